@@ -1,19 +1,33 @@
 # -*- coding: utf-8 -*-
 from app.config.env_func import reset_db_name
 from app.data.Client import Driver
+from app.data.ParquetResultSink import ParquetResultSink
 import sys
+import itertools
 import csv
 import app.config.env as env
 import json
 
 
+def get_records(collection, scenario):
+    if env.RESULT_SINK_FOLDER:
+        # results of a local run, read row group by row group
+        scenarios = [int(scenario)] if scenario is not None else None
+        if collection == ParquetResultSink.GLOBAL:
+            return ParquetResultSink.iter_rows(None, ParquetResultSink.GLOBAL, scenarios)
+        return ParquetResultSink.iter_details(None, scenarios)
+    # whole collections are streamed page by page
+    return Driver.get_results(collection, scenario) if scenario is not None else Driver.iter_results(collection)
+
+
 def write_in_csv(collection, scenario):
-    records = Driver.get_results(collection, scenario)
+    records = iter(get_records(collection, scenario))
+    first_record = next(records, None)
     output_file = "%s%s" % (env.OUTPUT_FOLDER, "%s.csv" % collection)
     with open(output_file, mode='w', newline='', encoding='utf-8') as output_file:
-        writer = csv.DictWriter(output_file, fieldnames=records[0].keys() if len(records) > 0 else ["empty"])
+        writer = csv.DictWriter(output_file, fieldnames=first_record.keys() if first_record is not None else ["empty"])
         writer.writeheader()
-        for record in records:
+        for record in itertools.chain([first_record] if first_record is not None else [], records):
             if "Moniker" in record and isinstance(record["Moniker"], list):
                 record["Moniker"] = json.dumps(record["Moniker"])
             writer.writerow(record)
@@ -26,6 +40,11 @@ if __name__ == "__main__":
     if options_len > 1:
         option = sys.argv[1]
         scenario = sys.argv[2] if options_len > 2 else ""
+    if option == "--parquet":
+        # results of a local run written in given folder, all of them or of one scenario
+        env.RESULT_SINK_FOLDER = scenario if scenario != "" else env.RESULT_SINK_FOLDER
+        scenario = sys.argv[3] if options_len > 3 else None
+        option = "--all" if scenario is None else "--one"
     if option == "--one":
         # global results
         write_in_csv("global", scenario)
@@ -20,9 +20,18 @@ CANVAS_URL = "http://10.21.98.21/canvas.xlsm"
 DB_NAME = None
 DB_HOST = "10.21.98.21"
 DB_PORT = 5006
+DB_MAX_POOL_SIZE = 100  # connections per process
+DB_MIN_POOL_SIZE = 0
+DB_WRITE_CONCERN = 1  # w option of writes, int or "majority"
+DB_RESULT_WRITE_CONCERN = 1  # w option of result workers writes
 
 DATA_SERVICE_ADD = "10.21.98.21"
 DATA_SERVICE_PORT = 5010
+DATA_SERVICE_BATCH_SIZE = 1000  # records fetched from db at once by streamed routes
+DATA_SERVICE_PAGE_SIZE = 10000  # records per page of Driver iterators
+DATA_SERVICE_FETCH_JOBS = 8  # concurrent requests of data loading
+DATA_CACHE = True  # local cache of data service responses, revalidated by ETag
+DATA_CACHE_FOLDER = APP_FOLDER + "cache/data/"
 
 
 # Results
@@ -31,11 +40,16 @@ DB_DETAILED_RESULT_COLLECTION_NAME = "detailed"
 DB_GLOBAL_RESULT_COLLECTION_NAME = "global"
 DB_GLOBAL_BEST_RESULT_COLLECTION_NAME = "global_best"
 DB_DETAILED_BEST_RESULT_COLLECTION_NAME = "detailed_best"
+DB_DETAILED_COLUMNAR_RESULT_COLLECTION_NAME = "detailed_columnar"
+DB_DETAILED_BEST_COLUMNAR_RESULT_COLLECTION_NAME = "detailed_best_columnar"
 DB_SENSITIVITY_COLLECTION_NAME = "sensitivity"
 RESULT_BATCHES_SIZE = 25
 HEAD_DATA_BITS = 17
 DB_NAME_BITS = 20
 RANDOMIZE_RESULTS = False
+RESULT_COMPRESSION = True  # zlib compression of result messages
+RESULT_BATCH_BYTES = 1 << 20  # maximum size of a result message before compression
+RESULT_LINGER = 0.5  # seconds before a partial result message is sent
 
 
 # RabbitMQ
@@ -46,6 +60,9 @@ RABBITMQ_DETAILED_RESULT_QUEUE_NAME = "SAVE_DETAIL"
 RABBITMQ_GLOBAL_RESULT_QUEUE_NAME = "SAVE_GLOBAL"
 RABBITMQ_MAX_WORKER = RABBITMQ_CYCLE
 RABBITMQ_PATH = "C:\\Program Files\\RabbitMQ Server\\rabbitmq_server-3.8.1\\sbin"
+RABBITMQ_RESULT_PREFETCH = 1000
+RABBITMQ_RESULT_FLUSH_SIZE = 500
+RABBITMQ_RESULT_FLUSH_INTERVAL = 1
 
 
 # Memcached
@@ -80,6 +97,9 @@ MONGO_SERVER_PATH = "C:\\Program Files\\MongoDB\\Server\\4.0\\bin"
 LOGISTICS_LP = False
 MODE_DEBUG = False
 GRANUL_RELAX = False
+SIMULATION_BATCH_SIZE = 0
+SENSITIVITY_ANALYTIC = True  # raw materials sensitivities of best scenarios from base volumes
+SENSITIVITY_JOBS = 1  # processes computing sensitivities of best scenarios, 0 for all cores
 
 
 class HTML_STATUS(IntEnum):
@@ -223,6 +243,35 @@ class ScenarioGeneratorType(IntEnum):
     FROM_OPTIONS = 1
     SPECIFIC_SCENARIOS = 2
 SCENARIO_GEN_TYPE = ScenarioGeneratorType.FROM_OPTIONS
+SCENARIO_GEN_LAZY = True
+
+class SimulationPartitioning(IntEnum):
+    STRIDED = 0
+    CONTIGUOUS = 1
+SIMULATION_PARTITIONING = SimulationPartitioning.STRIDED
+SIMULATION_CHUNKS_PER_PHASE = 1
+SIMULATION_JOBS = 0  # processes of Simulator.simulate_parallel, 0 for all cores
+SIMULATION_CHUNKS_PER_JOB = 4
+
+class GranulationCacheType(IntEnum):
+    NONE = 0
+    MEMCACHED = 1
+    DISK = 2
+GRANULATION_CACHE = GranulationCacheType.MEMCACHED
+GRANULATION_CACHE_FOLDER = APP_FOLDER + "cache/granulation/"
+GRANULATION_CACHE_TIMEOUT = 600
+
+class DetailedResultLayout(IntEnum):
+    ENTITY = 0  # one document per entity and scenario
+    COLUMNAR = 1  # one document per scenario, see ColumnarResults
+DETAILED_RESULT_LAYOUT = DetailedResultLayout.ENTITY
+
+DATA_SNAPSHOT = ""  # version of local data snapshot loaded instead of data service, "latest" for last saved
+DATA_SNAPSHOT_FOLDER = APP_FOLDER + "snapshot/"
+
+RESULT_SINK_FOLDER = ""  # Parquet results of a local run (Simulator sink_folder), read by dashboards and exports if set
+RESULT_SINK_ROW_GROUP_SIZE = 10000  # rows per row group of Parquet results
+RESULT_SINK_QUANTILE_STEP = 0.01  # Cost PV quantile step of scenarios detailed by dashboards from Parquet results
 
 PIPELINE_METADATA = {
     PipelineLayer.MINE: {
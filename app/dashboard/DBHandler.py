@@ -5,6 +5,7 @@ import datetime
 from bson import ObjectId
 from app.config.env_func import reset_db_name
 from app.data.DBAccess import DBAccess
+from app.data.ColumnarResults import ColumnarResults
 import app.config.env as env
 from pymongo import DESCENDING
 from app.data.Client import Driver
@@ -28,8 +29,9 @@ def get_best_global_scenarios(quantile_step):
         env.DB_GLOBAL_RESULT_COLLECTION_NAME,
         {}
     ).sort([("Cost PV", DESCENDING)])
-    step = int(quantile_step*scenarios.count())
-    representative_scenarios = [scenarios.skip(step*i)[0] for i in range(0, int(scenarios.count()/step))]
+    scenarios_count = db.count(env.DB_GLOBAL_RESULT_COLLECTION_NAME)
+    step = int(quantile_step*scenarios_count)
+    representative_scenarios = [scenarios.skip(step*i)[0] for i in range(0, int(scenarios_count/step))]
     db.save_to_db_no_check(env.DB_GLOBAL_BEST_RESULT_COLLECTION_NAME, representative_scenarios)
 
 
@@ -42,8 +44,9 @@ def get_best_detailed_scenarios(quantile_step):
         {"Cost PV": 1, "Scenario": 1},
         [("Cost PV", DESCENDING)]
     )
-    step = int(quantile_step*scenarios.count())
-    points = [scenarios.skip(step*i)[0]["Scenario"] for i in range(0, int(scenarios.count()/step))]
+    scenarios_count = db.count(env.DB_GLOBAL_RESULT_COLLECTION_NAME)
+    step = int(quantile_step*scenarios_count)
+    points = [scenarios.skip(step*i)[0]["Scenario"] for i in range(0, int(scenarios_count/step))]
     representative_scenarios = db.get_records(env.DB_DETAILED_RESULT_COLLECTION_NAME,
                                                    {"Scenario": {"$in": points}})
     db.save_to_db_no_check(env.DB_DETAILED_BEST_RESULT_COLLECTION_NAME, representative_scenarios)
@@ -55,7 +58,7 @@ def get_best_scenarios(quantile_step, db_name="mine2farm"):
         time_start = datetime.datetime.now().strftime("%d/%m/%y %H:%M:%S")
 
         # insert status of best scenarios "running"
-        db_history = DBAccess(env.MONITORING_DB_NAME)
+        db_history = DBAccess.get(env.MONITORING_DB_NAME)
         query_insert = {'time_start': time_start, 'db_name': db_name, 'quantile_step': quantile_step, 'status': -1}
         _id = db_history.save_to_db_no_check(env.MONITORING_COLLECTION_HISTORY_BEST_NAME, query_insert)
 
@@ -66,20 +69,27 @@ def get_best_scenarios(quantile_step, db_name="mine2farm"):
         logger.info("Deleting best collections from DB")
         db.clear_collection(env.DB_GLOBAL_BEST_RESULT_COLLECTION_NAME)
         db.clear_collection(env.DB_DETAILED_BEST_RESULT_COLLECTION_NAME)
+        db.clear_collection(env.DB_DETAILED_BEST_COLUMNAR_RESULT_COLLECTION_NAME)
         scenarios = db.get_records(
             env.DB_GLOBAL_RESULT_COLLECTION_NAME,
             {}
         ).sort([("Cost PV", DESCENDING)])
 
-        scenarios_count = scenarios.count()
+        scenarios_count = db.count(env.DB_GLOBAL_RESULT_COLLECTION_NAME)
         step = int(quantile_step * scenarios_count)
         # save to db
         if step == 0:
             # all scenarios are concerned
             logger.info("Moving all scenarios to best collections")
             db.copy_to_collection(env.DB_GLOBAL_RESULT_COLLECTION_NAME, env.DB_GLOBAL_BEST_RESULT_COLLECTION_NAME)
-            db.copy_to_collection(env.DB_DETAILED_RESULT_COLLECTION_NAME, env.DB_DETAILED_BEST_RESULT_COLLECTION_NAME)
-            details_count = db.count(env.DB_DETAILED_BEST_RESULT_COLLECTION_NAME)
+            if env.DETAILED_RESULT_LAYOUT == env.DetailedResultLayout.COLUMNAR:
+                db.copy_to_collection(env.DB_DETAILED_COLUMNAR_RESULT_COLLECTION_NAME,
+                                      env.DB_DETAILED_BEST_COLUMNAR_RESULT_COLLECTION_NAME)
+                details_count = db.count(env.DB_DETAILED_BEST_COLUMNAR_RESULT_COLLECTION_NAME)
+            else:
+                db.copy_to_collection(env.DB_DETAILED_RESULT_COLLECTION_NAME,
+                                      env.DB_DETAILED_BEST_RESULT_COLLECTION_NAME)
+                details_count = db.count(env.DB_DETAILED_BEST_RESULT_COLLECTION_NAME)
         else:
             # filter on specific scenarios
             representative_scenario_ids = [
@@ -90,12 +100,16 @@ def get_best_scenarios(quantile_step, db_name="mine2farm"):
             scenarios_global, scenarios_details = \
                 Simulator().simulate(scenarios_filter=representative_scenario_ids, logistics_lp=env.LOGISTICS_LP)
             # save
-            for scenario in scenarios_global:
-                db.save_to_db_no_check(env.DB_GLOBAL_BEST_RESULT_COLLECTION_NAME, scenarios_global[scenario])
+            db.save_to_db_no_check(env.DB_GLOBAL_BEST_RESULT_COLLECTION_NAME, scenarios_global.values())
+            details = []
             for scenario in scenarios_details:
                 json_data = json.dumps(NodeJSONEncoder().encode(scenarios_details[scenario]))
-                data = json.loads(json.loads(json_data))
-                db.save_to_db_no_check(env.DB_DETAILED_BEST_RESULT_COLLECTION_NAME, data)
+                details.extend(json.loads(json.loads(json_data)))
+            if env.DETAILED_RESULT_LAYOUT == env.DetailedResultLayout.COLUMNAR:
+                db.save_to_db_no_check(env.DB_DETAILED_BEST_COLUMNAR_RESULT_COLLECTION_NAME,
+                                       ColumnarResults.to_documents(details))
+            else:
+                db.save_to_db_no_check(env.DB_DETAILED_BEST_RESULT_COLLECTION_NAME, details)
             details_count = len(scenarios_details)
 
         # status update
@@ -117,11 +131,9 @@ def get_best_scenarios(quantile_step, db_name="mine2farm"):
         scenarios_dic = Utils.get_scenario_from_df(scenarios_df)
         risk_engine = RiskEngine()
 
-        for scenario_id in scenarios_dic:
-            deltas = risk_engine.compute_delta(scenarios_dic[scenario_id], shocks, with_logistics=env.LOGISTICS_LP)
-
-            deltas['Scenario'] = int(scenario_id)
-            db.save_to_db_no_check(env.DB_SENSITIVITY_COLLECTION_NAME, deltas)
+        deltas = risk_engine.compute_deltas(scenarios_dic, shocks, with_logistics=env.LOGISTICS_LP,
+                                            analytic=env.SENSITIVITY_ANALYTIC, n_jobs=env.SENSITIVITY_JOBS)
+        RiskEngine.save_deltas(db, deltas)
 
         # status update
         query_insert['time_end'] = datetime.datetime.now().strftime("%d/%m/%y %H:%M:%S")
@@ -2,11 +2,13 @@
 
 
 from app.data.DBAccess import DBAccess
+from app.data.ColumnarResults import ColumnarResults
 import app.config.env as env
 from pymongo import ASCENDING, DESCENDING
 from collections import defaultdict
-from app.tools.Logger import logger_dashboard as logger
 import numpy as np
+from app.tools.Logger import logger_dashboard as logger
+from app.tools import Discounting
 
 
 class DataHandler:
@@ -64,7 +66,7 @@ class OtherDataHandler(DataHandler):
                     data = {}
                     break
                 data = data[my_item]
-            histogram[item["Scenario"]] += np.npv(env.WACC, list(data.values()))
+            histogram[item["Scenario"]] += Discounting.npv(list(data.values()))
         points = []
         for key in histogram:
             #print("%s:%f" % (key, histogram[key]))
@@ -94,6 +96,64 @@ class OtherDataHandler(DataHandler):
         return bars
 
 
+class ColumnarDataHandler(DataHandler):
+    """
+    Reader of detailed results in columnar layout, as NumPy arrays
+    """
+
+    def __init__(self, collection=None):
+        """
+        ctor
+        :param collection: string, env.DB_DETAILED_COLUMNAR_RESULT_COLLECTION_NAME if None
+        """
+        super().__init__()
+        self.collection = env.DB_DETAILED_COLUMNAR_RESULT_COLLECTION_NAME if collection is None else collection
+
+    def get_scenario(self, scenario):
+        """
+        :param scenario: int, scenario id
+        :return: dictionary of arrays (see ColumnarResults.from_document), None if scenario is missing
+        """
+        document = self.db.get_one_record(self.collection, {"Scenario": scenario})
+        return ColumnarResults.from_document(document) if document is not None else None
+
+    def get_totals(self, items):
+        """
+        Yearly totals over entities of each scenario, only requested metric being fetched
+        :param items: path of metric, e.g. ["Opex"] or ["Consumption", "Raw water", "volume"]
+        :return: couple (np.array of scenario ids, np.array scenarios x years), years being union of scenarios years
+        """
+        kind = items[0]
+        mask = {"_id": 0, "Scenario": 1, "Layout": 1, "Years": 1, "Moniker": 1, "Cost PV": 1, kind: 1}
+        scenarios, rows = [], []
+        for document in self.db.get_records_with_mask(self.collection, {}, mask):
+            arrays = ColumnarResults.from_document(document)
+            if kind in ColumnarResults.VOLUMES:
+                volumes = arrays[kind]
+                if len(items) > 1 and items[1] in volumes["Items"]:
+                    values = volumes["Volumes"][volumes["Items"].index(items[1])].sum(axis=0)
+                else:
+                    values = np.zeros(len(arrays["Years"]))
+            else:
+                values = arrays[kind].sum(axis=0)
+            scenarios.append(arrays["Scenario"])
+            rows.append((arrays["Years"], values))
+
+        years = np.unique(np.concatenate([row_years for row_years, _ in rows])) if len(rows) > 0 else np.array([])
+        totals = np.zeros((len(rows), len(years)))
+        for total, (row_years, values) in zip(totals, rows):
+            total[np.searchsorted(years, row_years)] = values
+        return np.array(scenarios, dtype=int), totals
+
+    def get_histogram(self, items):
+        """
+        :param items: path of metric, see get_totals
+        :return: list of npv of yearly totals, one per scenario
+        """
+        _, totals = self.get_totals(items)
+        return list(Discounting.npv(totals)) if len(totals) > 0 else []
+
+
 def get_cost_pv_histogram():
     return CostPVDataHandler().get_histogram(), "$" #TODO: get the right unit
 
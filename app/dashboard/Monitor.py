@@ -82,8 +82,9 @@ def check_worker():
     count_worker = check_max_worker(env.RABBITMQ_SIMULATOR_QUEUE_NAME)
 
     for phase in range(env.RABBITMQ_CYCLE):
-        if memcached_client.get("workers_info_%i" % phase):
-            workers_info[phase] = memcached_client.get("workers_info_%i" % phase)[str(phase)]
+        phase_info = get_workers_info(phase)
+        if phase_info:
+            workers_info[phase] = phase_info
     return jsonify(workersInfo=workers_info, list_queues=list_queues, consumers=consumers,
                    best_scenarios_status=best_scenarios_status, db_names=db_names,
                    worker_global_result=worker_global_result,
@@ -100,7 +101,7 @@ def get_history(context=None):
     :return: JSON
     """
     if request.json['current_page'] and request.json['nb_pr_page']:
-        db = DBAccess(env.MONITORING_DB_NAME)
+        db = DBAccess.get(env.MONITORING_DB_NAME)
         if context == 'best':
             collection = env.MONITORING_COLLECTION_HISTORY_BEST_NAME
         else:
@@ -15,6 +15,7 @@ import json
 import plotly.graph_objs as go
 import app.dashboard.DataHandler as dh
 from app.data.Client import Driver
+from app.data.ParquetResultSink import ParquetResultSink
 from app.tools.Utils import make_list
 from app.risk.RiskEngine import RiskEngine
 import locale
@@ -22,7 +23,12 @@ import app.tools.Utils as Utils
 locale.setlocale(locale.LC_ALL, 'German')
 
 # Data
-if env.DB_LOAD_FROM_SERVICE:
+if env.RESULT_SINK_FOLDER:
+    # results of a local run, scenarios at each quantile step being detailed
+    scenarios_df = ParquetResultSink.get_representative_scenarios(ParquetResultSink.read_global(),
+                                                                  env.RESULT_SINK_QUANTILE_STEP)
+    scenario_detailed_df = pd.DataFrame(ParquetResultSink.iter_details(scenarios=scenarios_df["Scenario"].tolist()))
+elif env.DB_LOAD_FROM_SERVICE:
     scenarios_df = pd.DataFrame(Driver().get_results(env.DB_GLOBAL_BEST_RESULT_COLLECTION_NAME))
     scenario_detailed_df = pd.DataFrame(Driver().get_results(env.DB_DETAILED_BEST_RESULT_COLLECTION_NAME))
 else:
@@ -45,6 +51,8 @@ def get_capex_Opex(scenario_id, year_id):
     water_unit = ""
     electricity_unit = ""
     gypsum_unit = ""
+    if env.DETAILED_RESULT_LAYOUT == env.DetailedResultLayout.COLUMNAR and not env.RESULT_SINK_FOLDER:
+        return get_capex_opex_columnar(scenario_id, year_id)
     scenario = scenario_detailed_df[scenario_detailed_df["Scenario"] == scenario_id]
     for scenario_item in range(0, len(scenario)):
         try:
@@ -73,6 +81,27 @@ def get_capex_Opex(scenario_id, year_id):
     return capex_value, opex_value, water, electricity, gypsum, water_unit, electricity_unit, gypsum_unit
 
 
+def get_capex_opex_columnar(scenario_id, year_id):
+    """ get_capex_Opex on best detailed results in columnar layout, summed over entities with NumPy """
+    arrays = dh.ColumnarDataHandler(env.DB_DETAILED_BEST_COLUMNAR_RESULT_COLLECTION_NAME).get_scenario(scenario_id)
+    if arrays is None or int(year_id) not in arrays["Years"]:
+        return 0, 0, 0, 0, 0, "", "", ""
+    year = list(arrays["Years"]).index(int(year_id))
+
+    def get_volume(kind, item):
+        volumes = arrays[kind]
+        if item not in volumes["Items"]:
+            return 0, ""
+        i = volumes["Items"].index(item)
+        return volumes["Volumes"][i, :, year].sum(), volumes["Units"][i] or ""
+
+    water, water_unit = get_volume("Consumption", "Raw water")
+    electricity, electricity_unit = get_volume("Consumption", "Electricity")
+    gypsum, gypsum_unit = get_volume("Production", "Gypsum")
+    return arrays["Capex"][:, year].sum(), arrays["Opex"][:, year].sum(), water, electricity, gypsum, water_unit, \
+        electricity_unit, gypsum_unit
+
+
 # raw_material_sensitivity
 
 
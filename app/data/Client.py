@@ -1,16 +1,69 @@
 # -*- coding: utf-8 -*-
 
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 
+import app.config.env as env
 from app.config.env_func import get_service_url
+from app.data.ResponseCache import ResponseCache
 
 
 class Driver:
+    SESSIONS = {}  # process id -> requests.Session, connections of a parent process not being reused after fork
+
+    @staticmethod
+    def get_session():
+        """
+        :return: requests.Session of current process, keeping connections to data service alive
+        """
+        session = Driver.SESSIONS.get(os.getpid())
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=max(env.DATA_SERVICE_FETCH_JOBS, 1))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            Driver.SESSIONS = {os.getpid(): session}
+        return session
+
+    @staticmethod
+    def fetch(url):
+        """
+        GET json document, revalidated by ETag against local response cache if env.DATA_CACHE
+        :param url: String
+        :return: json document
+        """
+        cached = ResponseCache.get(url) if env.DATA_CACHE else None
+        headers = {"If-None-Match": cached[0]} if cached is not None else None
+        response = Driver.get_session().get(url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            return json.loads(cached[1])
+        etag = response.headers.get("ETag")
+        if env.DATA_CACHE and etag is not None and response.status_code == 200:
+            ResponseCache.put(url, etag, response.content)
+        return response.json()
+
     @staticmethod
     def get_data(name):
         data_service_url = get_service_url(context="data")
         url = "%s%s" % (data_service_url, name)
-        return requests.get(url).json()
+        return Driver.fetch(url)
+
+    @staticmethod
+    def get_many_data(names, n_jobs=None):
+        """
+        Concurrent get_data
+        :param names: list of collection names
+        :param n_jobs: int, # of concurrent requests, env.DATA_SERVICE_FETCH_JOBS if None
+        :return: list of json documents, in names order
+        """
+        n_jobs = env.DATA_SERVICE_FETCH_JOBS if n_jobs is None else n_jobs
+        if n_jobs <= 1 or len(names) <= 1:
+            return [Driver.get_data(name) for name in names]
+        with ThreadPoolExecutor(min(n_jobs, len(names))) as executor:
+            return list(executor.map(Driver.get_data, names))
 
     @staticmethod
     def get_results(collection, filter=None):
@@ -19,4 +72,52 @@ class Driver:
             url = "%s%s" % (results_service_url, collection)
         else:
             url = "%s%s/%s" % (results_service_url, collection, filter)
-        return requests.get(url).json()
+        return Driver.get_session().get(url).json()
+
+    @staticmethod
+    def iter_records(context, collection, filter=None, fields=None, sort="_id", order=1, page_size=None):
+        """
+        Iterates over records of collection with keyset pagination, each page being streamed as ndjson
+        :param context: string, data or results
+        :param collection: string
+        :param filter: dictionary, mongo query
+        :param fields: list of fields, all fields if None
+        :param sort: string, sort key
+        :param order: int, 1 ascending, -1 descending
+        :param page_size: int, records per request, env.DATA_SERVICE_PAGE_SIZE if None
+        :return: generator of records, without _id
+        """
+        page_size = env.DATA_SERVICE_PAGE_SIZE if page_size is None else page_size
+        url = "%s%s/" % (get_service_url(context=context), collection)
+        params = {"format": "ndjson", "sort": sort, "order": order, "limit": page_size}
+        if filter is not None:
+            params["filter"] = json.dumps(filter)
+        if fields is not None:
+            params["fields"] = ",".join(set(fields) | {sort} - {"_id"})
+        while True:
+            count = 0
+            with Driver.get_session().get(url, params=params, stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if len(line) == 0:
+                        continue
+                    record = json.loads(line)
+                    count += 1
+                    params["after_id"] = record.pop("_id")
+                    if sort != "_id":
+                        params["after"] = json.dumps(record.get(sort))
+                    if fields is not None and sort not in fields:
+                        record.pop(sort, None)
+                    yield record
+            if page_size <= 0 or count < page_size:
+                break
+
+    @staticmethod
+    def iter_results(collection, filter=None, fields=None, sort="_id", order=1, page_size=None):
+        """ iter_records on results database """
+        return Driver.iter_records("results", collection, filter, fields, sort, order, page_size)
+
+    @staticmethod
+    def iter_data(name, filter=None, fields=None, sort="_id", order=1, page_size=None):
+        """ iter_records on data database """
+        return Driver.iter_records("data", name, filter, fields, sort, order, page_size)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+from app.tools.Logger import logger_results as logger
+
+
+class ColumnarResults:
+    """
+    Columnar layout of detailed results: one document per scenario instead of one per entity.
+    Entity attributes are lists in entities order; yearly metrics are float64 little-endian binaries aligned on Years:
+    (entities x years) for Capacity, Opex and Capex, (items x entities x years) for Consumption and Production volumes,
+    missing values being 0
+    """
+
+    LAYOUT = 1
+    DTYPE = "<f8"
+    ATTRIBUTES = ["Moniker", "Layer", "Name", "Location", "Cost PV"]
+    METRICS = ["Capacity", "Opex", "Capex"]
+    VOLUMES = ["Consumption", "Production"]
+
+    @staticmethod
+    def to_series(values):
+        """
+        :param values: pd.Series, dictionary {year: value} (years possibly as strings), or None
+        :return: pd.Series indexed by int years
+        """
+        if values is None:
+            return pd.Series(dtype=float)
+        if not isinstance(values, pd.Series):
+            values = pd.Series(values, dtype=float)
+        if len(values) > 0 and not pd.api.types.is_integer_dtype(values.index):
+            values = pd.Series(values.values, index=values.index.astype(int))
+        return values
+
+    @staticmethod
+    def to_document(scenario_id, results):
+        """
+        :param scenario_id: int
+        :param results: list of detailed results of entities, with pd.Series or dictionaries {year: value}
+        :return: dictionary, columnar document of scenario
+        """
+        metrics = {metric: [ColumnarResults.to_series(result.get(metric)) for result in results]
+                   for metric in ColumnarResults.METRICS}
+        volumes = {kind: [{item: (ColumnarResults.to_series(volume["volume"]), volume.get("unit"))
+                           for item, volume in (result.get(kind) or {}).items()} for result in results]
+                   for kind in ColumnarResults.VOLUMES}
+
+        years = set()
+        for series in metrics.values():
+            for values in series:
+                years.update(values.index)
+        for entities in volumes.values():
+            for entity in entities:
+                for values, _ in entity.values():
+                    years.update(values.index)
+        years = sorted(int(year) for year in years)
+        positions = {year: i for i, year in enumerate(years)}
+
+        def fill(row, values):
+            if len(values) > 0:
+                row[[positions[year] for year in values.index]] = values.values
+
+        document = {"Scenario": int(scenario_id), "Layout": ColumnarResults.LAYOUT, "Years": years}
+        for attribute in ColumnarResults.ATTRIBUTES:
+            document[attribute] = [result.get(attribute) for result in results]
+        for metric, series in metrics.items():
+            matrix = np.zeros((len(results), len(years)))
+            for row, values in zip(matrix, series):
+                fill(row, values)
+            document[metric] = matrix.astype(ColumnarResults.DTYPE).tobytes()
+        for kind, entities in volumes.items():
+            items, units = [], []
+            for entity in entities:
+                for item, (_, unit) in entity.items():
+                    if item not in items:
+                        items.append(item)
+                        units.append(unit)
+            matrix = np.zeros((len(items), len(results), len(years)))
+            for e, entity in enumerate(entities):
+                for item, (values, _) in entity.items():
+                    fill(matrix[items.index(item), e], values)
+            document[kind] = {"Items": items, "Units": units,
+                              "Volumes": matrix.astype(ColumnarResults.DTYPE).tobytes()}
+        return document
+
+    @staticmethod
+    def to_documents(results):
+        """
+        :param results: list of detailed results of entities, each with its Scenario
+        :return: list of columnar documents, one per scenario
+        """
+        scenarios = {}
+        for result in results:
+            scenarios.setdefault(result["Scenario"], []).append(result)
+        return [ColumnarResults.to_document(scenario_id, scenario_results)
+                for scenario_id, scenario_results in scenarios.items()]
+
+    @staticmethod
+    def from_document(document):
+        """
+        :param document: dictionary, columnar document, possibly projected (with at least Layout, Years and Moniker)
+        :return: dictionary with Scenario, Years (np.array), entity attributes (lists, Cost PV as np.array),
+        metrics (np.array entities x years), and for Consumption and Production {"Items", "Units",
+        "Volumes": np.array items x entities x years}
+        """
+        if document.get("Layout") != ColumnarResults.LAYOUT:
+            logger.error("Detailed results of scenario %s are not in columnar layout" % document.get("Scenario"))
+            raise Exception("Detailed results are not in columnar layout")
+        years = np.array(document["Years"], dtype=int)
+        entities = len(document["Moniker"])
+        arrays = {"Scenario": document["Scenario"], "Years": years}
+        for attribute in ColumnarResults.ATTRIBUTES:
+            if attribute in document:
+                arrays[attribute] = document[attribute]
+        if "Cost PV" in document:
+            arrays["Cost PV"] = np.array(document["Cost PV"], dtype=float)
+        # metrics left out of a projection are skipped
+        for metric in ColumnarResults.METRICS:
+            if metric in document:
+                arrays[metric] = np.frombuffer(document[metric], dtype=ColumnarResults.DTYPE).reshape(entities,
+                                                                                                     len(years))
+        for kind in ColumnarResults.VOLUMES:
+            if kind not in document:
+                continue
+            items = document[kind]["Items"]
+            arrays[kind] = {
+                "Items": items,
+                "Units": document[kind]["Units"],
+                "Volumes": np.frombuffer(document[kind]["Volumes"], dtype=ColumnarResults.DTYPE).reshape(
+                    len(items), entities, len(years)),
+            }
+        return arrays
@@ -2,23 +2,63 @@
 
 
 from pymongo import MongoClient
+from pymongo.write_concern import WriteConcern
 import math
+import os
+import threading
 from app.tools.Logger import logger_datamanager as logger
 from app.config import env
 
-MONGO_CLIENT = MongoClient(host=env.DB_HOST, port=env.DB_PORT)
-
 
 class DBAccess:
-    def __init__(self, name):
+    # per process client and handles, MongoClient not being fork safe
+    CLIENT = None
+    CLIENT_PID = None
+    HANDLES = {}  # (db name, write concern) -> DBAccess
+    LOCK = threading.Lock()
+
+    def __init__(self, name, write_concern=None):
         """
-        Constructor
+        Constructor, prefer DBAccess.get to reuse handles
+        :param name: string, database name
+        :param write_concern: w option of writes (int or "majority"), env.DB_WRITE_CONCERN if None
         """
         if name is None:
             msg = "Database name is not defined!"
             logger.error(msg)
             raise Exception(msg)
-        self.db = MONGO_CLIENT[name]
+        write_concern = env.DB_WRITE_CONCERN if write_concern is None else write_concern
+        self.db = DBAccess.get_client().get_database(name, write_concern=WriteConcern(w=write_concern))
+
+    @staticmethod
+    def get_client():
+        """
+        :return: MongoClient of current process, pooling connections
+        """
+        if DBAccess.CLIENT is None or DBAccess.CLIENT_PID != os.getpid():
+            with DBAccess.LOCK:
+                if DBAccess.CLIENT is None or DBAccess.CLIENT_PID != os.getpid():
+                    DBAccess.HANDLES = {}
+                    DBAccess.CLIENT = MongoClient(host=env.DB_HOST, port=env.DB_PORT,
+                                                  maxPoolSize=env.DB_MAX_POOL_SIZE, minPoolSize=env.DB_MIN_POOL_SIZE)
+                    DBAccess.CLIENT_PID = os.getpid()
+        return DBAccess.CLIENT
+
+    @staticmethod
+    def get(name, write_concern=None):
+        """
+        Handle of database, shared in process
+        :param name: string, database name
+        :param write_concern: w option of writes (int or "majority"), env.DB_WRITE_CONCERN if None
+        :return: DBAccess
+        """
+        write_concern = env.DB_WRITE_CONCERN if write_concern is None else write_concern
+        DBAccess.get_client()
+        handle = DBAccess.HANDLES.get((name, write_concern))
+        if handle is None:
+            handle = DBAccess(name, write_concern)
+            DBAccess.HANDLES[(name, write_concern)] = handle
+        return handle
 
     @staticmethod
     def get_dbs_names():
@@ -26,7 +66,7 @@ class DBAccess:
         Get all dbs names
         :return: list
         """
-        cursor = MONGO_CLIENT.list_database_names()
+        cursor = DBAccess.get_client().list_database_names()
         names = []
         for db in cursor:
             names.append(db)
@@ -50,7 +90,27 @@ class DBAccess:
         self.db[collection].create_index(index)
 
     def save_to_db_no_check(self, collection, records):
-        return self.db[collection].insert(records, check_keys=False)
+        """
+        Insert records without validity check
+        :param collection: string
+        :param records: dictionary, or iterable of dictionaries inserted in one bulk
+        :return: inserted id, or list of inserted ids
+        """
+        if isinstance(records, dict):
+            return self.db[collection].insert_one(records).inserted_id
+        records = list(records)
+        if len(records) == 0:
+            return []
+        return self.db[collection].insert_many(records).inserted_ids
+
+    def save_many_unordered(self, collection, records):
+        """
+        Bulk insert in one round trip, server being free to write documents in any order
+        :param collection: string
+        :param records: list of dictionaries
+        :return: list of inserted ids
+        """
+        return self.db[collection].insert_many(records, ordered=False).inserted_ids
 
     def save_to_db(self, collection, records):
         """
@@ -75,7 +135,8 @@ class DBAccess:
                 if check_if_valid:
                     records_to_save.append(record)
                     break
-        self.db[collection].insert_many(records_to_save)
+        if len(records_to_save) > 0:
+            self.db[collection].insert_many(records_to_save)
 
     def get_all_records(self, collection):
         """
@@ -83,7 +144,7 @@ class DBAccess:
         :param collection: string
         :return: list, integer
         """
-        return list(self.db[collection].find()), self.db[collection].count()
+        return list(self.db[collection].find()), self.db[collection].estimated_document_count()
 
     def get_records(self, collection, filter_):
         """
@@ -94,6 +155,35 @@ class DBAccess:
         """
         return self.db[collection].find(filter_)
 
+    def get_cursor(self, collection, filter_=None, projection=None, sort=None, limit_=0, batch_size=0):
+        """
+        Cursor over records, fetched from server by batches while iterating
+        :param collection: string
+        :param filter_: Dictionary
+        :param projection: Dictionary, all fields if None
+        :param sort: list of couples (key, direction)
+        :param limit_: integer, no limit if 0
+        :param batch_size: integer, server default if 0
+        :return: Cursor
+        """
+        cursor = self.db[collection].find({} if filter_ is None else filter_, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit_ > 0:
+            cursor = cursor.limit(limit_)
+        if batch_size > 0:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
+
+    def get_version(self, collection):
+        """
+        Version of collection content, changed by inserts and reloads (ids being increasing), not by in place updates
+        :param collection: string
+        :return: string
+        """
+        last = self.db[collection].find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        return "%d-%s" % (self.db[collection].estimated_document_count(), last["_id"] if last is not None else "")
+
     def get_records_with_mask(self, collection, filter_, mask):
         """
         Get a collection from db
@@ -138,7 +228,8 @@ class DBAccess:
         :param limit_: limit value
         :return: tuple
         """
-        return self.db[collection].find({}, filter_).sort([[sort_key, sort_direction]]).limit(limit_), self.db[collection].count()
+        return self.db[collection].find({}, filter_).sort([(sort_key, sort_direction)]).limit(limit_), \
+            self.db[collection].estimated_document_count()
 
     def get_records_with_pagination(self, collection,  filter_, sort_key, sort_direction, current_page, nb_pr_page):
         """
@@ -152,8 +243,9 @@ class DBAccess:
         :return: tuple
         """
         skips = nb_pr_page * (current_page-1)
-        total_items = self.db[collection].count()
-        return self.db[collection].find({}, filter_).skip(skips).sort([[sort_key, sort_direction]]).limit(nb_pr_page), total_items
+        total_items = self.db[collection].estimated_document_count()
+        return self.db[collection].find({}, filter_).skip(skips).sort([(sort_key, sort_direction)]).limit(nb_pr_page), \
+            total_items
 
     def update_record(self, collection,  filter_, data):
         """
@@ -163,7 +255,7 @@ class DBAccess:
         :param data: dict
         :return: String
         """
-        self.db[collection].update(filter_, {'$set': data})
+        self.db[collection].update_one(filter_, {'$set': data})
 
     def delete_record(self,  collection,  filter_):
         """
@@ -187,10 +279,13 @@ class DBAccess:
         ]
         self.db[source].aggregate(pipeline)
 
-    def count(self, collection):
+    def count(self, collection, filter_=None):
         """
-        Count of collection
+        Count of collection, from collection metadata if there is no filter
         :param collection: string
+        :param filter_: Dictionary
         :return: integer
         """
-        return self.db[collection].count()
+        if not filter_:
+            return self.db[collection].estimated_document_count()
+        return self.db[collection].count_documents(filter_)
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 from functools import reduce
 
+import numpy as np
 import pandas as pd
 import app.config.env as env
 from app.data.Client import Driver
+from app.data.DataSnapshot import DataSnapshot
+from app.data.TableIndex import TableIndex
 from app.tools.Utils import production_header
 from app.tools.Logger import logger_datamanager as logger
 
@@ -21,14 +24,56 @@ class DataManager:
         self.raw_materials = None
         self.sales_plan = None
 
-    def load_data(self):
+    def load_data(self, snapshot=None):
         """
-        Load data from Driver and transform it
+        Load data from Driver and transform it, or from a local snapshot
+        :param snapshot: String, version of local snapshot to load ('latest' for last saved one), env.DATA_SNAPSHOT
+        if None, data service is used if empty
         :return: None
         """
+        snapshot = env.DATA_SNAPSHOT if snapshot is None else snapshot
+        if snapshot:
+            self.load_snapshot(snapshot)
+            return
         self.load_original_data()
         self.transform_data()
 
+    def save_snapshot(self, folder=None):
+        """
+        Export transformed data to a versioned local snapshot
+        :param folder: String, env.DATA_SNAPSHOT_FOLDER if None
+        :return: String, snapshot version
+        """
+        return DataSnapshot.save(self, folder)
+
+    def load_snapshot(self, version=None, folder=None, verify=False):
+        """
+        Load transformed data from a local snapshot, without data service
+        :param version: String, snapshot version, last saved one if None or 'latest'
+        :param folder: String, env.DATA_SNAPSHOT_FOLDER if None
+        :param verify: boolean, check file digests against snapshot manifest
+        :return: String, loaded version
+        """
+        version = DataSnapshot.load(self, version, folder, verify)
+        self.build_indexes()
+        return version
+
+    def build_indexes(self):
+        """
+        Build per moniker indexes of entity tables, and (Moniker, Product, Input, Item) indexes of specific
+        consumptions, used by entities instead of filtering whole tables
+        :return: None
+        """
+        TableIndex.clear()
+        for layer in self.data:
+            for kind in ["SpecCons", "SpecProd", "Capex"]:
+                df = self.data[layer].get(kind)
+                if df is None:
+                    continue
+                TableIndex.of(df)
+                if kind == "SpecCons" and all(key in df.columns for key in TableIndex.SPEC_CONS_KEYS):
+                    TableIndex.of(df, TableIndex.SPEC_CONS_KEYS)
+
     def load_original_data(self):
         """
         Load original data
@@ -37,6 +82,8 @@ class DataManager:
         if len(self.original_data) > 0:
             raise Exception("Original data already loaded")
 
+        # collections of all layers are fetched concurrently, then placed in schema order
+        names = []
         for layer in env.PipelineLayer:
             if layer in [env.PipelineLayer.UNDEFINED, env.PipelineLayer.MINE_BENEFICIATION]:
                 continue
@@ -48,16 +95,22 @@ class DataManager:
                     continue
                 #TODO: instead of "dico" find a more generic way
                 if key == "dico":
-                    collections = []
-                    for url in value:
-                        collections.append(Driver.get_data(url))
-                    self.original_data[layer][key] = collections
+                    self.original_data[layer][key] = [None] * len(value)
+                    names.extend(((layer, key, i), url) for i, url in enumerate(value))
                     continue
                 #TODO: instead of "type" find a more generic way
                 if key == "type":
                     self.original_data[layer][key] = value
                     continue
-                self.original_data[layer][key] = Driver.get_data(value)
+                self.original_data[layer][key] = None
+                names.append(((layer, key, None), value))
+
+        collections = Driver.get_many_data([name for _, name in names])
+        for (layer, key, i), collection in zip([place for place, _ in names], collections):
+            if i is None:
+                self.original_data[layer][key] = collection
+            else:
+                self.original_data[layer][key][i] = collection
 
     def bump_raw_materials(self, shocks):
         """
@@ -83,8 +136,10 @@ class DataManager:
             raise Exception("Data already transformed")
 
         convlayer = self.original_data[env.PipelineLayer.UNIT_CONVERSION_MATRIX]
-        unitmatrix = pd.DataFrame(convlayer['data'])
+        unit_lookup = DataManager.get_unit_lookup(pd.DataFrame(convlayer['data']))
 
+        # tables to convert, as (table key, converted columns: None for all numeric columns but Capacity)
+        conversions = []
         for layer in self.original_data:
             if layer not in env.PIPELINE_METADATA:
                 continue
@@ -98,42 +153,39 @@ class DataManager:
             if layer == env.PipelineLayer.RAW_MATERIALS:
                 self.raw_materials = DataManager.melt_without_moniker(pd.DataFrame(original_data["data"]),
                                                                       "price", headers)
-                self.raw_materials = DataManager.merge_rawmat_unit_data(unitmatrix, self.raw_materials)
+                conversions.append(("raw_materials", ["price"]))
 
             elif layer == env.PipelineLayer.SALES_PLAN:
                 self.sales_plan = DataManager.melt_without_moniker(pd.DataFrame(original_data["data"]),
                                                                    "volume", headers)
-                self.sales_plan = DataManager.merge_salesplan_unit_data(unitmatrix, self.sales_plan)
+                conversions.append(("sales_plan", ["volume"]))
 
             else:
                 self.data[layer] = {}
                 # handling options
                 options = pd.DataFrame(original_data["options"])
                 self.data[layer]["Options"] = options[(options["Moniker"] != "") & (~options["Moniker"].isna())]
-                self.data[layer]["Options"] = DataManager.merge_options_unit_data(unitmatrix,
-                                                                                  self.data[layer]["Options"])
+                conversions.append(((layer, "Options"), ["Capacity"]))
 
                 # handling opex/specific consumptions
                 opexs = pd.DataFrame(original_data["opex"])
                 self.data[layer]["SpecCons"] = DataManager.melt_and_include_moniker(opexs, "opex", "sc/opex", options,
                                                                                     headers)
-                self.data[layer]["SpecCons"] = DataManager.merge_sc_opex_unit_data(unitmatrix,
-                                                                                   self.data[layer]["SpecCons"])
+                conversions.append(((layer, "SpecCons"), None))
 
                 # handling specific production
                 if headers["type"] == env.PipelineType.PRODUCER:
                     self.data[layer]["SpecProd"] = DataManager.melt_and_include_moniker(
                         pd.DataFrame(original_data["production"]), "production", production_header(layer), options,
                         headers)
-                    self.data[layer]["SpecProd"] = DataManager.merge_sc_opex_unit_data(unitmatrix,
-                                                                                     self.data[layer]["SpecProd"])
+                    conversions.append(((layer, "SpecProd"), None))
                 else:
                     self.data[layer]["SpecProd"] = None
 
                 # handling capex
                 self.data[layer]["Capex"] = DataManager.melt_and_include_moniker(pd.DataFrame(original_data["capex"]),
                                                                                  "capex", "capex", options, headers)
-                self.data[layer]["Capex"] = DataManager.merge_capex_unit_data(unitmatrix, self.data[layer]["Capex"])
+                conversions.append(((layer, "Capex"), ["CAPEX"]))
 
                 # Adding priority mines to data for mine layer
                 if layer == env.PipelineLayer.MINE:
@@ -145,6 +197,87 @@ class DataManager:
                 if layer in [env.PipelineLayer.SAP, env.PipelineLayer.PAP]:
                     self.data[layer]["product_type"] = pd.DataFrame(original_data['product_type']).set_index('Product').to_dict()['Type']
 
+        # convert units of all tables at once, after checking all units
+        DataManager.check_units(unit_lookup, [self.get_table(key) for key, _ in conversions])
+        for key, columns in conversions:
+            self.set_table(key, DataManager.convert_units(unit_lookup, self.get_table(key), columns))
+        self.build_indexes()
+
+    def get_table(self, key):
+        """
+        :param key: String (raw_materials or sales_plan) or couple (layer, table name)
+        :return: Dataframe
+        """
+        return getattr(self, key) if isinstance(key, str) else self.data[key[0]][key[1]]
+
+    def set_table(self, key, df):
+        """
+        :param key: String (raw_materials or sales_plan) or couple (layer, table name)
+        :param df: Dataframe
+        :return: None
+        """
+        if isinstance(key, str):
+            setattr(self, key, df)
+        else:
+            self.data[key[0]][key[1]] = df
+
+    @staticmethod
+    def get_unit_lookup(convmatrixdf):
+        """
+        :param convmatrixdf: Dataframe, unit conversion matrix
+        :return: Dataframe indexed by unit, with columns Uniform Unit, Conversion Rate and Order (row in matrix)
+        """
+        if 'Unit' not in convmatrixdf.columns:
+            error_msg = "Unit column is missing in conversion matrix: %s" % list(convmatrixdf.columns)
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        lookup = convmatrixdf[['Unit', 'Uniform Unit', 'Conversion Rate']].copy()
+        lookup['Order'] = np.arange(len(lookup))
+        return lookup.drop_duplicates('Unit').set_index('Unit')
+
+    @staticmethod
+    def check_units(unit_lookup, targetdfs):
+        """
+        Checks units of all tables, reporting all unknown units at once
+        :param unit_lookup: Dataframe, from get_unit_lookup
+        :param targetdfs: list of Dataframes to be converted
+        :return: None
+        """
+        missing_columns = [list(targetdf.columns) for targetdf in targetdfs if 'Unit' not in targetdf.columns]
+        if len(missing_columns) > 0:
+            error_msg = "Unit column is missing in tables: %s" % missing_columns
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        unknown_units = set()
+        for targetdf in targetdfs:
+            units = targetdf['Unit'].unique()
+            unknown_units.update(units[~pd.Index(units).isin(unit_lookup.index)])
+        if len(unknown_units) > 0:
+            error_msg = "These units are not handled by the canvas: %s" % sorted(str(unit) for unit in unknown_units)
+            logger.error(error_msg)
+            raise Exception(error_msg)
+
+    @staticmethod
+    def convert_units(unit_lookup, targetdf, columns=None):
+        """
+        Converts values to uniform units, rows being grouped by unit in conversion matrix order
+        :param unit_lookup: Dataframe, from get_unit_lookup
+        :param targetdf: Dataframe with a Unit column, units being checked
+        :param columns: list of columns to convert, all numeric columns but Capacity if None
+        :return: converted Dataframe
+        """
+        if columns is None:
+            columns = [column for column in targetdf._get_numeric_data().columns if column != 'Capacity']
+        positions = unit_lookup.index.get_indexer(targetdf['Unit'])
+        order = np.argsort(unit_lookup['Order'].values[positions], kind='stable')
+        positions = positions[order]
+        df = targetdf.iloc[order]
+        df = df[['Unit'] + [column for column in df.columns if column != 'Unit']]
+        rates = unit_lookup['Conversion Rate'].values[positions]
+        for column in columns:
+            df[column] = df[column].values * rates
+        df['Unit'] = unit_lookup['Uniform Unit'].values[positions]
+        return df
 
     @staticmethod
     def melt_and_include_moniker(df_, metadata, value_name, df2, headers):
@@ -174,130 +307,3 @@ class DataManager:
             rename(columns={"value": value_name}).set_index("Tenor")
         df.index = pd.to_numeric(df.index)
         return df.sort_index(ascending=True)
-
-    @staticmethod
-    def merge_salesplan_unit_data(convmatrixdf, targetdf):
-        # unit conversion fct takes as argument the conversion matrix df & the target df to be treated
-
-        if 'Unit' in convmatrixdf.columns and 'Unit' in targetdf.columns:
-            unittest = targetdf['Unit'].isin(convmatrixdf['Unit'])
-            if unittest[unittest.isin([False])].empty:
-                df3 = pd.merge(convmatrixdf, targetdf, on='Unit', left_index=True)
-                df3['volume'] = df3['volume'] * df3['Conversion Rate']
-                df3['Unit'] = df3['Uniform Unit']
-                df3 = df3.drop(columns=['Uniform Unit', 'Conversion Rate'])
-                return df3
-            else:
-                error_msg = "This unit is not handled by the canvas: %s" % targetdf['Unit'][
-                    targetdf['Unit'].isin(convmatrixdf['Unit']) is False]
-                logger.error(error_msg)
-                raise Exception(error_msg)
-
-        else:
-            if 'Unit' not in convmatrixdf.columns:
-                error_msg = "Unit column is missing in conversion matrix: %s" % list(convmatrixdf.columns)
-            else:
-                error_msg = "Unit column is missing in table: %s" % list(targetdf.columns)
-            logger.error(error_msg)
-            raise Exception(error_msg)
-
-    @staticmethod
-    def merge_rawmat_unit_data(convmatrixdf, targetdf):
-        # unit conversion fct takes as argument the conversion matrix df & the target df to be treated
-
-        if 'Unit' in convmatrixdf.columns and 'Unit' in targetdf.columns:
-            unittest = targetdf['Unit'].isin(convmatrixdf['Unit'])
-            if unittest[unittest.isin([False])].empty:
-                df3 = pd.merge(convmatrixdf, targetdf, on='Unit', left_index=True)
-                df3['price'] = df3['price'] * df3['Conversion Rate']
-                df3['Unit'] = df3['Uniform Unit']
-                df3 = df3.drop(columns=['Uniform Unit', 'Conversion Rate'])
-                return df3
-            else:
-                error_msg = "This unit is not handled by the canvas: %s" % targetdf['Unit'][
-                    targetdf['Unit'].isin(convmatrixdf['Unit']) is False]
-                logger.error(error_msg)
-                raise Exception(error_msg)
-
-        else:
-            if 'Unit' not in convmatrixdf.columns:
-                error_msg = "Unit column is missing in conversion matrix: %s" % list(convmatrixdf.columns)
-            else:
-                error_msg = "Unit column is missing in table: %s" % list(targetdf.columns)
-            logger.error(error_msg)
-            raise Exception(error_msg)
-
-    @staticmethod
-    def merge_options_unit_data(convmatrixdf, targetdf):
-        #unit conversion fct takes as argument the conversion matrix df & the target df to be treated
-
-        if 'Unit' in convmatrixdf.columns and 'Unit' in targetdf.columns:
-            unittest = targetdf['Unit'].isin(convmatrixdf['Unit'])
-            if unittest[unittest.isin([False])].empty:
-                df3 = pd.merge(convmatrixdf, targetdf, on='Unit', left_index=True)
-                df3['Capacity'] = df3['Capacity'] * df3['Conversion Rate']
-                df3['Unit'] = df3['Uniform Unit']
-                df3 = df3.drop(columns=['Uniform Unit', 'Conversion Rate'])
-                return df3
-            else:
-                error_msg = "This unit is not handled by the canvas: %s" % targetdf['Unit'][targetdf['Unit'].isin(convmatrixdf['Unit']) is False]
-                logger.error(error_msg)
-                raise Exception(error_msg)
-
-        else:
-            if 'Unit' not in convmatrixdf.columns:
-                error_msg = "Unit column is missing in conversion matrix: %s" % list(convmatrixdf.columns)
-            else:
-                error_msg = "Unit column is missing in table: %s" % list(targetdf.columns)
-            logger.error(error_msg)
-            raise Exception(error_msg)
-
-    @staticmethod
-    def merge_capex_unit_data(convmatrixdf, targetdf):
-        # unit conversion fct takes as argument the conversion matrix df & the target df to be treated
-        if 'Unit' in convmatrixdf.columns and 'Unit' in targetdf.columns:
-            unittest = targetdf['Unit'].isin(convmatrixdf['Unit'])
-            if unittest[unittest.isin([False])].empty:
-                df3 = pd.merge(convmatrixdf, targetdf, on='Unit', left_index=True)
-                df3['CAPEX'] = df3['CAPEX'] * df3['Conversion Rate']
-                df3['Unit'] = df3['Uniform Unit']
-                df3 = df3.drop(columns=['Uniform Unit', 'Conversion Rate'])
-                return df3
-            else:
-                error_msg = "This unit is not handled by the canvas: %s" % targetdf['Unit'][targetdf['Unit'].isin(convmatrixdf['Unit']) is False]
-                logger.error(error_msg)
-                raise Exception(error_msg)
-        else:
-            if 'Unit' not in convmatrixdf.columns:
-                error_msg = "Unit column is missing in conversion matrix: %s" % list(convmatrixdf.columns)
-            else:
-                error_msg = "Unit column is missing in table: %s" % list(targetdf.columns)
-            logger.error(error_msg)
-            raise Exception(error_msg)
-
-    @staticmethod
-    def merge_sc_opex_unit_data(convmatrixdf, targetdf):
-        if 'Unit' in convmatrixdf.columns and 'Unit' in targetdf.columns:
-            unittest = targetdf['Unit'].isin(convmatrixdf['Unit'])
-            if unittest[unittest.isin([False])].empty:
-                df3 = pd.merge(convmatrixdf, targetdf, on='Unit', left_index=True)
-                for column in df3._get_numeric_data():
-                    if column == 'Conversion Rate' or column == 'Capacity':
-                        continue
-                    else:
-                        df3[column] = df3[column] * df3['Conversion Rate']
-                df3['Unit'] = df3['Uniform Unit']
-                df3 = df3.drop(columns=['Uniform Unit', 'Conversion Rate'])
-                return df3
-            else:
-                error_msg = "This unit is not handled by the canvas: %s" % targetdf['Unit'][targetdf['Unit'].isin(convmatrixdf['Unit']) is False]
-                logger.error(error_msg)
-                raise Exception(error_msg)
-        else:
-            if 'Unit' not in convmatrixdf.columns:
-                error_msg = "Unit column is missing in conversion matrix: %s" % list(convmatrixdf.columns)
-            else:
-                error_msg = "Unit column is missing in table: %s" % list(targetdf.columns)
-            logger.error(error_msg)
-            raise Exception(error_msg)
-
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+import app.config.env as env
+from app.tools.Logger import logger_datamanager as logger
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+class DataSnapshot:
+    """
+    Versioned local snapshot of transformed DataManager data: one Parquet file per dataframe, loaded memory mapped,
+    and a manifest with file digests, version being the digest of the whole content. Pickle files are only written
+    if pyarrow is missing, and should not be loaded from a shared folder.
+    Layout: <folder>/<version>/manifest.json, <folder>/CURRENT holding last saved version
+    """
+
+    MANIFEST = "manifest.json"
+    CURRENT = "CURRENT"
+    LATEST = "latest"
+
+    @staticmethod
+    def get_tables(dm):
+        """
+        :param dm: DataManager, with transformed data
+        :return: couple (dictionary {table name: dataframe}, dictionary {object name: json serializable object})
+        """
+        tables = {"raw_materials": dm.raw_materials, "sales_plan": dm.sales_plan}
+        objects = {}
+        for layer in dm.data:
+            for kind, value in dm.data[layer].items():
+                name = "%s.%s" % (layer.name, kind)
+                if isinstance(value, pd.DataFrame):
+                    tables[name] = value
+                else:
+                    objects[name] = value
+        return tables, objects
+
+    @staticmethod
+    def write_table(df, path, file_format):
+        if file_format == "parquet":
+            df.to_parquet(path)
+        else:
+            df.to_pickle(path)
+
+    @staticmethod
+    def read_table(path, file_format):
+        if file_format == "parquet":
+            if pq is None:
+                logger.error("pyarrow is required to read snapshot %s" % path)
+                raise Exception("pyarrow is required to read parquet snapshot")
+            return pq.read_table(path, memory_map=True).to_pandas()
+        return pd.read_pickle(path)
+
+    @staticmethod
+    def get_format():
+        if pq is None:
+            logger.warning("pyarrow is not installed: data snapshot saved as pickle files, not memory mapped and unsafe "
+                           "to load from a shared folder")
+            return "pickle"
+        return "parquet"
+
+    @staticmethod
+    def get_digest(path):
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def save(dm, folder=None):
+        """
+        Exports transformed data of data manager
+        :param dm: DataManager
+        :param folder: String, env.DATA_SNAPSHOT_FOLDER if None
+        :return: String, snapshot version
+        """
+        if dm.raw_materials is None or dm.sales_plan is None or len(dm.data) == 0:
+            logger.error("Data must be loaded and transformed before snapshot")
+            raise Exception("Data must be loaded and transformed before snapshot")
+        folder = env.DATA_SNAPSHOT_FOLDER if folder is None else folder
+        file_format = DataSnapshot.get_format()
+        tmp_folder = os.path.join(folder, ".tmp%d" % os.getpid())
+        os.makedirs(tmp_folder, exist_ok=True)
+
+        tables, objects = DataSnapshot.get_tables(dm)
+        files = {}
+        for name, df in tables.items():
+            file_name = "%s.%s" % (name, "parquet" if file_format == "parquet" else "pkl")
+            DataSnapshot.write_table(df, os.path.join(tmp_folder, file_name), file_format)
+            files[name] = {"file": file_name, "sha1": DataSnapshot.get_digest(os.path.join(tmp_folder, file_name))}
+        layers = [[layer.name, list(dm.data[layer].keys())] for layer in dm.data]
+        content = json.dumps({"format": file_format, "files": files, "objects": objects, "layers": layers},
+                             sort_keys=True)
+        version = hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+        manifest = {
+            "version": version,
+            "format": file_format,
+            "created": datetime.datetime.now().strftime("%d/%m/%y %H:%M:%S"),
+            "files": files,
+            "objects": objects,
+            "layers": layers,
+        }
+        with open(os.path.join(tmp_folder, DataSnapshot.MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=1)
+
+        version_folder = os.path.join(folder, version)
+        if os.path.exists(version_folder):
+            shutil.rmtree(tmp_folder)
+        else:
+            os.replace(tmp_folder, version_folder)
+        with open(os.path.join(folder, DataSnapshot.CURRENT + ".tmp%d" % os.getpid()), "w") as f:
+            f.write(version)
+        os.replace(os.path.join(folder, DataSnapshot.CURRENT + ".tmp%d" % os.getpid()),
+                   os.path.join(folder, DataSnapshot.CURRENT))
+        logger.info("Data snapshot %s saved in %s" % (version, folder))
+        return version
+
+    @staticmethod
+    def get_manifest(version=None, folder=None):
+        """
+        :param version: String, snapshot version, last saved version if None or 'latest'
+        :param folder: String, env.DATA_SNAPSHOT_FOLDER if None
+        :return: couple (folder of version, manifest dictionary)
+        """
+        folder = env.DATA_SNAPSHOT_FOLDER if folder is None else folder
+        if version is None or version == DataSnapshot.LATEST:
+            current = os.path.join(folder, DataSnapshot.CURRENT)
+            if not os.path.exists(current):
+                logger.error("No data snapshot in %s" % folder)
+                raise Exception("No data snapshot in %s" % folder)
+            with open(current) as f:
+                version = f.read().strip()
+        version_folder = os.path.join(folder, version)
+        path = os.path.join(version_folder, DataSnapshot.MANIFEST)
+        if not os.path.exists(path):
+            logger.error("Data snapshot %s not found in %s" % (version, folder))
+            raise Exception("Data snapshot %s not found" % version)
+        with open(path) as f:
+            return version_folder, json.load(f)
+
+    @staticmethod
+    def load(dm, version=None, folder=None, verify=False):
+        """
+        Loads snapshot into data manager, instead of data service
+        :param dm: DataManager, without data
+        :param version: String, snapshot version, last saved version if None or 'latest'
+        :param folder: String, env.DATA_SNAPSHOT_FOLDER if None
+        :param verify: boolean, check file digests against manifest
+        :return: String, loaded version
+        """
+        if any([dm.raw_materials is not None, dm.sales_plan is not None, len(dm.data) > 0]):
+            raise Exception("Data already transformed")
+        version_folder, manifest = DataSnapshot.get_manifest(version, folder)
+        if manifest["format"] != "parquet":
+            logger.warning("Data snapshot %s is made of pickle files, only load it from a trusted folder"
+                           % manifest["version"])
+        values = dict(manifest["objects"])
+        for name, description in manifest["files"].items():
+            path = os.path.join(version_folder, description["file"])
+            if verify and DataSnapshot.get_digest(path) != description["sha1"]:
+                logger.error("Corrupted data snapshot file %s" % path)
+                raise Exception("Corrupted data snapshot file %s" % path)
+            df = DataSnapshot.read_table(path, manifest["format"])
+            if name == "raw_materials":
+                dm.raw_materials = df
+            elif name == "sales_plan":
+                dm.sales_plan = df
+            else:
+                values[name] = df
+        # same layers and keys order as exported data
+        for layer, kinds in manifest["layers"]:
+            dm.data[env.PipelineLayer[layer]] = {kind: values["%s.%s" % (layer, kind)] for kind in kinds}
+        logger.info("Data snapshot %s loaded" % manifest["version"])
+        return manifest["version"]
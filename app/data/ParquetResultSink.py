@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import math
+import os
+import shutil
+import pandas as pd
+import app.config.env as env
+from app.data.ColumnarResults import ColumnarResults
+from app.graph.Node import NodeJSONEncoder
+from app.model.ResultPublisher import ResultPublisher
+from app.tools.Logger import logger_results as logger
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+    pq = None
+
+
+class ParquetResultSink(ResultPublisher):
+    """
+    Publisher writing results of a local run to Parquet files instead of keeping them in memory: rows are buffered and
+    written as row groups while scenarios are evaluated.
+    Layout: <folder>/<global|detailed>/phase=<phase>/couple=<couple index>/part-<part>.parquet, one file per writer
+    (chunk of simulate_parallel) and partition.
+    Global rows are those of Simulator.simulate without publishers; detailed rows are one per entity and scenario,
+    yearly metrics being lists aligned on Years (NaN if missing) and volumes lists of items, units and yearly volumes.
+    Readers give back documents as stored in results database, so that dashboards and exports read files directly
+    """
+
+    GLOBAL = "global"
+    DETAILED = "detailed"
+    ATTRIBUTES = ["Moniker", "Layer", "Name", "Location"]
+
+    @staticmethod
+    def get_schema(kind):
+        """
+        :param kind: GLOBAL or DETAILED
+        :return: pyarrow.Schema
+        """
+        if kind == ParquetResultSink.GLOBAL:
+            return pyarrow.schema([("Scenario", pyarrow.int64()), ("Cost PV", pyarrow.float64()),
+                                   ("Unit", pyarrow.string()), ("Moniker", pyarrow.string())])
+        fields = [("Scenario", pyarrow.int64())]
+        fields += [(attribute, pyarrow.string()) for attribute in ParquetResultSink.ATTRIBUTES]
+        fields += [("Cost PV", pyarrow.float64()), ("Years", pyarrow.list_(pyarrow.int64()))]
+        fields += [(metric, pyarrow.list_(pyarrow.float64())) for metric in ColumnarResults.METRICS]
+        for volume in ColumnarResults.VOLUMES:
+            fields += [("%s Items" % volume, pyarrow.list_(pyarrow.string())),
+                       ("%s Units" % volume, pyarrow.list_(pyarrow.string())),
+                       (volume, pyarrow.list_(pyarrow.list_(pyarrow.float64())))]
+        return pyarrow.schema(fields)
+
+    @staticmethod
+    def check_pyarrow():
+        if pyarrow is None:
+            logger.error("pyarrow is required to write or read Parquet results")
+            raise Exception("pyarrow is required to write or read Parquet results")
+
+    @staticmethod
+    def create_publishers(folder=None, phase=0, part=0, row_group_size=None):
+        """
+        :param folder: string, env.RESULT_SINK_FOLDER if None
+        :param phase: int, partition until set_partition is called
+        :param part: int, part of file names, distinct for concurrent writers
+        :param row_group_size: int, rows per row group, env.RESULT_SINK_ROW_GROUP_SIZE if None
+        :return: dictionary of publishers, as expected by Simulator.simulate
+        """
+        return {
+            "details": ParquetResultSink(ParquetResultSink.DETAILED, folder, phase, part, row_group_size),
+            "global": ParquetResultSink(ParquetResultSink.GLOBAL, folder, phase, part, row_group_size),
+        }
+
+    @staticmethod
+    def clear(folder=None):
+        """
+        Removes results of a former run
+        :param folder: string, env.RESULT_SINK_FOLDER if None
+        :return: None
+        """
+        folder = env.RESULT_SINK_FOLDER if folder is None else folder
+        for kind in [ParquetResultSink.GLOBAL, ParquetResultSink.DETAILED]:
+            shutil.rmtree(os.path.join(folder, kind), ignore_errors=True)
+
+    def __init__(self, kind, folder=None, phase=0, part=0, row_group_size=None):
+        """
+        ctor
+        :param kind: GLOBAL or DETAILED
+        :param folder: string, env.RESULT_SINK_FOLDER if None
+        :param phase: int, partition until set_partition is called
+        :param part: int, part of file names, distinct for concurrent writers
+        :param row_group_size: int, rows per row group, env.RESULT_SINK_ROW_GROUP_SIZE if None
+        """
+        ParquetResultSink.check_pyarrow()
+        self.kind = kind
+        self.folder = os.path.join(env.RESULT_SINK_FOLDER if folder is None else folder, kind)
+        self.part = part
+        self.row_group_size = max(env.RESULT_SINK_ROW_GROUP_SIZE if row_group_size is None else row_group_size, 1)
+        self.schema = ParquetResultSink.get_schema(kind)
+        self.partition = (phase, 0)
+        self.rows = []
+        self.writer = None
+        self.count = 0
+
+    def set_partition(self, phase, couple_index):
+        if (phase, couple_index) != self.partition:
+            self.close_writer()
+            self.partition = (phase, couple_index)
+
+    def save(self, data, task_id):
+        if self.kind == ParquetResultSink.GLOBAL:
+            row = dict(data)
+            if not isinstance(row["Moniker"], str):
+                row["Moniker"] = json.dumps(NodeJSONEncoder().encode(row["Moniker"]))
+            self.rows.append(row)
+        else:
+            self.rows.extend(ParquetResultSink.to_row(result) for result in data)
+        if len(self.rows) >= self.row_group_size:
+            self.write()
+
+    def write(self):
+        """
+        Writes buffered rows as a row group of current partition file
+        :return: None
+        """
+        if len(self.rows) == 0:
+            return
+        if self.writer is None:
+            folder = os.path.join(self.folder, "phase=%d" % self.partition[0], "couple=%d" % self.partition[1])
+            os.makedirs(folder, exist_ok=True)
+            self.writer = pq.ParquetWriter(os.path.join(folder, "part-%d.parquet" % self.part), self.schema)
+        # built column by column: Table.from_pylist needs pyarrow >= 7
+        columns = [pyarrow.array([row.get(field.name) for row in self.rows], type=field.type)
+                   for field in self.schema]
+        self.writer.write_table(pyarrow.Table.from_arrays(columns, names=self.schema.names),
+                                row_group_size=self.row_group_size)
+        self.count += len(self.rows)
+        self.rows = []
+
+    def close_writer(self):
+        self.write()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def close(self, check=True):
+        self.close_writer()
+        logger.info("%d %s results written to %s" % (self.count, self.kind, self.folder))
+
+    @staticmethod
+    def to_row(result):
+        """
+        :param result: dictionary, detailed result of an entity
+        :return: dictionary, row of detailed schema
+        """
+        row = {"Scenario": int(result["Scenario"])}
+        for attribute in ParquetResultSink.ATTRIBUTES:
+            value = result.get(attribute)
+            row[attribute] = None if value is None else str(value)
+        row["Cost PV"] = None if result.get("Cost PV") is None else float(result["Cost PV"])
+        metrics = {metric: ColumnarResults.to_series(result.get(metric)) for metric in ColumnarResults.METRICS}
+        volumes = {kind: {item: (ColumnarResults.to_series(volume["volume"]), volume.get("unit"))
+                          for item, volume in (result.get(kind) or {}).items()} for kind in ColumnarResults.VOLUMES}
+        years = set()
+        for values in metrics.values():
+            years.update(values.index)
+        for items in volumes.values():
+            for values, _ in items.values():
+                years.update(values.index)
+        years = sorted(int(year) for year in years)
+        row["Years"] = years
+        for metric, values in metrics.items():
+            row[metric] = values.reindex(years).astype(float).tolist()
+        for kind, items in volumes.items():
+            row["%s Items" % kind] = list(items)
+            row["%s Units" % kind] = [unit for _, unit in items.values()]
+            row[kind] = [values.reindex(years).astype(float).tolist() for values, _ in items.values()]
+        return row
+
+    @staticmethod
+    def to_document(row):
+        """
+        :param row: dictionary, row of detailed schema
+        :return: dictionary, detailed result as stored in results database, years being strings
+        """
+        def to_dict(values):
+            return {str(year): value for year, value in zip(row["Years"], values)
+                    if value is not None and not math.isnan(value)}
+
+        document = {"Scenario": row["Scenario"]}
+        for attribute in ParquetResultSink.ATTRIBUTES:
+            document[attribute] = row[attribute]
+        document["Cost PV"] = row["Cost PV"]
+        for metric in ColumnarResults.METRICS:
+            document[metric] = to_dict(row[metric])
+        for kind in ColumnarResults.VOLUMES:
+            document[kind] = {item: {"volume": to_dict(values), "unit": unit} for item, unit, values in
+                              zip(row["%s Items" % kind], row["%s Units" % kind], row[kind])}
+        return document
+
+    @staticmethod
+    def get_files(folder, kind):
+        """
+        :param folder: string, env.RESULT_SINK_FOLDER if None
+        :param kind: GLOBAL or DETAILED
+        :return: list of Parquet files of kind, ordered by partition
+        """
+        folder = os.path.join(env.RESULT_SINK_FOLDER if folder is None else folder, kind)
+        files = []
+        for root, _, names in os.walk(folder):
+            files.extend(os.path.join(root, name) for name in names if name.endswith(".parquet"))
+        return sorted(files)
+
+    @staticmethod
+    def iter_rows(folder, kind, scenarios=None, columns=None):
+        """
+        Reads files row group by row group
+        :param folder: string, env.RESULT_SINK_FOLDER if None
+        :param kind: GLOBAL or DETAILED
+        :param scenarios: collection of scenario ids, all scenarios if None
+        :param columns: list of columns, all columns if None
+        :return: generator of rows
+        """
+        ParquetResultSink.check_pyarrow()
+        scenarios = None if scenarios is None else set(int(scenario) for scenario in scenarios)
+        if scenarios is not None and columns is not None and "Scenario" not in columns:
+            columns = ["Scenario"] + list(columns)
+        for path in ParquetResultSink.get_files(folder, kind):
+            parquet_file = pq.ParquetFile(path)
+            for i in range(parquet_file.num_row_groups):
+                values = parquet_file.read_row_group(i, columns=columns).to_pydict()
+                for row in (dict(zip(values.keys(), row_values)) for row_values in zip(*values.values())):
+                    if scenarios is None or row["Scenario"] in scenarios:
+                        yield row
+
+    @staticmethod
+    def read_global(folder=None, columns=None):
+        """
+        :param folder: string, env.RESULT_SINK_FOLDER if None
+        :param columns: list of columns, all columns if None
+        :return: DataFrame of global results, sorted by scenario
+        """
+        ParquetResultSink.check_pyarrow()
+        tables = [pq.read_table(path, columns=columns)
+                  for path in ParquetResultSink.get_files(folder, ParquetResultSink.GLOBAL)]
+        if len(tables) == 0:
+            return pd.DataFrame(columns=columns or ParquetResultSink.get_schema(ParquetResultSink.GLOBAL).names)
+        results = pyarrow.concat_tables(tables).to_pandas()
+        if "Scenario" in results.columns:
+            results = results.sort_values("Scenario").reset_index(drop=True)
+        return results
+
+    @staticmethod
+    def iter_details(folder=None, scenarios=None):
+        """
+        :param folder: string, env.RESULT_SINK_FOLDER if None
+        :param scenarios: collection of scenario ids, all scenarios if None
+        :return: generator of detailed results, as stored in results database
+        """
+        for row in ParquetResultSink.iter_rows(folder, ParquetResultSink.DETAILED, scenarios):
+            yield ParquetResultSink.to_document(row)
+
+    @staticmethod
+    def get_representative_scenarios(scenarios_df, quantile_step):
+        """
+        Scenarios at each quantile step of Cost PV, in descending order, as DBHandler.get_best_global_scenarios
+        :param scenarios_df: DataFrame of global results
+        :param quantile_step: float
+        :return: DataFrame
+        """
+        scenarios_df = scenarios_df.sort_values(["Cost PV", "Scenario"], ascending=[False, True]).reset_index(drop=True)
+        step = max(int(quantile_step * len(scenarios_df)), 1)
+        return scenarios_df.iloc[[step * i for i in range(0, int(len(scenarios_df) / step))]]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+
+import hashlib
+import os
+import threading
+import app.config.env as env
+from app.tools.Logger import logger_datamanager as logger
+
+
+class ResponseCache:
+    """
+    Local disk cache of data service responses with their ETag, shared by processes of a host: responses are
+    revalidated with If-None-Match, so that unchanged collections are not downloaded again
+    Layout: <folder>/<sha1 of url>.etag and .json
+    """
+
+    @staticmethod
+    def get_path(url, suffix, folder=None):
+        folder = env.DATA_CACHE_FOLDER if folder is None else folder
+        return os.path.join(folder, hashlib.sha1(url.encode("utf-8")).hexdigest() + suffix)
+
+    @staticmethod
+    def get(url, folder=None):
+        """
+        :param url: String
+        :param folder: String, env.DATA_CACHE_FOLDER if None
+        :return: couple (etag, body bytes), None if missing
+        """
+        try:
+            with open(ResponseCache.get_path(url, ".etag", folder)) as f:
+                etag = f.read()
+            with open(ResponseCache.get_path(url, ".json", folder), "rb") as f:
+                return etag, f.read()
+        except OSError:
+            return None
+
+    @staticmethod
+    def put(url, etag, body, folder=None):
+        """
+        Body is written before its etag, each file atomically, so that a reader never gets an etag with an older body
+        :param url: String
+        :param etag: String
+        :param body: bytes
+        :param folder: String, env.DATA_CACHE_FOLDER if None
+        :return: None
+        """
+        try:
+            os.makedirs(env.DATA_CACHE_FOLDER if folder is None else folder, exist_ok=True)
+            etag_path = ResponseCache.get_path(url, ".etag", folder)
+            if os.path.exists(etag_path):
+                os.remove(etag_path)
+            for path, content, mode in [(ResponseCache.get_path(url, ".json", folder), body, "wb"),
+                                        (etag_path, etag, "w")]:
+                tmp_path = "%s.tmp%d_%d" % (path, os.getpid(), threading.get_ident())
+                with open(tmp_path, mode) as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Response of %s not cached: %s" % (url, e))
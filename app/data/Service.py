@@ -2,8 +2,11 @@
 
 
 from app.data.DBAccess import DBAccess
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
+from flask import json as flask_json
+from bson import ObjectId
 from app.tools.Utils import JSONEncoder, trim_collection_name
+import hashlib
 import json
 import app.config.env as env
 from app.config.env_func import reset_db_name
@@ -21,7 +24,7 @@ def get_records_into_dics(db_name, collection):
     :return: JSON
     """
     reset_db_name(db_name)
-    records = DBAccess(env.DB_NAME).get_all_records(collection)
+    records = DBAccess.get(env.DB_NAME).get_all_records(collection)
     dic_records = {}
     for record in records:
         _id = record["_id"]
@@ -30,36 +33,104 @@ def get_records_into_dics(db_name, collection):
     return json.dumps(JSONEncoder().encode(records))
 
 
+def get_query(args):
+    """
+    Cursor options from query string:
+    fields (comma separated projection), filter (json query), sort (key, _id by default), order (1 or -1),
+    after and after_id (json sort value and _id of last record of previous page), limit (page size, 0 for all)
+    :param args: request arguments
+    :return: tuple (filter, projection, sort, limit)
+    """
+    filter_ = json.loads(args["filter"]) if "filter" in args else {}
+    if any(operator in args.get("filter", "") for operator in ["$where", "$function", "$accumulator"]):
+        raise Exception("Server side javascript is not allowed in filters")
+    fields = [field for field in args.get("fields", "").split(",") if len(field) > 0]
+    projection = dict.fromkeys(fields, 1) if len(fields) > 0 else None
+    sort_key = args.get("sort", "_id")
+    order = 1 if int(args.get("order", 1)) >= 0 else -1
+    sort = [(sort_key, order)] if sort_key == "_id" else [(sort_key, order), ("_id", order)]
+
+    # keyset pagination: records strictly after last record of previous page, in sort order
+    if "after" in args or "after_id" in args:
+        operator = "$gt" if order > 0 else "$lt"
+        if sort_key == "_id":
+            keyset = {"_id": {operator: ObjectId(args.get("after_id", json.loads(args.get("after", "null"))))}}
+        else:
+            after = json.loads(args["after"])
+            keyset = {"$or": [{sort_key: {operator: after}},
+                              {sort_key: after, "_id": {operator: ObjectId(args["after_id"])}}]}
+        filter_ = {"$and": [filter_, keyset]} if len(filter_) > 0 else keyset
+    return filter_, projection, sort, int(args.get("limit", 0))
+
+
+def stream_records(db_name, collection, args):
+    """
+    Streams records of collection from a cursor, without loading them: a json array of records without _id, or with
+    format=ndjson one record per line with _id as string, for keyset pagination
+    :param db_name: database name
+    :param collection: name
+    :param args: request arguments, see get_query
+    :return: Response
+    """
+    try:
+        filter_, projection, sort, limit = get_query(args)
+    except Exception as e:
+        logger.error("Invalid query on %s/%s: %s" % (db_name, collection, e))
+        return jsonify(status=env.HTML_STATUS.ERROR, message=str(e)), 400
+    cursor = DBAccess.get(db_name).get_cursor(collection, filter_, projection, sort, limit, env.DATA_SERVICE_BATCH_SIZE)
+    ndjson = args.get("format", "json") == "ndjson"
+
+    def generate():
+        try:
+            if not ndjson:
+                yield "["
+            for counter, record in enumerate(cursor):
+                if ndjson:
+                    record["_id"] = str(record["_id"])
+                    yield flask_json.dumps(record) + "\n"
+                else:
+                    record.pop("_id", None)
+                    yield ("," if counter > 0 else "") + flask_json.dumps(record)
+            if not ndjson:
+                yield "]"
+        finally:
+            cursor.close()
+
+    return Response(stream_with_context(generate()),
+                    mimetype="application/x-ndjson" if ndjson else "application/json")
+
+
 @DATA_SERVICE.route("/data/<db_name>/<collection>/")
 def get_records(db_name, collection):
     """
-    Get records from collection
+    Get records from collection, streamed (see stream_records)
     :param db_name: name of current database
     :param collection: name
     :return: JSON
     """
     reset_db_name(db_name)
-    records, _ = DBAccess(env.DB_NAME).get_all_records(collection)
-    for record in records:
-        _id = record["_id"]
-        record.pop("_id", None)
-    return jsonify(records)
+    # data collections are reloaded as a whole: unchanged content is revalidated without being sent
+    etag = hashlib.sha1(("%s?%s" % (DBAccess.get(env.DB_NAME).get_version(collection),
+                                    request.query_string.decode("utf-8"))).encode("utf-8")).hexdigest()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = stream_records(env.DB_NAME, collection, request.args)
+    if isinstance(response, Response):
+        response.set_etag(etag)
+    return response
 
 
 @DATA_SERVICE.route("/results/<db_name>/<collection>/")
 def get_all_results(db_name, collection):
     """
-    Get results from collection
+    Get results from collection, streamed (see stream_records)
     :param db_name: name of current database
     :param collection: name
     :return: JSON
     """
     reset_db_name(db_name)
-    records, _ = DBAccess(env.DB_RESULT_NAME).get_all_records(collection)
-    for record in records:
-        _id = record["_id"]
-        record.pop("_id", None)
-    return jsonify(records)
+    return stream_records(env.DB_RESULT_NAME, collection, request.args)
 
 
 @DATA_SERVICE.route("/results/<db_name>/<collection>/<scenario_id>/")
@@ -73,7 +144,7 @@ def get_results(db_name, collection, scenario_id):
     """
     reset_db_name(db_name)
 
-    cursor = DBAccess(env.DB_RESULT_NAME).get_records(collection, {"Scenario": int(scenario_id)})
+    cursor = DBAccess.get(env.DB_RESULT_NAME).get_records(collection, {"Scenario": int(scenario_id)})
     records = []
     for record in cursor:
         record.pop("_id", None)
@@ -91,7 +162,7 @@ def get_result(db_name, collection, scenario_id):
     :return: JSON
     """
     reset_db_name(db_name)
-    record = DBAccess(env.DB_RESULT_NAME).get_one_record(collection, {"Scenario": int(scenario_id)})
+    record = DBAccess.get(env.DB_RESULT_NAME).get_one_record(collection, {"Scenario": int(scenario_id)})
     _id = record["_id"]
     record.pop("_id", None)
     return jsonify(record)
@@ -102,7 +173,7 @@ def save_data():
     try:
         reset_db_name(request.json['db_name'])
         records = request.json['table']
-        db = DBAccess(env.DB_NAME)
+        db = DBAccess.get(env.DB_NAME)
         name_ = trim_collection_name(request.json['name'])
         db.clear_collection(name_)
         db.save_to_db(name_, records)
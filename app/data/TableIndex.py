@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+
+class TableIndex:
+    """
+    Rows of a dataframe grouped once by key columns, for lookups in constant time instead of boolean masks over the
+    whole table. Indexes are shared per dataframe: DataManager builds them for its tables, others are built on first use
+    """
+
+    # keys of specific consumptions lookups
+    SPEC_CONS_KEYS = ("Moniker", "Product", "Input", "Item")
+
+    # (id of dataframe, key columns) -> (dataframe, index), dataframe being kept alive so that its id is not reused
+    INDEXES = {}
+
+    def __init__(self, df, keys):
+        """
+        ctor
+        :param df: Dataframe
+        :param keys: tuple of key columns
+        """
+        self.keys = tuple(keys)
+        self.empty = df.iloc[0:0]
+        self.groups = {}
+        if len(df) > 0:
+            for key, group in df.groupby(list(self.keys), sort=False):
+                self.groups[key if isinstance(key, tuple) else (key,)] = group
+        self.tenors = sorted(df.index.unique().tolist())
+
+    def get(self, *values):
+        """
+        :param values: values of key columns
+        :return: Dataframe, rows matching all values in table order, empty if none
+        """
+        return self.groups.get(values, self.empty)
+
+    @staticmethod
+    def of(df, keys=("Moniker",)):
+        """
+        :param df: Dataframe
+        :param keys: tuple of key columns
+        :return: TableIndex of dataframe, built if missing
+        """
+        keys = tuple(keys)
+        entry = TableIndex.INDEXES.get((id(df), keys))
+        if entry is None or entry[0] is not df:
+            entry = (df, TableIndex(df, keys))
+            TableIndex.INDEXES[(id(df), keys)] = entry
+        return entry[1]
+
+    @staticmethod
+    def clear():
+        TableIndex.INDEXES.clear()
@@ -25,16 +25,15 @@ class BeneficiationEntity(Entity):
         self.main_input = "Raw Rock"
         self.main_inputs = self.get_main_consumed(self.moniker, spec_prod)
         self.outputs = self.get_products(option, spec_prod)
-        self.production = {k: {"volume": pd.Series([0]*len(self.timeline), index=self.timeline), "unit": ""} for k in self.outputs}
+        self.set_products(self.outputs)
         self.specific_consumptions = self.get_specific_consumptions(spec_cons_opex, option, self.outputs,
                                                                     self.main_inputs, self.inputs, inputs_type='specific')
         self.yields = self.get_yields(option, spec_prod, self.outputs, self.main_inputs)
         self.opex = self.calculate_opex_per_ton(option, spec_cons_opex, rm_prices, self.outputs, self.main_inputs)
-        self.zero_production = {k: {"volume": pd.Series([0] * len(self.timeline), index=self.timeline), "unit": ""} for k in self.outputs}
 
     @staticmethod
     def calculate_opex_per_ton(option, spec_cons_df, rm_prices, outputs=None, main_inputs=None):
-        opex = spec_cons_df[spec_cons_df.Moniker == option.Moniker]
+        opex = Entity.get_moniker_rows(spec_cons_df, option.Moniker)
         opex_per_input_per_output = Utils.multidict(outputs, main_inputs, {})
         for input in main_inputs:
             for output in outputs:
@@ -51,7 +50,7 @@ class BeneficiationEntity(Entity):
 
     @staticmethod
     def get_yields(option, spec_prod, outputs, inputs):
-        yields = spec_prod[spec_prod.Moniker == option.Moniker]
+        yields = Entity.get_moniker_rows(spec_prod, option.Moniker)
         d = Utils.multidict(outputs, inputs, {})
         for product in outputs:
             for input in inputs:
@@ -63,15 +62,15 @@ class BeneficiationEntity(Entity):
 
     @staticmethod
     def get_products(option, spec_prod_df):
-        return list(spec_prod_df[(spec_prod_df.Moniker == option.Moniker)]['OutputQuality'].unique())
+        return list(Entity.get_moniker_rows(spec_prod_df, option.Moniker)['OutputQuality'].unique())
 
     @staticmethod
     def get_main_consumed(moniker, spec_prod):
-        return list(spec_prod[(spec_prod.Moniker == moniker)]["InputQuality"].unique())
+        return list(Entity.get_moniker_rows(spec_prod, moniker)["InputQuality"].unique())
 
     @staticmethod
     def get_specific_consumptions_in_out_item(spec_cons_df, option, product, input, item):
-        return spec_cons_df[(spec_cons_df.Moniker == option.Moniker) &
-                            (spec_cons_df.Item == item) &
-                            (spec_cons_df.InputQuality == input) &
-                            (spec_cons_df.OutputQuality == product)]['sc/opex']
+        spec_cons = Entity.get_moniker_rows(spec_cons_df, option.Moniker)
+        return spec_cons[(spec_cons.Item == item) &
+                         (spec_cons.InputQuality == input) &
+                         (spec_cons.OutputQuality == product)]['sc/opex']
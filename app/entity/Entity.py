@@ -1,13 +1,16 @@
 # -*- coding: utf-8 -*-
 
 
+from copy import copy
 from app.tools import Utils
+from app.tools import Discounting
 import numpy as np
 from app.tools.Logger import logger_simulation as logger
 import app.config.env as env
 import pandas as pd
 from app.tools.Utils import multidict
-from copy import deepcopy
+from app.entity.EntityState import EntityState
+from app.data.TableIndex import TableIndex
 
 
 class Entity:
@@ -61,10 +64,11 @@ class Entity:
         self.moniker = option.Moniker
 
         # Attributes describing option, with information available in other sheets
-        self.timeline = sorted(spec_cons_opex.index.unique().tolist())
-        self.capacity = Entity.get_capacities(option, self.nominal_capacity, self.timeline)
+        self.timeline = list(TableIndex.of(spec_cons_opex).tenors)
         self.capex = Entity.get_capex(capex, self.moniker)
         self.inputs = Entity.get_consumed(option, spec_cons_opex)
+        # opex per ton computed from raw materials prices, i.e. not given as a Total item
+        self.priced_opex = 'Total' not in set(Entity.get_moniker_rows(spec_cons_opex, self.moniker).Item)
         self.outputs = []
         self.main_input = None
         self.specific_consumptions = None
@@ -79,17 +83,12 @@ class Entity:
         else:
             self.secondary_products = None
 
-        # Constants used for reinitialization from one scenario to another
-        self.zero_consumption = {k: {"volume": pd.Series([0] * len(self.timeline), index=self.timeline), "unit": ""} for k in self.inputs}
-        self.zero_production = {k: {"volume": pd.Series([0] * len(self.timeline), index=self.timeline), "unit": ""} for k in self.outputs}
-        self.zero_capacities = self.capacity
-        self.zero_total_opex = pd.Series([0] * len(self.timeline), index=self.timeline)
+        # Capacity, opex, consumption and production, reinitialized from one scenario to another
+        self.state = EntityState(self.timeline, Entity.get_capacities(option, self.nominal_capacity, self.timeline),
+                                 self.inputs)
 
         # Attributes to reset from one scenario to another (not exhaustive)
         self.total_capex = self.capex.copy()
-        self.total_opex = self.zero_total_opex
-        self.consumption = {k: {"volume": pd.Series([0]*len(self.timeline), index=self.timeline), "unit": ""} for k in self.inputs}
-        self.production = {k: {"volume": pd.Series([0]*len(self.timeline), index=self.timeline), "unit": ""} for k in self.outputs}
         self.cost_pv = None
 
     def __str__(self):
@@ -101,17 +100,69 @@ class Entity:
     def get_location(self):
         return self.location
 
+    @property
+    def capacity(self):
+        return self.state.view(EntityState.CAPACITY)
+
+    @capacity.setter
+    def capacity(self, value):
+        self.state.set(EntityState.CAPACITY, value)
+
+    @property
+    def total_opex(self):
+        return self.state.view(EntityState.TOTAL_OPEX)
+
+    @total_opex.setter
+    def total_opex(self, value):
+        self.state.set(EntityState.TOTAL_OPEX, value)
+
+    @property
+    def consumption(self):
+        """ Read-only view {input: {"volume": pd.Series, "unit": ""}}, updated through add_consumption """
+        return self.state.volumes[EntityState.CONSUMPTION]
+
+    @property
+    def production(self):
+        """ Read-only view {product: {"volume": pd.Series, "unit": ""}}, updated through (add|set)_production """
+        return self.state.volumes[EntityState.PRODUCTION]
+
+    def set_products(self, products):
+        """
+        Allocates production of entity
+        :param products: list of produced items
+        :return: None
+        """
+        self.state.add_rows([(EntityState.PRODUCTION, product) for product in products])
+
+    def add_production(self, product, volume):
+        self.state.add((EntityState.PRODUCTION, product), volume)
+
+    def set_production(self, product, volume, year=None):
+        self.state.set((EntityState.PRODUCTION, product), volume, year)
+
+    def add_consumption(self, input_, volume):
+        self.state.add((EntityState.CONSUMPTION, input_), volume)
+
+    @staticmethod
+    def get_moniker_rows(df, moniker):
+        """
+        :param df: Dataframe with a Moniker column (specific consumptions, productions, capex)
+        :param moniker: String
+        :return: Dataframe, rows of moniker, looked up in index of dataframe
+        """
+        return TableIndex.of(df).get(moniker)
+
     @staticmethod
     def get_products(option, spec_prod_df):
-        return list(spec_prod_df[(spec_prod_df.Moniker == option.Moniker)]['Product'].unique())
+        return list(Entity.get_moniker_rows(spec_prod_df, option.Moniker)['Product'].unique())
 
     @staticmethod
     def get_main_consumed(moniker, spec_prod):
-        return list(spec_prod[(spec_prod.Moniker == moniker)]["Input"].unique())[0]
+        return list(Entity.get_moniker_rows(spec_prod, moniker)["Input"].unique())[0]
 
     @staticmethod
     def get_consumed(option, spec_cons_df, non_consumables=tuple(['Total'])):
-        consumption = list(spec_cons_df[(spec_cons_df.Moniker == option.Moniker)]['Item'].unique())
+        consumption = list(Entity.get_moniker_rows(spec_cons_df, option.Moniker)['Item'].unique())
         for e in non_consumables:
             try: consumption.remove(e)
             except ValueError: pass
@@ -119,7 +170,7 @@ class Entity:
 
     @staticmethod
     def get_capex(capex_, moniker):
-        capex = capex_[capex_.Moniker == moniker]
+        capex = Entity.get_moniker_rows(capex_, moniker)
         if 'Total' in list(set(capex.Item)):
             c = capex[capex.Item == 'Total']
         else:
@@ -164,7 +215,7 @@ class Entity:
         :return: dict(by/co/waste/product name: pd.Series(prod_spec_per_year)
         """
         output = dict()
-        spec_prod_df = spec_prod_df[spec_prod_df.Moniker == self.moniker]
+        spec_prod_df = Entity.get_moniker_rows(spec_prod_df, self.moniker)
         if self.secondary_products is not None:
             for product in self.secondary_products:
                 if product in spec_prod_df.Product.unique():
@@ -197,17 +248,15 @@ class Entity:
         main_product = list(self.specific_consumptions.keys())[0] # Assumption: only one main_product in SAP[ACS]/PAP[ACP] layers
         for product in self.production.keys():
             if product in self.secondary_products:
-                self.production[product]['volume'] = self.production[main_product]['volume'] * self.secondary_products_spec_prod[product]
+                self.set_production(product, self.production[main_product]['volume'] * self.secondary_products_spec_prod[product])
 
     def compute_inputs_balances(self):
         # update consumption for different inputs in combination
         for input_ in self.inputs:
             for produced in self.specific_consumptions.keys():
                 if len(self.specific_consumptions[produced][self.main_input][input_]) > 0:
-                    self.consumption[input_]['volume'] = \
-                        self.consumption[input_]['volume'] + \
-                        self.production[produced]['volume'] * \
-                        self.specific_consumptions[produced][self.main_input][input_]
+                    self.add_consumption(input_, self.production[produced]['volume'] *
+                                         self.specific_consumptions[produced][self.main_input][input_])
 
     def compute_total_opex(self):
         """ Computes total opex for a given entity"""
@@ -216,7 +265,7 @@ class Entity:
         else:
             for produced in self.specific_consumptions.keys():
                 if produced in self.production.keys() and produced in self.opex.keys():
-                    self.total_opex = self.total_opex + self.production[produced]['volume'] * self.opex[produced]
+                    self.state.add(EntityState.TOTAL_OPEX, self.production[produced]['volume'] * self.opex[produced])
 
     def compute_total_capex(self):
         """computes total capex for an entity"""
@@ -233,7 +282,7 @@ class Entity:
     def compute_cost_pv(self):
         """computes elementary cost_pv"""
         total_yearly_expenses = self.total_opex.add(self.total_capex, fill_value=0)
-        return np.npv(env.WACC, total_yearly_expenses)
+        return Discounting.npv(total_yearly_expenses)
 
     def compute_metrics(self):
         """function called after the completion of a given scenario's calculation
@@ -246,17 +295,25 @@ class Entity:
         self.compute_total_capex()
         self.cost_pv = self.compute_cost_pv()
 
+    def clone(self):
+        """
+        Lightweight copy of entity: parameters (specific consumptions, opex, capex, yields, initial capacity...), never
+        modified once entity is built, are shared; only scenario dependent state is allocated
+        :return: Entity
+        """
+        entity = copy(self)
+        entity.state = self.state.copy()
+        entity.total_capex = self.total_capex.copy()
+        return entity
+
     #@profile
     def reset(self):
         """
         Reset consumption and production based on sales plan schedule
         """
-        self.consumption = deepcopy(self.zero_consumption)
-        self.production = deepcopy(self.zero_production)
-        self.total_opex = self.zero_total_opex.copy()
+        self.state.reset()
         self.total_capex = self.capex.copy()
         self.cost_pv = 0
-        self.capacity = self.zero_capacities.copy()
 
     def get_data(self, randomize=False):
         if not randomize:
@@ -265,12 +322,12 @@ class Entity:
                 "Layer": str(self.layer).replace("PipelineLayer.", ""),
                 "Name": self.name,
                 "Location": self.get_location(),
-                "Capacity": self.capacity,
+                "Capacity": self.capacity.copy(),
                 "Cost PV": self.cost_pv,
-                "Opex": self.total_opex,
+                "Opex": self.total_opex.copy(),
                 "Capex": self.total_capex,
-                "Consumption": self.consumption,
-                "Production": self.production,
+                "Consumption": Entity.copy_volumes(self.consumption),
+                "Production": Entity.copy_volumes(self.production),
             }]
         # simulated data
         return [{
@@ -282,10 +339,18 @@ class Entity:
             "Cost PV": Utils.simulate_range(100000, 1000000),
             "Opex": Utils.simulate_series(self.total_opex, 100, 10000),
             "Capex": Utils.simulate_series(self.total_capex, 1000, 100000),
-            "Consumption": Utils.to_dict_and_simulate(self.consumption, "volume", 2, 100, 1000),
-            "Production": Utils.to_dict_and_simulate(self.production, "volume", 2, 50, 500),
+            "Consumption": Utils.to_dict_and_simulate(Entity.copy_volumes(self.consumption), "volume", 2, 100, 1000),
+            "Production": Utils.to_dict_and_simulate(Entity.copy_volumes(self.production), "volume", 2, 50, 500),
         }]
 
+    @staticmethod
+    def copy_volumes(volumes):
+        """
+        :param volumes: read-only view {item: {"volume": pd.Series, "unit": ""}}
+        :return: dict, snapshot of volumes
+        """
+        return {k: {"volume": v["volume"].copy(), "unit": v["unit"]} for k, v in volumes.items()}
+
     def get_cost_pv(self, randomize=False):
         if not randomize:
             return self.cost_pv if self.cost_pv is not None else 0
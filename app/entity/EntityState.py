@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+from types import MappingProxyType
+
+
+class EntityState:
+    """
+    Scenario dependent time series of an entity (capacity, total opex, consumption and production per product),
+    stored as the rows of one preallocated float64 matrix indexed by the entity timeline
+    """
+
+    __slots__ = ["timeline", "index", "keys", "rows", "matrix", "initial", "series", "volumes"]
+
+    CAPACITY = "Capacity"
+    TOTAL_OPEX = "Opex"
+    CONSUMPTION = "Consumption"
+    PRODUCTION = "Production"
+
+    def __init__(self, timeline, capacity, inputs, outputs=()):
+        """
+        :param timeline: sorted list of years
+        :param capacity: pd.Series, capacities over timeline
+        :param inputs: list of consumed items
+        :param outputs: list of produced items
+        """
+        self.timeline = timeline
+        self.index = pd.Index(timeline)
+        keys = [self.CAPACITY, self.TOTAL_OPEX] + \
+               [(self.CONSUMPTION, k) for k in inputs] + [(self.PRODUCTION, k) for k in outputs]
+        initial = np.zeros((len(keys), len(timeline)))
+        initial[0] = self.to_row(capacity)
+        self.build(keys, initial)
+
+    def build(self, keys, initial, matrix=None):
+        """
+        Allocates matrix and row views
+        :param keys: list of row keys
+        :param initial: np.array, values restored by reset
+        :param matrix: np.array, current values, copy of initial if None
+        :return: None
+        """
+        self.keys = list(keys)
+        self.rows = {key: i for i, key in enumerate(self.keys)}
+        self.initial = initial
+        self.matrix = initial.copy() if matrix is None else matrix
+        self.series = [pd.Series(self.matrix[i], index=self.index, copy=False) for i in range(len(self.keys))]
+        self.volumes = {
+            kind: MappingProxyType({key[1]: MappingProxyType({"volume": self.series[i], "unit": ""})
+                                    for i, key in enumerate(self.keys) if isinstance(key, tuple) and key[0] == kind})
+            for kind in [self.CONSUMPTION, self.PRODUCTION]
+        }
+
+    def add_rows(self, keys):
+        """
+        Appends zero rows, to be called while building entity
+        :param keys: list of row keys
+        :return: None
+        """
+        keys = [key for key in keys if key not in self.rows]
+        if len(keys) == 0:
+            return
+        zeros = np.zeros((len(keys), len(self.timeline)))
+        self.build(self.keys + keys, np.vstack([self.initial, zeros]), np.vstack([self.matrix, zeros]))
+
+    def to_row(self, values):
+        """
+        :param values: pd.Series (aligned on timeline), np.array or scalar
+        :return: np.array or scalar
+        """
+        if isinstance(values, pd.Series):
+            if not values.index.equals(self.index):
+                values = values.reindex(self.index)
+            return values.values
+        return values
+
+    def get(self, key):
+        """
+        :param key: row key
+        :return: np.array, view on row
+        """
+        return self.matrix[self.rows[key]]
+
+    def get_initial(self, key):
+        """
+        :param key: row key
+        :return: np.array, value of row after reset
+        """
+        return self.initial[self.rows[key]]
+
+    def view(self, key):
+        """
+        :param key: row key
+        :return: pd.Series, view on row
+        """
+        return self.series[self.rows[key]]
+
+    def set(self, key, values, year=None):
+        """
+        :param key: row key
+        :param values: new values of row, or of year if given
+        :param year: int
+        :return: None
+        """
+        if year is None:
+            self.matrix[self.rows[key]] = self.to_row(values)
+        else:
+            self.matrix[self.rows[key], self.index.get_loc(year)] = values
+
+    def add(self, key, values):
+        """
+        :param key: row key
+        :param values: values added to row
+        :return: None
+        """
+        row = self.matrix[self.rows[key]]
+        row += self.to_row(values)
+
+    def copy(self):
+        """
+        :return: EntityState sharing timeline, keys and initial values, with its own copy of current values
+        """
+        state = EntityState.__new__(EntityState)
+        state.timeline = self.timeline
+        state.index = self.index
+        state.build(self.keys, self.initial, self.matrix.copy())
+        return state
+
+    def reset(self):
+        """
+        Restores initial values
+        :return: None
+        """
+        np.copyto(self.matrix, self.initial)
+
+    def __getstate__(self):
+        return self.timeline, self.keys, self.initial, self.matrix
+
+    def __setstate__(self, state):
+        self.timeline, keys, initial, matrix = state
+        self.index = pd.Index(self.timeline)
+        self.build(keys, initial, matrix)
@@ -22,8 +22,7 @@ class GranulationEntity(Entity):
         self.specific_consumptions = self.get_specific_consumptions(spec_cons, option, self.outputs, self.main_input, self.inputs) #TODO: correct hardcoded 'ACP29' once coproducts/byproducts correctly handled
         self.granulation_ratios = self.get_granulation_ratios(option, self.outputs, spec_prod)
         self.opex = self.calculate_opex_per_ton(option, spec_cons, rm_prices, self.outputs)
-        self.production = {k: {"volume": pd.Series([0]*len(self.timeline), index=self.timeline), "unit": ""} for k in self.outputs}
-        self.zero_production = {k: {"volume": pd.Series([0] * len(self.timeline), index=self.timeline), "unit": ""} for k in self.outputs}
+        self.set_products(self.outputs)
 
     @staticmethod
     def get_products(option):
@@ -31,7 +30,7 @@ class GranulationEntity(Entity):
 
     @staticmethod
     def get_granulation_ratios(option, outputs, spec_prod):
-        gr = spec_prod[spec_prod.Moniker == option.Moniker]
+        gr = Entity.get_moniker_rows(spec_prod, option.Moniker)
         d = dict()
         for product in outputs:
             ratio = gr[gr.Product == product]
@@ -40,13 +39,12 @@ class GranulationEntity(Entity):
         return d
 
     def get_specific_consumptions_in_out_item(self, spec_cons_df, option, product, input, item):
-        return spec_cons_df[(spec_cons_df.Moniker == option.Moniker) &
-                            (spec_cons_df.Product == product) &
-                            (spec_cons_df.Item == item)]['sc/opex']
+        spec_cons = Entity.get_moniker_rows(spec_cons_df, option.Moniker)
+        return spec_cons[(spec_cons.Product == product) & (spec_cons.Item == item)]['sc/opex']
 
     @staticmethod
     def calculate_opex_per_ton(option, spec_cons_df, rm_prices, outputs=None, inputs=None):
-        opex = spec_cons_df[(spec_cons_df.Moniker == option.Moniker)]
+        opex = Entity.get_moniker_rows(spec_cons_df, option.Moniker)
         d = dict()
         for output in outputs:
             opex_ = opex[opex.Product == output]
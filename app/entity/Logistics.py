@@ -26,12 +26,11 @@ class LogisticsEntity(Entity):
         self.outputs = ['Rock', 'Acid', 'Fertilizer']
         self.specific_consumptions = self.get_specific_consumptions(spec_cons, option, [self.product_class], 'All', self.inputs)
         self.opex = self.calculate_opex_per_ton(option, spec_cons, raw_materials, outputs=self.product_class)
-        self.production = {k: {"volume": pd.Series([0]*len(self.timeline), index=self.timeline), "unit": ""} for k in self.outputs}
-        self.zero_production = {k: {"volume": pd.Series([0] * len(self.timeline), index=self.timeline), "unit": ""} for k in self.outputs}
+        self.set_products(self.outputs)
 
     @staticmethod
     def calculate_opex_per_ton(option, spec_cons_df, rm_prices, outputs=None, inputs=None):
-        opex = spec_cons_df[(spec_cons_df.Moniker == option.Moniker)]
+        opex = Entity.get_moniker_rows(spec_cons_df, option.Moniker)
         if 'Total' in list(set(opex.Item)):
             o = opex[opex.Item == 'Total'].rename(columns={'sc/opex': 'opex'})
             return {outputs: o['opex']}
@@ -42,5 +41,5 @@ class LogisticsEntity(Entity):
 
     @staticmethod
     def get_specific_consumptions_in_out_item(spec_cons_df, option, product, input, item):
-        return spec_cons_df[(spec_cons_df.Moniker == option.Moniker) &
-                            (spec_cons_df.Item == item)]['sc/opex']
+        spec_cons = Entity.get_moniker_rows(spec_cons_df, option.Moniker)
+        return spec_cons[spec_cons.Item == item]['sc/opex']
@@ -25,14 +25,11 @@ class MineEntity(Entity):
         self.opex = self.calculate_opex_per_ton(option, spec_cons_opex, rm_prices)
 
         # Calculated and scenario dependent elements, to be reinitialized from one scenario to another
-        self.production = {"Raw Rock": {"volume": pd.Series([0] * len(self.timeline), index=self.timeline), "unit": ""}}
-
-        # Constants used for reinitialization from one scenario to another
-        self.zero_production = {"Raw Rock": {"volume": pd.Series([0] * len(self.timeline), index=self.timeline), "unit": ""}}
+        self.set_products(["Raw Rock"])
 
     @staticmethod
     def get_mine_composition(moniker, outputs, spec_prod):
-        composition = spec_prod[spec_prod.Moniker == moniker]
+        composition = Entity.get_moniker_rows(spec_prod, moniker)
         d = dict()
         for quality in outputs:
             c = composition[composition.Quality == quality]
@@ -42,7 +39,7 @@ class MineEntity(Entity):
 
     @staticmethod
     def calculate_opex_per_ton(option, spec_cons_df, rm_prices, outputs=None, inputs=None):
-        opex = spec_cons_df[(spec_cons_df.Moniker == option.Moniker)]
+        opex = Entity.get_moniker_rows(spec_cons_df, option.Moniker)
         if 'Total' in list(set(opex.Item)):
             o = opex[opex.Item == 'Total'].rename(columns={'sc/opex': 'opex'})
             s = o['opex']
@@ -54,8 +51,8 @@ class MineEntity(Entity):
 
     @staticmethod
     def get_products(option, spec_prod_df):
-        return list(spec_prod_df[(spec_prod_df.Moniker == option.Moniker)]['Quality'].unique())
+        return list(Entity.get_moniker_rows(spec_prod_df, option.Moniker)['Quality'].unique())
 
     def get_specific_consumptions_in_out_item(self, spec_cons_df, option, product, input, item):
-        return spec_cons_df[(spec_cons_df.Moniker == option.Moniker) &
-                            (spec_cons_df.Item == item)]['sc/opex']
+        spec_cons = Entity.get_moniker_rows(spec_cons_df, option.Moniker)
+        return spec_cons[spec_cons.Item == item]['sc/opex']
@@ -21,13 +21,12 @@ class PAPEntity(Entity):
         self.outputs = self.get_products(option, spec_prod)
         self.specific_consumptions = self.get_specific_consumptions(spec_cons, option, ['ACP 29'], self.main_input, self.inputs) #TODO: correct hardcoded 'ACP 29' once coproducts/byproducts correctly handled
         self.opex = self.calculate_opex_per_ton(option, spec_cons, rm_prices, outputs=['ACP 29'])
-        self.production = {k: {"volume": pd.Series([0]*len(self.timeline), index=self.timeline), "unit": ""} for k in self.outputs}
-        self.zero_production = {k: {"volume": pd.Series([0] * len(self.timeline), index=self.timeline), "unit": ""} for k in self.outputs}
+        self.set_products(self.outputs)
 
 
     @staticmethod
     def calculate_opex_per_ton(option, spec_cons_df, rm_prices, outputs=None, inputs=None):
-        opex = spec_cons_df[(spec_cons_df.Moniker == option.Moniker)]
+        opex = Entity.get_moniker_rows(spec_cons_df, option.Moniker)
         d = dict()
         for output in outputs:  # TODO handle byproducts
             opex = opex[opex.Product == output]
@@ -43,7 +42,4 @@ class PAPEntity(Entity):
         return d
 
     def get_specific_consumptions_in_out_item(self, spec_cons_df, option, product, input, item):
-        return spec_cons_df[(spec_cons_df.Moniker == option.Moniker) &
-                            (spec_cons_df.Product == product) &
-                            (spec_cons_df.Input == input) &
-                            (spec_cons_df.Item == item)]['sc/opex']
+        return TableIndex.of(spec_cons_df, TableIndex.SPEC_CONS_KEYS).get(option.Moniker, product, input, item)['sc/opex']
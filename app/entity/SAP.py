@@ -25,13 +25,12 @@ class SAPEntity(Entity):
         self.outputs = self.get_products(option, spec_prod)
         self.specific_consumptions = self.get_specific_consumptions(spec_cons_opex, option, ['ACS'], self.main_input, self.inputs)
         self.opex = self.calculate_opex_per_ton(option, spec_cons_opex, rm_prices, outputs=['ACS'])
-        self.production = {k: {"volume": pd.Series([0]*len(self.timeline), index=self.timeline), "unit": ""} for k in self.outputs}
-        self.zero_production = {k: {"volume": pd.Series([0] * len(self.timeline), index=self.timeline), "unit": ""} for k in self.outputs}
+        self.set_products(self.outputs)
 
 
     @staticmethod
     def calculate_opex_per_ton(option, spec_cons_df, rm_prices, outputs=None, inputs=None):
-        opex = spec_cons_df[(spec_cons_df.Moniker == option.Moniker)]
+        opex = Entity.get_moniker_rows(spec_cons_df, option.Moniker)
         d = dict()
         for output in outputs:  # TODO handle byproducts
             if 'Total' in list(set(opex.Item)):
@@ -46,5 +45,5 @@ class SAPEntity(Entity):
         return d
 
     def get_specific_consumptions_in_out_item(self, spec_cons_df, option, product, input, item):
-        return spec_cons_df[(spec_cons_df.Moniker == option.Moniker) &
-                            (spec_cons_df.Item == item)]['sc/opex']
+        spec_cons = Entity.get_moniker_rows(spec_cons_df, option.Moniker)
+        return spec_cons[spec_cons.Item == item]['sc/opex']
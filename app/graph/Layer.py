@@ -13,6 +13,7 @@ from app.entity.Entity import Entity
 from app.tools.Logger import logger_simulation as logger
 from app.graph.Node import ComboNode
 from app.tools.Utils import get_capacity, multidict
+from app.tools import Discounting
 
 
 class Layer:
@@ -411,7 +412,7 @@ class Layer:
                                 total_capex.index = total_capex.index + prod_start
                                 total_capex = total_capex.loc[[x in node.entity.timeline for x in total_capex.index]]
                                 total_yearly_expenses = total_opex.add(total_capex, fill_value=0)
-                                npv += np.npv(env.WACC, total_yearly_expenses)
+                                npv += Discounting.npv(total_yearly_expenses)
                             if np.count_nonzero(driver) == 0: break
                         df_key_npv = df_key_npv.append({'key': key, 'npv': npv}, ignore_index=True)
                     permutations_kept = df_key_npv.sort_values(by=['npv'], ascending=False).head(max_permutations_to_keep)
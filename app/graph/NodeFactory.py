@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 
-from copy import deepcopy
 from app.graph.Node import Node, MineBeneficiationEntity
 from app.graph.Layer import Layer, ComboLayer
 from app.config.env import *
@@ -42,7 +41,7 @@ class NodeFactory:
                     entity.signature = signature_counter
                     id_counter = 1
                     for i in range(int(entity.max_number)):
-                        e = deepcopy(entity)
+                        e = entity.clone()
                         e.id_number = id_counter
                         e.name = e.location + '/' + str(e.nominal_capacity) + '/NEW' + str(id_counter)
                         tokens = entity.moniker.split(env.MONIKER_SEPARATOR)
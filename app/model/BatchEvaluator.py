@@ -0,0 +1,656 @@
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+
+import app.config.env as env
+from app.entity.Entity import Entity
+from app.entity.EntityState import EntityState
+from app.entity.MineBeneficiation import MineBeneficiationEntity
+from app.tools.Logger import logger_simulation as logger
+from app.tools import Discounting
+
+
+class ScenarioBatch:
+    """
+    State of a batch of scenarios: every time series of every entity is a row of an array
+    of shape (scenarios, entities, years)
+    """
+
+    def __init__(self, scenarios, capacity, details=True):
+        """
+        ctor
+        :param scenarios: list of scenarios (list of layers, a layer being a list of nodes)
+        :param capacity: np.array (entities, years), initial capacities
+        :param details: boolean, keep track of input balances of mines and beneficiations
+        """
+        self.details = details
+        self.scenarios = scenarios
+        self.size = len(scenarios)
+        self.depth = max(len(scenario) for scenario in scenarios)
+        self.rows = np.arange(self.size)
+        self.capacity = np.repeat(capacity[np.newaxis], self.size, axis=0)
+        self.total_opex = np.zeros(self.capacity.shape)
+        self.production = {}
+        self.consumption = {}
+        self.sublayers = {}
+
+    def get_production(self, product):
+        """
+        Production array of a product, created on first use
+        :param product: str
+        :return: np.array (scenarios, entities, years)
+        """
+        if product not in self.production:
+            self.production[product] = np.zeros(self.capacity.shape)
+        return self.production[product]
+
+    def get_consumption(self, input_):
+        """
+        Consumption array of an input, created on first use
+        :param input_: str
+        :return: np.array (scenarios, entities, years)
+        """
+        if input_ not in self.consumption:
+            self.consumption[input_] = np.zeros(self.capacity.shape)
+        return self.consumption[input_]
+
+
+class BatchEvaluator:
+    """
+    Vectorized evaluation of scenarios sharing the same granulation couple.
+    Follows the same allocation rules as Simulator.flow_upstream, but scenarios are stacked so that
+    capacity allocation, opex, capex shift and NPV are computed in bulk.
+    """
+
+    def __init__(self, nodes):
+        """
+        ctor
+        :param nodes: dictionary of nodes per layer, as built by NodeFactory
+        """
+        excluded_layers = [env.PipelineLayer.GRANULATION, env.PipelineLayer.LOGISTICS]
+        counted = [entity for entity in Entity.ENTITIES.values() if entity.layer not in excluded_layers]
+        self.threads = [node.entity for node in nodes.get(env.PipelineLayer.MINE_BENEFICIATION, [])]
+
+        # entities are indexed in registry order, then entities only referenced by nodes (not accounted for)
+        self.entities = []
+        self.index = {}
+        for entity in counted:
+            self.add_entity(entity)
+        n_counted = len(self.entities)
+        for layer in nodes:
+            if layer in excluded_layers or layer == env.PipelineLayer.MINE_BENEFICIATION:
+                continue
+            for node in nodes[layer]:
+                self.add_entity(node.entity)
+        for thread in self.threads:
+            for entity in [thread.mine, thread.beneficiation]:
+                self.add_entity(entity)
+                if entity.base_entity is not None:
+                    self.add_entity(entity.base_entity)
+        self.counted = np.arange(len(self.entities)) < n_counted
+
+        if len(self.entities) == 0:
+            logger.error("No entity to evaluate")
+            raise Exception("No entity to evaluate")
+        self.timeline = self.entities[0].timeline
+        for entity in self.entities:
+            if entity.timeline != self.timeline:
+                logger.error("Entity %s has timeline %s, expected %s" % (entity.moniker, entity.timeline, self.timeline))
+                raise Exception("Batch evaluation requires a common timeline for all entities")
+        self.years = np.array(self.timeline)
+        self.index = pd.Index(self.timeline)
+        self.compounding = Discounting.compounding_factors(env.WACC, len(self.timeline))
+
+        n = len(self.entities)
+        self.capacity = np.array([entity.state.get_initial(EntityState.CAPACITY) for entity in self.entities])
+        self.nominal = np.array([entity.nominal_capacity for entity in self.entities])
+        self.upstream = np.array([entity.layer in [env.PipelineLayer.MINE, env.PipelineLayer.BENEFICIATION]
+                                  for entity in self.entities])
+
+        # opex of raw rock for mines, opex per product for other layers (in specific consumptions order)
+        self.mine_opex = np.full((n, len(self.timeline)), np.nan)
+        self.opex_slots = []
+        slots = {}
+        for e, entity in enumerate(self.entities):
+            if entity.layer == env.PipelineLayer.MINE:
+                self.mine_opex[e] = self.to_array(entity.opex['Raw Rock'])
+            elif not self.upstream[e] and entity.specific_consumptions is not None:
+                produced_list = [produced for produced in entity.specific_consumptions.keys()
+                                 if produced in entity.production.keys() and produced in entity.opex.keys()]
+                for rank, produced in enumerate(produced_list):
+                    slots.setdefault((rank, produced), []).append(e)
+        for rank, produced in sorted(slots.keys(), key=lambda key: key[0]):
+            entities = np.array(slots[(rank, produced)])
+            coefficients = np.array([self.to_array(self.entities[e].opex[produced]) for e in entities])
+            self.opex_slots.append((produced, entities, coefficients))
+
+        # capex offsets, to be shifted by the first year of production
+        self.capex = []
+        for e, entity in enumerate(self.entities):
+            if len(entity.capex) > 0:
+                self.capex.append((e, np.array(entity.capex.index, dtype=float), np.array(entity.capex.values, dtype=float)))
+
+        # production keys
+        self.products = sorted(set(product for entity in self.entities for product in entity.production.keys()))
+        self.production_keys = np.zeros((n, len(self.products)), dtype=bool)
+        for e, entity in enumerate(self.entities):
+            for product in entity.production.keys():
+                self.production_keys[e, self.products.index(product)] = True
+
+        # threads
+        self.thread_index = {id(thread): t for t, thread in enumerate(self.threads)}
+        self.thread_mine = np.array([self.index[id(thread.mine)] for thread in self.threads], dtype=int)
+        self.thread_beneficiation = np.array([self.index[id(thread.beneficiation)] for thread in self.threads], dtype=int)
+        self.thread_mine_base = np.array([self.get_index(thread.mine.base_entity) for thread in self.threads], dtype=int)
+        self.thread_beneficiation_base = np.array([self.get_index(thread.beneficiation.base_entity)
+                                                   for thread in self.threads], dtype=int)
+        self.raw_rock_consumption = {}
+        self.wp_opex = {}
+        self.base_wp_opex = {}
+        self.wp_specific_consumption = {}
+        self.base_wp_specific_consumption = {}
+        self.thread_keys = []
+        self.thread_keys_code = np.zeros(len(self.threads), dtype=int)
+        for t, thread in enumerate(self.threads):
+            for product in thread.raw_rock_consumption:
+                self.get_thread_table(self.raw_rock_consumption, product)[t] = \
+                    self.to_array(thread.raw_rock_consumption[product])
+            keys = (tuple(thread.wp_equivalent_opex.keys()), tuple(thread.beneficiation.inputs))
+            if keys not in self.thread_keys:
+                self.thread_keys.append(keys)
+            self.thread_keys_code[t] = self.thread_keys.index(keys)
+            for product in keys[0]:
+                self.get_thread_table(self.wp_opex, product)[t] = self.to_array(thread.wp_equivalent_opex[product])
+                for input_ in keys[1]:
+                    self.get_thread_table(self.wp_specific_consumption, (product, input_))[t] = \
+                        self.to_array(thread.wp_equivalent_specific_consumption[product][input_])
+            if thread.beneficiation.base_entity is not None:
+                base_specific_consumption, base_opex = \
+                    MineBeneficiationEntity.get_wp_specific_consumptions(thread.mine,
+                                                                         thread.beneficiation.base_entity,
+                                                                         thread.raw_rock_consumption)
+                for product in keys[0]:
+                    self.get_thread_table(self.base_wp_opex, product)[t] = self.to_array(base_opex[product])
+                    for input_ in keys[1]:
+                        self.get_thread_table(self.base_wp_specific_consumption, (product, input_))[t] = \
+                            self.to_array(base_specific_consumption[product][input_])
+
+        # specific consumptions of mines, used for input balances
+        self.mine_specific_consumption = {}
+        self.mine_inputs = {}
+        for e, entity in enumerate(self.entities):
+            if entity.layer == env.PipelineLayer.MINE:
+                for input_ in entity.inputs:
+                    if input_ not in self.mine_specific_consumption:
+                        self.mine_specific_consumption[input_] = np.full((n, len(self.timeline)), np.nan)
+                        self.mine_inputs[input_] = np.zeros(n, dtype=bool)
+                    self.mine_specific_consumption[input_][e] = \
+                        self.to_array(entity.specific_consumptions['Raw Rock']['All'][input_])
+                    self.mine_inputs[input_][e] = True
+
+        self.main_inputs = []
+        self.propagation = {}
+        self.balances = {}
+
+    def add_entity(self, entity):
+        """
+        Index entity if not already indexed
+        :param entity: Entity
+        :return: None
+        """
+        if id(entity) not in self.index:
+            self.index[id(entity)] = len(self.entities)
+            self.entities.append(entity)
+
+    def get_index(self, entity):
+        """
+        :param entity: Entity or None
+        :return: int, -1 if entity is None
+        """
+        return -1 if entity is None else self.index[id(entity)]
+
+    def get_thread_table(self, tables, product):
+        """
+        Per thread time series of a product, created on first use
+        :param tables: dictionary
+        :param product: str
+        :return: np.array (threads, years)
+        """
+        if product not in tables:
+            tables[product] = np.full((len(self.threads), len(self.timeline)), np.nan)
+        return tables[product]
+
+    def to_array(self, values):
+        """
+        Align time series on timeline
+        :param values: pd.Series or scalar
+        :return: np.array (years)
+        """
+        if isinstance(values, pd.Series):
+            return np.asarray(values.reindex(self.timeline), dtype=float)
+        return np.full(len(self.timeline), values, dtype=float)
+
+    def to_series(self, values):
+        """
+        :param values: np.array (years)
+        :return: pd.Series indexed by timeline, as entity state series
+        """
+        return pd.Series(np.array(values, dtype=float), index=self.index)
+
+    @staticmethod
+    def non_zero(values):
+        """
+        Rows with at least one non zero value, as np.count_nonzero on each row
+        :param values: np.array (scenarios, years)
+        :return: np.array (scenarios) of booleans
+        """
+        return np.count_nonzero(values, axis=1) != 0
+
+    def get_propagation(self, product):
+        """
+        Coefficients used to propagate the production of a product upstream
+        :param product: str
+        :return: tuple(defined, main input code, main input coefficients, has ACS, ACS coefficients)
+        """
+        if product not in self.propagation:
+            n = len(self.entities)
+            defined = np.zeros(n, dtype=bool)
+            main_code = np.full(n, -1, dtype=int)
+            main_coefficients = np.full((n, len(self.timeline)), np.nan)
+            has_acs = np.zeros(n, dtype=bool)
+            acs_coefficients = np.full((n, len(self.timeline)), np.nan)
+            for e, entity in enumerate(self.entities):
+                if entity.specific_consumptions is None or product not in entity.specific_consumptions:
+                    continue
+                defined[e] = True
+                consumptions = entity.specific_consumptions[product][entity.main_input]
+                if entity.main_input != 'All':
+                    if entity.main_input not in self.main_inputs:
+                        self.main_inputs.append(entity.main_input)
+                    main_code[e] = self.main_inputs.index(entity.main_input)
+                    main_coefficients[e] = self.to_array(consumptions[entity.main_input])
+                if 'ACS' in consumptions.keys():
+                    has_acs[e] = True
+                    acs_coefficients[e] = self.to_array(consumptions['ACS'])
+            self.propagation[product] = (defined, main_code, main_coefficients, has_acs, acs_coefficients)
+        return self.propagation[product]
+
+    def get_sublayer(self, batch, position, product):
+        """
+        Entities (or threads) producing product at given position of every scenario, in scenario order
+        :param batch: ScenarioBatch
+        :param position: int, layer position in scenarios
+        :param product: str
+        :return: tuple(np.array of booleans (scenarios), np.array of booleans (scenarios), np.array (scenarios, k))
+        """
+        key = (position, product)
+        if key not in batch.sublayers:
+            produces = np.zeros(batch.size, dtype=bool)
+            combo = np.zeros(batch.size, dtype=bool)
+            ids = []
+            for s, scenario in enumerate(batch.scenarios):
+                sublayer = [node.entity for node in scenario[position] if product in node.entity.outputs] \
+                    if position < len(scenario) else []
+                produces[s] = len(sublayer) > 0
+                combo[s] = produces[s] and sublayer[0].layer == env.PipelineLayer.MINE_BENEFICIATION
+                if combo[s]:
+                    row = [self.thread_index[id(entity)] for entity in sublayer]
+                else:
+                    row = [self.index[id(entity)] for entity in sublayer]
+                ids.append(row)
+            array = np.full((batch.size, max(len(row) for row in ids)), -1, dtype=int)
+            for s, row in enumerate(ids):
+                array[s, :len(row)] = row
+            batch.sublayers[key] = (produces, combo, array)
+        return batch.sublayers[key]
+
+    def flow_upstream(self, batch, position, product, demand):
+        """
+        Flow upstream in the scenarios and transform products along the way
+        :param batch: ScenarioBatch
+        :param position: int, position of the first layer to consider
+        :param product: output product
+        :param demand: np.array (scenarios, years)
+        :return: None
+        """
+        if position >= batch.depth or np.count_nonzero(demand) == 0:
+            return
+        produces, combo, ids = self.get_sublayer(batch, position, product)
+        if not produces.all():
+            self.flow_upstream(batch, position + 1, product, np.where(produces[:, np.newaxis], 0., demand))
+        if not produces.any():
+            return
+        demand = np.where(produces[:, np.newaxis], demand, 0.)
+        if combo.any():
+            self.allocate_threads(batch, product, np.where(combo[:, np.newaxis], demand, 0.), ids)
+        if not combo.all():
+            allocations = self.allocate_entities(batch, product, np.where(combo[:, np.newaxis], 0., demand), ids)
+            defined, main_code, main_coefficients, has_acs, acs_coefficients = self.get_propagation(product)
+            for recorded, e, produced in allocations:
+                if not recorded.any():
+                    continue
+                if not defined[e[recorded]].all():
+                    logger.error("Missing specific consumptions of %s" % product)
+                    raise KeyError(product)
+                codes = main_code[e]
+                for code in np.unique(codes[recorded]):
+                    if code < 0:
+                        continue
+                    selected = (recorded & (codes == code))[:, np.newaxis]
+                    self.flow_upstream(batch, position + 1, self.main_inputs[code],
+                                       np.where(selected, produced * main_coefficients[e], 0.))
+                selected = (recorded & has_acs[e])[:, np.newaxis]
+                if selected.any():
+                    self.flow_upstream(batch, position + 1, 'ACS', np.where(selected, produced * acs_coefficients[e], 0.))
+
+    def allocate_entities(self, batch, product, demand, ids):
+        """
+        Fill production of entities in scenario order, taking into account needs and capacities
+        :param batch: ScenarioBatch
+        :param product: str
+        :param demand: np.array (scenarios, years)
+        :param ids: np.array (scenarios, k) of entity indexes
+        :return: list of tuples(recorded rows, entity indexes, produced) per position in layer
+        """
+        rows = batch.rows
+        production = batch.get_production(product)
+        allocations = []
+        for k in range(ids.shape[1]):
+            active = (ids[:, k] >= 0) & self.non_zero(demand)
+            if not active.any():
+                continue
+            e = np.where(active, ids[:, k], 0)
+            produced = np.maximum(0, np.minimum(demand, batch.capacity[rows, e]))
+            recorded = active & self.non_zero(produced)
+            r, er, p = rows[recorded], e[recorded], produced[recorded]
+            production[r, er] = production[r, er] + p
+            demand[recorded] = demand[recorded] - p
+            batch.capacity[r, er] = batch.capacity[r, er] - p
+            allocations.append((recorded, e, produced))
+        return allocations
+
+    def allocate_threads(self, batch, product, demand, ids):
+        """
+        Fill production of mine/beneficiation threads, base entities first, then extensions
+        :param batch: ScenarioBatch
+        :param product: str
+        :param demand: np.array (scenarios, years)
+        :param ids: np.array (scenarios, k) of thread indexes
+        :return: None
+        """
+        rows = batch.rows
+        for k in range(ids.shape[1]):
+            active = (ids[:, k] >= 0) & self.non_zero(demand)
+            if not active.any():
+                continue
+            t = np.where(active, ids[:, k], 0)
+            consumption = self.raw_rock_consumption[product][t]
+            mine, beneficiation = self.thread_mine[t], self.thread_beneficiation[t]
+            mine_base, beneficiation_base = self.thread_mine_base[t], self.thread_beneficiation_base[t]
+            has_mine_base, has_beneficiation_base = mine_base >= 0, beneficiation_base >= 0
+            first_mine = np.where(has_mine_base, mine_base, mine)
+            first_beneficiation = np.where(has_beneficiation_base, beneficiation_base, beneficiation)
+            capa_mine_constrained, capa_wp_constrained = \
+                self.produce_in_threads(batch, product, demand, consumption, active, first_mine, first_beneficiation,
+                                        batch.capacity[rows, first_mine], batch.capacity[rows, first_beneficiation])
+
+            extend = active & self.non_zero(demand) & (
+                (has_mine_base & has_beneficiation_base) |
+                (has_mine_base & ~has_beneficiation_base & np.any(capa_mine_constrained < capa_wp_constrained, axis=1)) |
+                (~has_mine_base & has_beneficiation_base & np.any(capa_wp_constrained < capa_mine_constrained, axis=1)))
+            if extend.any():
+                mine_capacity = batch.capacity[rows, mine]
+                beneficiation_capacity = batch.capacity[rows, beneficiation]
+                mine_capacity = np.where(has_mine_base[:, np.newaxis],
+                                         np.maximum(mine_capacity - self.nominal[mine_base][:, np.newaxis], 0),
+                                         mine_capacity)
+                beneficiation_capacity = np.where(has_beneficiation_base[:, np.newaxis],
+                                                  np.maximum(beneficiation_capacity -
+                                                             self.nominal[beneficiation_base][:, np.newaxis], 0),
+                                                  beneficiation_capacity)
+                self.produce_in_threads(batch, product, demand, consumption, extend, mine, beneficiation,
+                                        mine_capacity, beneficiation_capacity)
+
+    @staticmethod
+    def produce_in_threads(batch, product, demand, consumption, mask, mine, beneficiation,
+                           mine_capacity, beneficiation_capacity):
+        """
+        Dispatch production on a mine and a beneficiation for every selected scenario, updates demand in place
+        :return: couple(capacity constrained by mine, capacity constrained by beneficiation)
+        """
+        capa_mine_constrained = mine_capacity / consumption
+        capa_wp_constrained = beneficiation_capacity / consumption
+        produced = np.maximum(0, np.minimum(demand, np.minimum(capa_mine_constrained, capa_wp_constrained)))
+        recorded = mask & BatchEvaluator.non_zero(produced)
+        if recorded.any():
+            r, m, b = batch.rows[recorded], mine[recorded], beneficiation[recorded]
+            rock = produced[recorded] * consumption[recorded]
+            demand[recorded] = demand[recorded] - produced[recorded]
+            batch.capacity[r, m] = batch.capacity[r, m] - rock
+            batch.capacity[r, b] = batch.capacity[r, b] - rock
+            raw_rock = batch.get_production('Raw Rock')
+            raw_rock[r, m] = raw_rock[r, m] + rock
+            production = batch.get_production(product)
+            production[r, b] = production[r, b] + rock
+        return capa_mine_constrained, capa_wp_constrained
+
+    def get_last_threads(self, batch):
+        """
+        :param batch: ScenarioBatch
+        :return: np.array (scenarios, k) of thread indexes of the last layer of every scenario
+        """
+        ids = [[self.thread_index[id(node.entity)] for node in scenario[-1]] for scenario in batch.scenarios]
+        array = np.full((batch.size, max(len(row) for row in ids)), -1, dtype=int)
+        for s, row in enumerate(ids):
+            array[s, :len(row)] = row
+        return array
+
+    def rebalance(self, batch, mask, extension, base):
+        """
+        Move base entity production to its extension from the year the extension starts producing
+        :param batch: ScenarioBatch
+        :param mask: np.array of booleans (scenarios)
+        :param extension: np.array (scenarios) of entity indexes
+        :param base: np.array (scenarios) of entity indexes
+        :return: None
+        """
+        rows = batch.rows
+        n_years = len(self.timeline)
+        start = np.full(batch.size, n_years)
+        complete = np.ones(batch.size, dtype=bool)
+        for p, product in enumerate(self.products):
+            owns = mask & self.production_keys[extension, p]
+            if not owns.any():
+                continue
+            positive = batch.get_production(product)[rows, extension] > 0
+            found = positive.any(axis=1)
+            complete &= ~owns | found
+            start = np.where(owns & found, np.minimum(start, positive.argmax(axis=1)), start)
+        start = np.where(complete, start, n_years)
+        heaviside = (np.arange(n_years)[np.newaxis] >= start[:, np.newaxis]).astype(float)
+        for p, product in enumerate(self.products):
+            owns = mask & self.production_keys[extension, p]
+            if not owns.any():
+                continue
+            production = batch.get_production(product)
+            r, ext, bs, h = rows[owns], extension[owns], base[owns], heaviside[owns]
+            base_production = production[r, bs]
+            production[r, ext] = production[r, ext] + base_production * h
+            production[r, bs] = base_production * (1 - h)
+
+    def rebalance_threads(self, batch, threads):
+        """
+        Rebalance production in threads, and compute opex (and input balances if needed) of mines and beneficiations
+        :param batch: ScenarioBatch
+        :param threads: np.array (scenarios, k) of thread indexes
+        :return: None
+        """
+        rows = batch.rows
+        raw_rock = batch.get_production('Raw Rock')
+        for k in range(threads.shape[1]):
+            valid = threads[:, k] >= 0
+            t = np.where(valid, threads[:, k], 0)
+            mine, beneficiation = self.thread_mine[t], self.thread_beneficiation[t]
+            mine_base, beneficiation_base = self.thread_mine_base[t], self.thread_beneficiation_base[t]
+            self.rebalance(batch, valid & (beneficiation_base >= 0), beneficiation, beneficiation_base)
+            self.rebalance(batch, valid & (mine_base >= 0), mine, mine_base)
+
+            with_base = valid & (mine_base >= 0)
+            r, m = rows[valid], mine[valid]
+            batch.total_opex[r, m] = raw_rock[r, m] * self.mine_opex[m]
+            r, m, mb = rows[with_base], mine[with_base], mine_base[with_base]
+            batch.total_opex[r, mb] = raw_rock[r, m] * self.mine_opex[m]
+            if batch.details:
+                for input_, specific_consumption in self.mine_specific_consumption.items():
+                    for selected, entities in [(valid, mine), (with_base, mine_base)]:
+                        selected = selected & self.mine_inputs[input_][entities]
+                        r, me = rows[selected], entities[selected]
+                        consumption = batch.get_consumption(input_)
+                        consumption[r, me] = consumption[r, me] + raw_rock[r, me] * specific_consumption[me]
+
+            codes = self.thread_keys_code[t]
+            for code in np.unique(codes[valid]):
+                selected = valid & (codes == code)
+                with_base = selected & (beneficiation_base >= 0)
+                products, inputs = self.thread_keys[code]
+                for product in products:
+                    production = batch.get_production(product)
+                    for mask, entities, opex, specific_consumption in [
+                            (selected, beneficiation, self.wp_opex, self.wp_specific_consumption),
+                            (with_base, beneficiation_base, self.base_wp_opex, self.base_wp_specific_consumption)]:
+                        r, b, tt = rows[mask], entities[mask], t[mask]
+                        batch.total_opex[r, b] = batch.total_opex[r, b] + production[r, b] * opex[product][tt]
+                        if batch.details:
+                            for input_ in inputs:
+                                consumption = batch.get_consumption(input_)
+                                consumption[r, b] = consumption[r, b] + \
+                                                    production[r, b] * specific_consumption[(product, input_)][tt]
+
+    def evaluate(self, scenarios, drivers, base_cost_pv=0., details=True):
+        """
+        Compute cost PV of a batch of scenarios
+        :param scenarios: list of scenarios (list of layers, a layer being a list of nodes)
+        :param drivers: list of couples (product, driver), flowed upstream in this order
+        :param base_cost_pv: float, cost PV shared by all scenarios (granulation layer)
+        :param details: boolean, build detailed results
+        :return: couple(np.array of cost PV, list of detailed results per scenario or None)
+        """
+        batch = ScenarioBatch(scenarios, self.capacity, details)
+        for product, driver in drivers:
+            demand = np.repeat(self.to_array(driver)[np.newaxis], batch.size, axis=0)
+            self.flow_upstream(batch, 0, product, demand)
+        self.rebalance_threads(batch, self.get_last_threads(batch))
+
+        # opex of non mine/beneficiation entities
+        for produced, entities, coefficients in self.opex_slots:
+            production = batch.get_production(produced)
+            batch.total_opex[:, entities] = batch.total_opex[:, entities] + \
+                                            production[:, entities] * coefficients[np.newaxis]
+
+        has_produced = np.zeros((batch.size, len(self.entities)), dtype=bool)
+        for production in batch.production.values():
+            has_produced |= (production > 0).any(axis=2)
+        has_produced &= self.counted[np.newaxis]
+
+        # capex shifted by first year of production
+        positive = batch.total_opex > 0
+        started = positive.any(axis=2)
+        first_year = self.years[positive.argmax(axis=2)]
+        total_capex = np.full(batch.total_opex.shape, np.nan)
+        for e, offsets, values in self.capex:
+            years = first_year[:, e, np.newaxis] + offsets[np.newaxis]
+            columns = np.minimum(np.searchsorted(self.years, years), len(self.years) - 1)
+            kept = (self.years[columns] == years) & started[:, e, np.newaxis]
+            r, c = np.nonzero(kept)
+            total_capex[r, e, columns[r, c]] = values[c]
+
+        opex_missing, capex_missing = np.isnan(batch.total_opex), np.isnan(total_capex)
+        total_yearly_expenses = np.where(opex_missing & capex_missing, np.nan,
+                                         np.where(opex_missing, 0., batch.total_opex) +
+                                         np.where(capex_missing, 0., total_capex))
+        cost_pv = (total_yearly_expenses / self.compounding).sum(axis=2)
+
+        scenarios_cost_pv = np.full(batch.size, base_cost_pv, dtype=float)
+        for e in np.flatnonzero(has_produced.any(axis=0)):
+            scenarios_cost_pv = scenarios_cost_pv + np.where(has_produced[:, e], cost_pv[:, e], 0.)
+
+        if not details:
+            return scenarios_cost_pv, None
+        results = []
+        for s in range(batch.size):
+            results.append([self.get_data(batch, s, e, cost_pv[s, e], int(first_year[s, e]) if started[s, e] else None)
+                            for e in np.flatnonzero(has_produced[s])])
+        return scenarios_cost_pv, results
+
+    def get_balances(self, e):
+        """
+        Coefficients used for input balances and secondary products of a non mine/beneficiation entity
+        :param e: int, entity index
+        :return: couple(list of (input, list of (produced, coefficients)), list of (product, main product, coefficients))
+        """
+        if e not in self.balances:
+            entity = self.entities[e]
+            inputs = []
+            for input_ in entity.inputs:
+                coefficients = []
+                for produced in entity.specific_consumptions.keys():
+                    specific_consumption = entity.specific_consumptions[produced][entity.main_input][input_]
+                    if len(specific_consumption) > 0:
+                        coefficients.append((produced, self.to_array(specific_consumption)))
+                inputs.append((input_, coefficients))
+            secondary = []
+            if entity.secondary_products is not None:
+                main_product = list(entity.specific_consumptions.keys())[0]
+                for product in entity.production.keys():
+                    if product in entity.secondary_products:
+                        secondary.append((product, main_product,
+                                          self.to_array(entity.secondary_products_spec_prod[product])))
+            self.balances[e] = (inputs, secondary)
+        return self.balances[e]
+
+    def get_data(self, batch, s, e, cost_pv, first_year):
+        """
+        Detailed results of an entity in a scenario, same fields and types as Entity.get_data (pd.Series by year)
+        :param batch: ScenarioBatch
+        :param s: int, scenario index in batch
+        :param e: int, entity index
+        :param cost_pv: float
+        :param first_year: int, first year of production, None if entity has no opex
+        :return: dictionary
+        """
+        entity = self.entities[e]
+        production = {product: batch.get_production(product)[s, e] for product in entity.production.keys()}
+        if self.upstream[e]:
+            consumption = {input_: batch.get_consumption(input_)[s, e] for input_ in entity.inputs}
+        else:
+            inputs, secondary = self.get_balances(e)
+            consumption = {}
+            for input_, coefficients in inputs:
+                consumption[input_] = np.zeros(len(self.timeline))
+                for produced, specific_consumption in coefficients:
+                    consumption[input_] = consumption[input_] + production[produced] * specific_consumption
+            for product, main_product, specific_production in secondary:
+                production[product] = production[main_product] * specific_production
+        # as Entity.compute_total_capex
+        if first_year is None:
+            total_capex = pd.Series([])
+        else:
+            total_capex = entity.capex.copy()
+            total_capex.index += first_year
+            total_capex = total_capex.loc[total_capex.index.isin(self.timeline)]
+        return {
+            "Moniker": entity.moniker,
+            "Layer": str(entity.layer).replace("PipelineLayer.", ""),
+            "Name": entity.name,
+            "Location": entity.get_location(),
+            "Capacity": self.to_series(batch.capacity[s, e]),
+            "Cost PV": cost_pv,
+            "Opex": self.to_series(batch.total_opex[s, e]),
+            "Capex": total_capex,
+            "Consumption": {input_: {"volume": self.to_series(volume), "unit": ""}
+                            for input_, volume in consumption.items()},
+            "Production": {product: {"volume": self.to_series(volume), "unit": ""}
+                           for product, volume in production.items()},
+        }
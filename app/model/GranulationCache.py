@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+import time
+import app.config.env as env
+from app.tools.Logger import logger_simulation as logger
+
+
+class GranulationCache:
+    """
+    Content addressed cache of granulation LP solutions, shared among workers through memcached or local disk.
+    The first worker missing a key claims it, solves and publishes; other workers wait for the published solution.
+    """
+
+    def __init__(self, cache_type=None, folder=None, timeout=None):
+        """
+        ctor
+        :param cache_type: GranulationCacheType, env.GRANULATION_CACHE if None
+        :param folder: String, folder of disk cache, env.GRANULATION_CACHE_FOLDER if None
+        :param timeout: int, seconds before a claim expires, env.GRANULATION_CACHE_TIMEOUT if None
+        """
+        self.cache_type = env.GRANULATION_CACHE if cache_type is None else cache_type
+        self.folder = env.GRANULATION_CACHE_FOLDER if folder is None else folder
+        self.timeout = env.GRANULATION_CACHE_TIMEOUT if timeout is None else timeout
+        self.client = None
+        if self.cache_type == env.GranulationCacheType.MEMCACHED:
+            from app.server.ClientMemcached import memcached_client
+            self.client = memcached_client
+        elif self.cache_type == env.GranulationCacheType.DISK:
+            os.makedirs(self.folder, exist_ok=True)
+
+    def enabled(self):
+        return self.cache_type != env.GranulationCacheType.NONE
+
+    def disable(self, error):
+        """
+        Falls back to solving every LP locally
+        :param error: Exception
+        :return: None
+        """
+        logger.warning("Granulation cache disabled: %s" % error)
+        self.cache_type = env.GranulationCacheType.NONE
+
+    def get_path(self, key, suffix=".json"):
+        return os.path.join(self.folder, key + suffix)
+
+    def get(self, key):
+        """
+        :param key: String
+        :return: dictionary {"status": int, "values": {variable name: value}}, None if missing
+        """
+        try:
+            if self.cache_type == env.GranulationCacheType.MEMCACHED:
+                return self.client.get(key)
+            if self.cache_type == env.GranulationCacheType.DISK:
+                path = self.get_path(key)
+                if not os.path.exists(path):
+                    return None
+                with open(path) as f:
+                    return json.load(f)
+        except Exception as e:
+            self.disable(e)
+        return None
+
+    def claim(self, key):
+        """
+        Atomically marks key as being solved
+        :param key: String
+        :return: boolean, True if caller has to solve and publish
+        """
+        try:
+            if self.cache_type == env.GranulationCacheType.MEMCACHED:
+                return self.client.add(key + "_claim", "1", expire=self.timeout, noreply=False)
+            if self.cache_type == env.GranulationCacheType.DISK:
+                path = self.get_path(key, ".claim")
+                if os.path.exists(path) and time.time() - os.path.getmtime(path) > self.timeout:
+                    os.remove(path)
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+        except FileExistsError:
+            return False
+        except Exception as e:
+            self.disable(e)
+        return True
+
+    def release(self, key):
+        """
+        :param key: String
+        :return: None
+        """
+        try:
+            if self.cache_type == env.GranulationCacheType.MEMCACHED:
+                self.client.delete(key + "_claim")
+            elif self.cache_type == env.GranulationCacheType.DISK:
+                os.remove(self.get_path(key, ".claim"))
+        except Exception as e:
+            logger.warning("Granulation cache claim %s not released: %s" % (key, e))
+
+    def is_claimed(self, key):
+        if self.cache_type == env.GranulationCacheType.MEMCACHED:
+            return self.client.get(key + "_claim") is not None
+        return os.path.exists(self.get_path(key, ".claim"))
+
+    def publish(self, key, solution):
+        """
+        :param key: String
+        :param solution: dictionary {"status": int, "values": {variable name: value}}
+        :return: None
+        """
+        try:
+            if self.cache_type == env.GranulationCacheType.MEMCACHED:
+                self.client.set(key, solution)
+            elif self.cache_type == env.GranulationCacheType.DISK:
+                path = self.get_path(key)
+                with open(path + ".tmp%d" % os.getpid(), "w") as f:
+                    json.dump(solution, f)
+                os.replace(path + ".tmp%d" % os.getpid(), path)
+        except Exception as e:
+            self.disable(e)
+
+    def wait(self, key, delay=0.5):
+        """
+        Waits for solution claimed by another worker
+        :param key: String
+        :param delay: float, seconds between polls
+        :return: solution, None if claim is released or expired without solution
+        """
+        start = time.time()
+        try:
+            while time.time() - start < self.timeout:
+                solution = self.get(key)
+                if solution is not None or not self.enabled() or not self.is_claimed(key):
+                    return solution if solution is not None else self.get(key)
+                time.sleep(delay)
+        except Exception as e:
+            self.disable(e)
+        return None
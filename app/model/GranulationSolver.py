@@ -2,12 +2,37 @@
 
 
 from functools import reduce
+from collections import namedtuple
+import hashlib
 from app.model.GranulationDataPrep import *
+from app.model.GranulationCache import GranulationCache
+from app.entity.EntityState import EntityState
 from pulp import *
 import app.config.env as env
 from app.tools.Logger import logger_simulation as logger
 
 
+GranulationVariable = namedtuple("GranulationVariable", ["name", "varValue"])
+
+
+class GranulationSolution:
+    """
+    Granulation LP solution restored from cache, read as a solved pulp model by write_optimization_results
+    """
+
+    def __init__(self, status, values):
+        """
+        ctor
+        :param status: int, pulp status
+        :param values: dictionary {variable name: value} of non zero variables
+        """
+        self.status = status
+        self.values = values
+
+    def variables(self):
+        return [GranulationVariable(name, value) for name, value in self.values.items()]
+
+
 class GranulationSolver:
 
     def __init__(self, nodes, salesPlan):
@@ -20,6 +45,8 @@ class GranulationSolver:
         self.couples = self.get_sp_nodes_couples()
         self.separator = '#'
         self.var_dict = dict()
+        self.cache = GranulationCache()
+        self.data_digest = None
 
     def get_sp_nodes_couples(self):
         """ This method is usd to build all possible (nodes, sp) combinations,
@@ -228,12 +255,64 @@ class GranulationSolver:
 
         return model
 
+    def solve(self, tup):
+        """
+        Solves granulation LP of couple, or reuses solution published by another worker
+        :param tup: couple (granulation nodes, sales plan)
+        :return: solved pulp model or GranulationSolution
+        """
+        if not self.cache.enabled():
+            return self.launch_granulation_solver(tup)
+        key = self.get_couple_key(tup)
+        solution = self.cache.get(key)
+        claimed = False
+        if solution is None:
+            claimed = self.cache.claim(key)
+            if not claimed:
+                solution = self.cache.wait(key)
+        if solution is not None:
+            logger.info("Granulation LP %s reused from cache" % key)
+            return GranulationSolution(solution["status"], solution["values"])
+        try:
+            model = self.launch_granulation_solver(tup)
+            self.cache.publish(key, {
+                "status": model.status,
+                "values": {var.name: var.varValue for var in model.variables() if var.varValue}
+            })
+        finally:
+            if claimed:
+                self.cache.release(key)
+        return model
+
+    def get_couple_key(self, tup):
+        """
+        Content address of couple LP: granulation data, monikers of couple entities and recalculated sales plan
+        :param tup: couple (granulation nodes, sales plan)
+        :return: String
+        """
+        if self.data_digest is None:
+            digest = hashlib.sha1()
+            for node in self.granulation_nodes:
+                entity = node.entity
+                digest.update(repr((entity.moniker, entity.status, entity.productionSite, entity.timeline,
+                                    sorted(entity.production.keys()))).encode())
+                series = [entity.capex] + [entity.opex[k] for k in sorted(entity.opex)] + \
+                         [entity.granulation_ratios[k] for k in sorted(entity.granulation_ratios)]
+                for s in series:
+                    digest.update(pd.util.hash_pandas_object(s).values.tobytes())
+                digest.update(entity.state.get_initial(EntityState.CAPACITY).tobytes())
+            self.data_digest = digest.hexdigest()
+        digest = hashlib.sha1(self.data_digest.encode())
+        digest.update(repr((env.WACC, env.GRANUL_RELAX, [node.entity.moniker for node in tup[0]])).encode())
+        digest.update(pd.util.hash_pandas_object(tup[1]).values.tobytes())
+        return "granulation_%s" % digest.hexdigest()
+
     def write_optimization_results(self, model):
         entity_production = list(filter(lambda x: (x.varValue != 0 and ('ExistingProd'in x.name or 'NewProd' in x.name)), model.variables()))
         for var in entity_production:
             variable_details = var.name.split(self.separator)
             node = list(filter(lambda x: (x.entity.moniker.replace(' ','/') == variable_details[1].replace('_','/')), self.granulation_nodes))[0]
-            node.entity.production[variable_details[2]]['volume'][int(variable_details[3])] = var.varValue
+            node.entity.set_production(variable_details[2], var.varValue, int(variable_details[3]))
             logger.info('varname : ' + var.name + ' = ' + str(var.varValue))
 
         if not env.GRANUL_RELAX:
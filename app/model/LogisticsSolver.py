@@ -4,24 +4,24 @@
 from app.entity.Entity import *
 from pulp import *
 import app.config.env as env
+import time
 from app.tools.Logger import logger_simulation as logger
 
 
 class LogisticsSolver:
+    """
+    Logistics LP, built once per train location as a template: only constants depending on scenario production and
+    consumption are updated before each solve, previous solution being used as warm start
+    """
     def __init__(self, nodes, scenario, salesPlan):
 
         pipeAndconveyorNodes = list(
             filter(lambda x: (x.entity.method != 'Train'), nodes[env.PipelineLayer.LOGISTICS]))
 
-        newPAPentities = list(filter(lambda x: (x.entity.status == 'New'), scenario[0]))
-        if newPAPentities[0].entity.location == 'Mzinda':
-            trainNodes = list(
-                filter(lambda x: (x.entity.method == 'Train' and x.entity.PAPlocation == 'Mz'),
-                       nodes[env.PipelineLayer.LOGISTICS]))
-        else:
-            trainNodes = list(
-                filter(lambda x: (x.entity.method == 'Train' and x.entity.PAPlocation == 'Safi'),
-                       nodes[env.PipelineLayer.LOGISTICS]))
+        train_location = LogisticsSolver.get_train_location(scenario)
+        trainNodes = list(
+            filter(lambda x: (x.entity.method == 'Train' and x.entity.PAPlocation == train_location),
+                   nodes[env.PipelineLayer.LOGISTICS]))
 
         logisticList = []
         logisticList.extend(pipeAndconveyorNodes)
@@ -36,11 +36,51 @@ class LogisticsSolver:
         self.new_logistics_entities = self.get_new_logistics()  # New logistics nodes
         self.extended_logistics_entities = self.get_extended_logistics()    # Extended logistics nodes
         self.separator = '#'
-        self.var_dict = dict()  #   Variables dictionnary
+        self.volumes = dict()  #   Volume variables, by (node index, year)
+        self.investments = dict()  #   Investment variables, by (node index, year)
         self.locations = self.get_locations_function()  #   List of all possible locations
         self.timeline = list(range(env.T0, env.TMAX))   #   Timeline
         self.rock_port = salesPlan[(salesPlan.Type == 'Rock')].copy()  #    Rock sales plan
         self.acid_port = salesPlan[(salesPlan.Type == 'Acid')].copy()  #    Acid sales plan
+        self.model = None   #   Template model
+        self.data_constraints = []  #   Constraints with scenario dependent constant
+        self.build_time = 0.    #   Template model build time, in seconds
+        self.solve_time = 0.    #   Cumulated solve time, in seconds
+        self.build_indexes()
+
+    @staticmethod
+    def get_train_location(scenario):
+        """
+        :param scenario: scenario, PAP nodes first
+        :return: String, PAP location of train logistics used by scenario
+        """
+        newPAPentities = list(filter(lambda x: (x.entity.status == 'New'), scenario[0]))
+        return 'Mz' if newPAPentities[0].entity.location == 'Mzinda' else 'Safi'
+
+    def add_data_constraint(self, model, constraint, name, offset, terms):
+        """
+        Adds constraint whose constant is recomputed from scenario data before each solve
+        :param model: LpProblem
+        :param constraint: LpConstraint, without constant
+        :param name: String
+        :param offset: float, scenario independent part of constant
+        :param terms: list of (sign, entity, 'production'|'consumption', item, year), scenario dependent part of constant
+        :return: None
+        """
+        model += constraint, name
+        self.data_constraints.append((constraint, offset, terms))
+
+    def update_data_constraints(self):
+        """ Sets constants of template constraints from current production and consumption of entities"""
+        for constraint, offset, terms in self.data_constraints:
+            constant = offset
+            for sign, entity, kind, item, year in terms:
+                constant += sign * getattr(entity, kind)[item]['volume'][year]
+            constraint.constant = constant
+
+    @staticmethod
+    def to_float(value):
+        return float(value.sum()) if isinstance(value, pd.Series) else float(value)
 
     def get_locations_function(self):   #   Function that gets the locations
         dict = {}
@@ -69,138 +109,151 @@ class LogisticsSolver:
         """ Function that creates the linear problem"""
         return LpProblem('logistics lp', LpMinimize)
 
+    def get_volume_name(self, index, year):
+        return 'Volume' + self.separator + self.logistics_entities[index].entity.moniker + self.separator + str(year)
+
+    def get_investment_name(self, index, year):
+        return 'Investment' + self.separator + self.logistics_entities[index].entity.moniker + self.separator + str(year)
+
+    def build_indexes(self):
+        """ Function that builds adjacency indexes of logistics nodes (node indices) and entities per location"""
+        self.node_indices = {id(node): index for index, node in enumerate(self.logistics_entities)}
+        self.inbound = {}   #   (downstream location, product) -> nodes
+        self.washplants_inbound = {}    #   downstream location -> WP2WP nodes
+        self.rock_outbound = {}     #   upstream location -> Rock nodes that are not WP2WP nodes of same location
+        self.acid_outbound = {}     #   upstream location -> PAP2Granul and PAP2Port nodes
+        for index, node in enumerate(self.logistics_entities):
+            self.inbound.setdefault((node.entity.downstream, node.entity.product), []).append(index)
+            if node.entity.moniker.split('/')[5] == 'WP2WP':
+                self.washplants_inbound.setdefault(node.entity.downstream, []).append(index)
+            if node.entity.product == 'Rock' and not (node.entity.downstream == node.entity.upstream and
+                                                      node.entity.moniker.split('/')[5] == 'WP2WP'):
+                self.rock_outbound.setdefault(node.entity.upstream, []).append(index)
+            if node.entity.moniker.split('/')[5] in ['PAP2Granul', 'PAP2Port']:
+                self.acid_outbound.setdefault(node.entity.upstream, []).append(index)
+        self.beneficiation_by_location = LogisticsSolver.group_by_location(self.beneficiation_entities)
+        self.pap_by_location = LogisticsSolver.group_by_location(self.pap_entities)
+        self.granul_by_location = LogisticsSolver.group_by_location(self.granul_entities)
+        self.acid_consumers = [node for node in self.granul_entities if 'ACP 29' in node.entity.consumption.keys()]
+
+    @staticmethod
+    def group_by_location(nodes):
+        """
+        :param nodes: list of nodes
+        :return: dictionary {location: list of nodes}
+        """
+        groups = {}
+        for node in nodes:
+            groups.setdefault(node.entity.location, []).append(node)
+        return groups
+
+    def get_volumes(self, indices, year):
+        return [self.volumes[index, year] for index in indices]
+
     def existing_logistics_definition(self):    #   Function that creates the existing logistics volume variables
         for node in self.existing_logistics_entities:
+            index = self.node_indices[id(node)]
             for year in node.entity.timeline:
-                var_name = 'Volume' + self.separator + node.entity.moniker + self.separator + str(year)
-                self.var_dict[var_name] = LpVariable(var_name, 0)
+                self.volumes[index, year] = LpVariable(self.get_volume_name(index, year), 0)
 
     def new_logistics_definition(self):     #   Function that creates the new logistics volume variables
         for node in self.new_logistics_entities:
+            index = self.node_indices[id(node)]
             for year in node.entity.timeline:
-                var_name = 'Volume' + self.separator + node.entity.moniker + self.separator + str(year)
-                self.var_dict[var_name] = LpVariable(var_name, 0)
+                self.volumes[index, year] = LpVariable(self.get_volume_name(index, year), 0)
 
     def new_investments_definition(self):   #   Function that creates the investment binary variables
         for node in self.new_logistics_entities:
+            index = self.node_indices[id(node)]
             for year in node.entity.timeline:
-                var_name = 'Investment' + self.separator + node.entity.moniker + self.separator + str(year)
-                self.var_dict[var_name] = LpVariable(var_name, cat=LpBinary)
+                self.investments[index, year] = LpVariable(self.get_investment_name(index, year), cat=LpBinary)
 
     def beneficiation_balance_constraint(self, model):
         """ Function that creates the demand constraint from beneficiation and
         that takes into consideration movement of Rock between washplants """
         for location in self.locations:
+            lhs_nodes = self.washplants_inbound.get(location, [])
+            rhs_nodes = self.rock_outbound.get(location, [])
+            washplants = self.beneficiation_by_location.get(location, [])
+            if len(lhs_nodes) + len(washplants) == 0 or len(rhs_nodes) == 0:
+                continue
             for year in self.timeline:
-                lhs = []
-                rhs = []
-                for node in self.logistics_entities:
-                    if node.entity.downstream == location and node.entity.moniker.split('/')[5] == 'WP2WP':
-                        var_name = 'Volume' + self.separator + node.entity.moniker + self.separator + str(year)
-                        lhs.append(self.var_dict[var_name])
-                    elif node.entity.upstream == location and node.entity.product == 'Rock':
-                        var_name = 'Volume' + self.separator + node.entity.moniker + self.separator + str(year)
-                        rhs.append(self.var_dict[var_name])
-                for entity in self.beneficiation_entities:
-                    if entity.entity.location == location:
-                        lhs.append(entity.entity.production['Chimie']['volume'][year])
-                if len(lhs) > 0 and len(rhs) > 0:
-                    constraint_name_left = 'BalanceCstWP' + self.separator + location + self.separator + str(year) + "production_driving"
-                    constraint_name_right = 'BalanceCstWP' + self.separator + location + self.separator + str(year)+"demand_driving"
-                    model += lpSum(lhs) <= lpSum(rhs), constraint_name_right
-                    model += lpSum(lhs) >= lpSum(rhs), constraint_name_left
+                lhs = self.get_volumes(lhs_nodes, year)
+                rhs = self.get_volumes(rhs_nodes, year)
+                # washplants production, on left hand side
+                terms = [(1, entity.entity, 'production', 'Chimie', year) for entity in washplants]
+                constraint_name_left = 'BalanceCstWP' + self.separator + location + self.separator + str(year) + "production_driving"
+                constraint_name_right = 'BalanceCstWP' + self.separator + location + self.separator + str(year)+"demand_driving"
+                self.add_data_constraint(model, lpSum(lhs) - lpSum(rhs) <= 0, constraint_name_right, 0., terms)
+                self.add_data_constraint(model, lpSum(lhs) - lpSum(rhs) >= 0, constraint_name_left, 0., terms)
 
     def consumption_at_destination_definition(self, model):
         """ Function that creates the demand constraint driven by the PAP, Granul and Port"""
         for location in self.locations:
+            rock_nodes = self.inbound.get((location, 'Rock'), [])
+            acid_nodes = self.inbound.get((location, 'Acid'), [])
+            fertilizer_nodes = self.inbound.get((location, 'Fertilizer'), [])
+            paps = [entity for entity in self.pap_by_location.get(location, [])
+                    if 'Chimie' in entity.entity.consumption.keys()]
+            granuls = [entity for entity in self.granul_by_location.get(location, [])
+                       if 'Chimie' in entity.entity.consumption.keys()]
+            port = location == 'Safi'
             for year in self.timeline:
-                lhsRock = []
-                lhsAcid = []
-                lhsFertilizer = []
-                for node in self.logistics_entities:
-                    if node.entity.downstream == location and node.entity.product == 'Rock':
-                        var_name = 'Volume' + self.separator + node.entity.moniker + self.separator + str(year)
-                        lhsRock.append(self.var_dict[var_name])
-                    if node.entity.downstream == location and node.entity.product == 'Acid':
-                        var_name = 'Volume' + self.separator + node.entity.moniker + self.separator + str(year)
-                        lhsAcid.append(self.var_dict[var_name])
-                    if node.entity.downstream == location and node.entity.product == 'Fertilizer':
-                        var_name = 'Volume' + self.separator + node.entity.moniker + self.separator + str(year)
-                        lhsFertilizer.append(self.var_dict[var_name])
-
-                rhsRock = []
+                lhsRock = self.get_volumes(rock_nodes, year)
+                lhsAcid = self.get_volumes(acid_nodes, year)
+                lhsFertilizer = self.get_volumes(fertilizer_nodes, year)
+
+                # right hand sides, as (sign, entity, kind, item, year) terms of constraint constant
+                rhsRock = [(-1, entity.entity, 'consumption', 'Chimie', year) for entity in paps + granuls]
                 rhsAcid = []
                 rhsFertilizer = []
-
-                for entity in self.pap_entities :
-                    if entity.entity.location == location:
-                        try:
-                            rhsRock.append(entity.entity.consumption['Chimie']['volume'][year])
-                            if location == 'Safi':
-                                rhsAcid.append(-entity.entity.production['ACP 29']['volume'][year])
-                        except :
-                            pass
-                for entity in self.granul_entities:
-                    if entity.entity.location == location:
-                        try:
-                            rhsRock.append(entity.entity.consumption['Chimie']['volume'][year])
-                        except :
-                            pass
-                    if 'ACP 29' in entity.entity.consumption.keys():
-                        rhsAcid.append(entity.entity.consumption['ACP 29']['volume'][year])
-
-
-                if location == 'Safi':
-
-                    rhsRock.append(self.rock_port['volume'][year])
-                    rhsAcid.append(self.acid_port['volume'][year])
-
-                if len(lhsRock)>0 and len(rhsRock)>0:
+                rock_offset = 0.
+                acid_offset = 0.
+                if port:
+                    rhsAcid += [(1, entity.entity, 'production', 'ACP 29', year) for entity in paps
+                                if 'ACP 29' in entity.entity.production.keys()]
+                rhsAcid += [(-1, entity.entity, 'consumption', 'ACP 29', year) for entity in self.acid_consumers]
+
+                if port:
+                    rock_offset = -LogisticsSolver.to_float(self.rock_port['volume'][year])
+                    acid_offset = -LogisticsSolver.to_float(self.acid_port['volume'][year])
+
+                if len(lhsRock)>0 and (len(rhsRock)>0 or port):
                     constraint_name = 'ConsumptionCst' + self.separator + 'Rock' + self.separator + location + self.separator + str(year)
-                    model += lpSum(lhsRock) >= lpSum(rhsRock), constraint_name
+                    self.add_data_constraint(model, lpSum(lhsRock) >= 0, constraint_name, rock_offset, rhsRock)
 
-                if len(lhsAcid) > 0 and len(rhsAcid) > 0:
+                if len(lhsAcid) > 0 and (len(rhsAcid) > 0 or port):
                     constraint_name = 'ConsumptionCst' + self.separator + 'Acid' + self.separator + location + self.separator + str(year)
-                    model += lpSum(lhsAcid) >= lpSum(rhsAcid), constraint_name
+                    self.add_data_constraint(model, lpSum(lhsAcid) >= 0, constraint_name, acid_offset, rhsAcid)
 
                 if len(lhsFertilizer) > 0 and len(rhsFertilizer) > 0:
                     constraint_name = 'ConsumptionCst' + self.separator + 'Fertilizer' + self.separator + location + self.separator + str(year)
-                    model += lpSum(lhsFertilizer) >= lpSum(rhsFertilizer), constraint_name
+                    self.add_data_constraint(model, lpSum(lhsFertilizer) >= 0, constraint_name, 0., rhsFertilizer)
 
     def existing_transportation_capacity_definition(self, model):
         """ Function that creates the capacity constraint of existing logistic nodes"""
         for node in self.existing_logistics_entities:
+            index = self.node_indices[id(node)]
             for year in node.entity.timeline:
-                lhs = []
-                var_name = 'Volume' + self.separator + node.entity.moniker + self.separator + str(year)
-                lhs.append(self.var_dict[var_name])
-
-                if len(lhs)>0:
-                    constraint_name = 'TransportCapaCst' + self.separator + node.entity.moniker + self.separator + str(year)
-                    model += lpSum(lhs) <= node.entity.capacity[year], constraint_name
+                constraint_name = 'TransportCapaCst' + self.separator + node.entity.moniker + self.separator + str(year)
+                model += self.volumes[index, year] <= node.entity.capacity[year], constraint_name
 
     def new_transportation_capacity_definition(self, model):
         """ Function that creates the capacity constraint of new logistic nodes"""
         for node in self.new_logistics_entities:
+            index = self.node_indices[id(node)]
+            investments = []
             for year in node.entity.timeline:
-                lhs = []
-                var_name = 'Volume' + self.separator + node.entity.moniker + self.separator + str(year)
-                lhs.append(self.var_dict[var_name])
-                investment_years = [inv_year for inv_year in node.entity.timeline if inv_year <= year]
-                for investment_year in investment_years:
-                    inv_var_name = 'Investment' + self.separator + node.entity.moniker + self.separator + str(investment_year)
-                    lhs.append(-self.var_dict[inv_var_name] * node.entity.capacity[investment_year])
-                if len(lhs)>0:
-                    constraint_name = 'TransportCapaCst' + self.separator + node.entity.moniker + self.separator + str(year)
-                    model += lpSum(lhs) <= 0, constraint_name
+                # investments made up to year included, built incrementally
+                investments.append(-self.investments[index, year] * node.entity.capacity[year])
+                constraint_name = 'TransportCapaCst' + self.separator + node.entity.moniker + self.separator + str(year)
+                model += self.volumes[index, year] + lpSum(investments) <= 0, constraint_name
 
     def investment_constraint_definition(self, model):
         """ Function that creates the constraint limiting the one time investment in a logistic nodes"""
         for node in self.new_logistics_entities:
-            lhs = []
-            for year in node.entity.timeline:
-                var_name = 'Investment' + self.separator + node.entity.moniker + self.separator + str(year)
-                lhs.append(self.var_dict[var_name])
+            index = self.node_indices[id(node)]
+            lhs = [self.investments[index, year] for year in node.entity.timeline]
             if len(lhs) > 0:
                 constraint_name = 'InvestmentDefinitionCst' + self.separator + node.entity.moniker
                 model += lpSum(lhs) <= 1, constraint_name
@@ -208,26 +261,18 @@ class LogisticsSolver:
     def upstream_production_definition(self, model):
         """ Function that creates that the production volume constraint"""
         for location in self.locations:
+            lhs_nodes = self.acid_outbound.get(location, [])
+            paps = self.pap_by_location.get(location, [])
+            if len(lhs_nodes) == 0 or len(paps) == 0:
+                continue
             for year in self.timeline:
-                lhs = []
-                rhs = []
-                for node in self.logistics_entities:
-                    if node.entity.upstream == location and (node.entity.moniker.split('/')[5] == 'PAP2Granul' or node.entity.moniker.split('/')[5] == 'PAP2Port'):
-                        var_name = 'Volume' + self.separator + node.entity.moniker + self.separator + str(year)
-                        lhs.append(self.var_dict[var_name])
-
-                for entity in self.pap_entities :
-                    if entity.entity.location == location :
-                        rhs.append(entity.entity.production['ACP 29']['volume'][year])
+                lhs = self.get_volumes(lhs_nodes, year)
+                rhs = [(-1, entity.entity, 'production', 'ACP 29', year) for entity in paps]
                 # TODO : à activer seulement si la granul peut se faire ailleurs qu'à Safi
-                # for entity in self.granul_entities :
-                #     if entity.entity.location == location :
-                #         rhs.append(-entity.entity.consumption['ACP 29']['volume'][year])
-
-                if len(lhs) > 0 and len(rhs)>0 :
-                    constraint_name = 'ProductionCst' + self.separator + location + self.separator + str(year)
-                    model += lpSum(lhs) <= lpSum(rhs), constraint_name
-
+                # rhs += [(1, entity.entity, 'consumption', 'ACP 29', year)
+                #         for entity in self.granul_by_location.get(location, [])]
+                constraint_name = 'ProductionCst' + self.separator + location + self.separator + str(year)
+                self.add_data_constraint(model, lpSum(lhs) <= 0, constraint_name, 0., rhs)
 
     def objective_function_definition(self, model):
         """ Function writing the objective function with the opex being opex
@@ -235,17 +280,16 @@ class LogisticsSolver:
         model.sense = LpMinimize
 
         opex = []
-        for node in self.logistics_entities:
+        for index, node in enumerate(self.logistics_entities):
             for year in node.entity.timeline:
-                var_name = 'Volume' + self.separator + node.entity.moniker + self.separator + str(year)
-                opex.append(node.entity.opex[node.entity.product][year]/((1+env.WACC)**(year-node.entity.timeline[0]))*self.var_dict[var_name])
+                opex.append(node.entity.opex[node.entity.product][year]/((1+env.WACC)**(year-node.entity.timeline[0]))*self.volumes[index, year])
 
         capex = []
         for node in self.new_logistics_entities:
+            index = self.node_indices[id(node)]
             for year in node.entity.timeline:
-                var_name = 'Investment' + self.separator + node.entity.moniker + self.separator + str(year)
-                for index in node.entity.capex.index:
-                    capex.append(node.entity.capex[index]/((1+env.WACC)**((year-node.entity.timeline[0])+index))*self.var_dict[var_name])
+                for capex_index in node.entity.capex.index:
+                    capex.append(node.entity.capex[capex_index]/((1+env.WACC)**((year-node.entity.timeline[0])+capex_index))*self.investments[index, year])
         objective = lpSum(capex) + lpSum(opex)
         model += lpSum(objective)
 
@@ -261,14 +305,38 @@ class LogisticsSolver:
         self.investment_constraint_definition(model)
         self.beneficiation_balance_constraint(model)
 
-    def launch_logistics_solver(self):
+    def build_logistics_model(self):
+        """ Function that builds the template model, constants of scenario dependent constraints being left to 0"""
         model = self.create_logistics_model()
         self.variables_definition()
         self.add_constraints(model)
         self.objective_function_definition(model)
+        return model
+
+    @staticmethod
+    def get_solver():
+        """ CBC warm started from variables values, i.e. solution of previous scenario """
+        try:
+            return PULP_CBC_CMD(warmStart=True)
+        except TypeError:
+            # pulp versions without warm start
+            return None
+
+    def launch_logistics_solver(self):
+        if self.model is None:
+            start = time.time()
+            self.model = self.build_logistics_model()
+            self.build_time = time.time() - start
+            logger.info('Logistics model built in %.3fs: %d variables, %d constraints' %
+                        (self.build_time, len(self.volumes) + len(self.investments), len(self.model.constraints)))
+        start = time.time()
+        self.update_data_constraints()
+        model = self.model
         #model.writeLP("file_logistics.lp")
-        model.solve()
-        logger.info('Logistics model status :  %s ' % LpStatus[model.status])
+        model.solve(LogisticsSolver.get_solver())
+        solve_time = time.time() - start
+        self.solve_time += solve_time
+        logger.info('Logistics model status :  %s, solved in %.3fs' % (LpStatus[model.status], solve_time))
 
         return self.write_optimization_results(model)
 
@@ -276,17 +344,13 @@ class LogisticsSolver:
         logistic_nodes = []
         logistic_entities = []
         if model.status == 1:
-            logistics_entities = self.logistics_entities
-            transported_volumes = list(
-                filter(lambda x: (x.varValue != 0 and 'Volume' in x.name),
-                       model.variables()))
             dict = {}
-            for var in transported_volumes:
-                variable_details = var.name.split(self.separator)
-                node = list(filter(lambda x: (x.entity.moniker.replace(' ', '/') == variable_details[1].replace('_', '/')),
-                                   self.logistics_entities))
-                logistics_entities[self.logistics_entities.index(node[0])].entity.production[variable_details[1].split('_')[8]]['volume'][int(variable_details[2])] = var.varValue
-                dict[node[0].entity.moniker] = logistics_entities[self.logistics_entities.index(node[0])]
-            logistic_nodes = list(x for x in dict.values())
+            for (index, year), var in self.volumes.items():
+                if var.varValue != 0:
+                    node = self.logistics_entities[index]
+                    variable_details = var.name.split(self.separator)
+                    node.entity.set_production(variable_details[1].split('_')[8], var.varValue, year)
+                    dict[index] = node
+            logistic_nodes = list(dict[index] for index in sorted(dict))
             logistic_entities = list(x.entity for x in dict.values())
         return logistic_nodes, logistic_entities, model.status
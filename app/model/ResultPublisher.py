@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+
+from abc import ABC, abstractmethod
+
+
+class ResultPublisher(ABC):
+    """
+    Interface of publishers of Simulator.simulate, given as {"details": publisher, "global": publisher}: results of
+    each evaluated scenario are saved as soon as it is evaluated, so that they are not kept in memory for the whole run
+    """
+
+    def set_partition(self, phase, couple_index):
+        """
+        Called by simulator before evaluating scenarios of a granulation couple
+        :param phase: int
+        :param couple_index: int, index of granulation couple
+        :return: None
+        """
+        pass
+
+    @abstractmethod
+    def save(self, data, task_id):
+        """
+        :param data: dictionary (global result) or list of dictionaries (detailed results of entities)
+        :param task_id: int, scenario id
+        :return: None
+        """
+
+    def close(self, check=True):
+        """
+        Saves remaining results
+        :param check: boolean, raise if some results were not saved
+        :return: None
+        """
+        pass
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import itertools
+import numpy as np
 
 from app.model.Scenario import *
 from app.entity.Entity import *
@@ -111,11 +112,14 @@ class ScenarioGeneratorFromOption:
     """
     Class handling options based scenarios
     """
-    def __init__(self, layers):
+    def __init__(self, layers, lazy=None):
         """
         ctor
         :param layers: dictionary of layers
+        :param lazy: boolean, if True scenarios are built on demand instead of being stored, env.SCENARIO_GEN_LAZY if None
         """
+        if lazy is None:
+            lazy = env.SCENARIO_GEN_LAZY
         layer_combinations = {}
         self.length = 1
         for layer_type in layers:
@@ -124,14 +128,47 @@ class ScenarioGeneratorFromOption:
             layer = layers[layer_type]
             combinations = layer.shuffle()
             layer_combinations[layer_type] = combinations
-        sub_scenarios_pap_sap_only = itertools.product(*[layer_combinations[env.PipelineLayer.SAP], layer_combinations[env.PipelineLayer.PAP]])
-        valid_scenarios_sap_pap_wise = ScenarioGeneratorFromOption.filter_over_sap_pap_locations(sub_scenarios_pap_sap_only)
-        scenarios = itertools.product(*[valid_scenarios_sap_pap_wise,
-                                        layer_combinations[env.PipelineLayer.MINE_BENEFICIATION]])
-        self.combinations = [[comb[0][1]]+[comb[0][0]] + list(comb[1:]) for comb in scenarios]
-        self.length = len(self.combinations)
+        if lazy:
+            # scenario i is (i // #threads)-th valid sap/pap couple with (i % #threads)-th thread combination
+            self.combinations = None
+            self.saps = layer_combinations[env.PipelineLayer.SAP]
+            self.paps = layer_combinations[env.PipelineLayer.PAP]
+            self.threads = layer_combinations[env.PipelineLayer.MINE_BENEFICIATION]
+            self.valid_sap_pap = ScenarioGeneratorFromOption.index_valid_sap_pap(self.saps, self.paps)
+            self.length = len(self.valid_sap_pap) * len(self.threads)
+        else:
+            sub_scenarios_pap_sap_only = itertools.product(*[layer_combinations[env.PipelineLayer.SAP], layer_combinations[env.PipelineLayer.PAP]])
+            valid_scenarios_sap_pap_wise = ScenarioGeneratorFromOption.filter_over_sap_pap_locations(sub_scenarios_pap_sap_only)
+            scenarios = itertools.product(*[valid_scenarios_sap_pap_wise,
+                                            layer_combinations[env.PipelineLayer.MINE_BENEFICIATION]])
+            self.combinations = [[comb[0][1]]+[comb[0][0]] + list(comb[1:]) for comb in scenarios]
+            self.length = len(self.combinations)
         logger.info("Number of scenarios: %d" % self.length)
 
+    @staticmethod
+    def index_valid_sap_pap(saps, paps):
+        """
+        Same filter as filter_over_sap_pap_locations, sap and pap combinations only compared within a location
+        :param saps: list of sap combinations
+        :param paps: list of pap combinations
+        :return: np.array of (sap index * len(paps) + pap index) of valid couples, in itertools.product order
+        """
+        paps_per_location = {}
+        for j, pap in enumerate(paps):
+            paps_per_location.setdefault(pap[-1].entity.location, []).append(
+                (j, set(pap_.moniker() for pap_ in pap)))
+        indices = []
+        for i, sap in enumerate(saps):
+            location = sap[-1].entity.location
+            if location != location:
+                # nan location never matches
+                continue
+            associated_paps = set(node.entity.associated_pap for node in sap if pd.isna(node.entity.associated_pap) is False)
+            for j, pap_monikers in paps_per_location.get(location, []):
+                if associated_paps <= pap_monikers:
+                    indices.append(i * len(paps) + j)
+        return np.array(indices, dtype=np.int64)
+
     @staticmethod
     def filter_over_sap_pap_locations(scenarios):
         valid_scenarios_sap_pap_wise = list()
@@ -163,9 +200,64 @@ class ScenarioGeneratorFromOption:
         """
         return self.length
 
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        """
+        Random access to scenarios
+        :param index: int, scenario index in generation order
+        :return: scenario
+        """
+        if index < 0 or index >= self.length:
+            raise IndexError("Scenario index %d out of range" % index)
+        if self.combinations is not None:
+            return self.combinations[index]
+        sap, pap, thread = self.unrank(index)
+        return [self.paps[pap], self.saps[sap], self.threads[thread]]
+
+    def unrank(self, index):
+        """
+        :param index: int, scenario index in generation order
+        :return: tuple (sap, pap, thread) of indices in layer combinations
+        """
+        if self.combinations is not None:
+            logger.error("Scenario ranking requires lazy generation")
+            raise Exception("Scenario ranking requires lazy generation")
+        pair, thread = divmod(index, len(self.threads))
+        sap, pap = divmod(int(self.valid_sap_pap[pair]), len(self.paps))
+        return sap, pap, thread
+
+    def rank(self, sap, pap, thread):
+        """
+        Inverse of unrank
+        :param sap: int, index in sap combinations
+        :param pap: int, index in pap combinations
+        :param thread: int, index in mine/beneficiation combinations
+        :return: int, scenario index in generation order
+        """
+        if self.combinations is not None:
+            logger.error("Scenario ranking requires lazy generation")
+            raise Exception("Scenario ranking requires lazy generation")
+        flat_index = sap * len(self.paps) + pap
+        pair = int(np.searchsorted(self.valid_sap_pap, flat_index))
+        if pair == len(self.valid_sap_pap) or self.valid_sap_pap[pair] != flat_index:
+            logger.error("SAP combination %d and PAP combination %d are not compatible" % (sap, pap))
+            raise Exception("Invalid SAP/PAP couple (%d, %d)" % (sap, pap))
+        return pair * len(self.threads) + thread
+
+    def __iter__(self):
+        if self.combinations is not None:
+            yield from self.combinations
+            return
+        for pair in self.valid_sap_pap:
+            sap, pap = divmod(int(pair), len(self.paps))
+            for thread in self.threads:
+                yield [self.paps[pap], self.saps[sap], thread]
+
     def generate(self):
         """
         Generate all scenarios
-        :return: iterator on all scenarios
+        :return: collection of all scenarios, with random access
         """
-        return self.combinations
+        return self.combinations if self.combinations is not None else self
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+
+import app.config.env as env
+from app.tools.Logger import logger_simulation as logger
+
+
+class ScenarioSpace:
+    """
+    Mixed radix numbering of scenarios, digits being (granulation couple, sap/pap couple, mine/beneficiation threads),
+    scenario id = couple index * # scenarios per couple + scenario index + 1, as Simulator counter
+    """
+
+    def __init__(self, couples, scenarios, scenarios_len=None):
+        """
+        ctor
+        :param couples: list of granulation couples (GranulationSolver.couples)
+        :param scenarios: collection of scenarios of a couple, as given by scenario generator
+        :param scenarios_len: int, # of scenarios per couple, len(scenarios) if None
+        """
+        self.couples = couples
+        self.scenarios = scenarios
+        self.scenarios_len = len(scenarios) if scenarios_len is None else scenarios_len
+        self.size = len(couples) * self.scenarios_len
+
+    def unrank(self, scenario_id):
+        """
+        :param scenario_id: int, from 1 to size
+        :return: couple (couple index, scenario index)
+        """
+        if scenario_id < 1 or scenario_id > self.size:
+            logger.error("Scenario %s out of scenario space of size %d" % (scenario_id, self.size))
+            raise Exception("Scenario %s out of scenario space" % scenario_id)
+        return divmod(scenario_id - 1, self.scenarios_len)
+
+    def rank(self, couple_index, scenario_index):
+        """
+        :param couple_index: int, granulation couple index
+        :param scenario_index: int, scenario index in couple
+        :return: int, scenario id
+        """
+        return couple_index * self.scenarios_len + scenario_index + 1
+
+    def get(self, scenario_id):
+        """
+        :param scenario_id: int
+        :return: couple (granulation couple, scenario)
+        """
+        couple_index, scenario_index = self.unrank(scenario_id)
+        return self.couples[couple_index], self.scenarios[scenario_index]
+
+    def get_choices(self, scenario_id):
+        """
+        :param scenario_id: int
+        :return: dictionary {layer: index of chosen combination in layer}
+        """
+        if not hasattr(self.scenarios, "unrank"):
+            logger.error("Scenarios of type %s can not be decomposed by layer" % type(self.scenarios).__name__)
+            raise Exception("Scenario decomposition requires a lazy options based generator")
+        couple_index, scenario_index = self.unrank(scenario_id)
+        sap, pap, thread = self.scenarios.unrank(scenario_index)
+        return {
+            env.PipelineLayer.GRANULATION: couple_index,
+            env.PipelineLayer.SAP: sap,
+            env.PipelineLayer.PAP: pap,
+            env.PipelineLayer.MINE_BENEFICIATION: thread,
+        }
+
+    def get_id(self, choices):
+        """
+        Inverse of get_choices
+        :param choices: dictionary {layer: index of chosen combination in layer}
+        :return: int, scenario id
+        """
+        scenario_index = self.scenarios.rank(choices[env.PipelineLayer.SAP], choices[env.PipelineLayer.PAP],
+                                             choices[env.PipelineLayer.MINE_BENEFICIATION])
+        return self.rank(choices[env.PipelineLayer.GRANULATION], scenario_index)
+
+    def group_by_couple(self, scenario_ids):
+        """
+        :param scenario_ids: collection of scenario ids, ids out of space being ignored
+        :return: dictionary {couple index: sorted positions (scenario index + 1) of requested scenarios}
+        """
+        groups = {}
+        for scenario_id in sorted(set(scenario_ids)):
+            if scenario_id < 1 or scenario_id > self.size:
+                logger.warning("Scenario %s out of scenario space of size %d" % (scenario_id, self.size))
+                continue
+            couple_index, scenario_index = self.unrank(scenario_id)
+            groups.setdefault(couple_index, []).append(scenario_index + 1)
+        return groups
@@ -2,21 +2,27 @@
 
 
 import datetime
+import multiprocessing
 from functools import lru_cache
 from app.graph.NodeFactory import *
 from app.graph.Node import *
 from app.model.GranulationSolver import GranulationSolver
 from app.model.LogisticsSolver import LogisticsSolver
+from app.model.BatchEvaluator import BatchEvaluator
+from app.model.ScenarioSpace import ScenarioSpace
 from app.model.ScenarioGenerator import ScenarioGeneratorFactory as SGF
+from app.data.ParquetResultSink import ParquetResultSink
 from tqdm import tqdm
 from app.data.DataManager import *
 import numpy as np
 import app.config.env as env
-from app.server.ClientMemcached import memcached_client, insert_history, update_cache
+from app.server.ClientMemcached import memcached_client, insert_history, update_cache, delete_cache
 from app.tools.Logger import logger_simulation as logger
 
 
 class Simulator:
+    PARALLEL_SIMULATOR = None  # simulator inherited by processes of simulate_parallel
+
     def __init__(self, dm=None, monikers_filter=None):
         """
         Constructor
@@ -38,210 +44,550 @@ class Simulator:
         """
         Entity.ENTITIES.clear()
         self.nodes, self.layers, self.sales_plan = NodeFactory.load_entities(self.data_manager, monikers_filter)
+        self.batch_evaluator = None
 
     def simulate(self, cycle=1, phase=0, publishers=None, scenario_generator=None,
                  monitor=False, counter_limit=None, logistics_lp=False,
-                 scenarios_filter=None):
+                 scenarios_filter=None, batch_size=None, partitioning=None, chunk=0, chunks=1, sink_folder=None):
         """
         Simulate scenarios and compute CostPV of all possible scenarios
         :param cycle: int
         :param phase: int
-        :param publishers: list
+        :param publishers: dictionary {"details": ResultPublisher, "global": ResultPublisher}, results being kept in
+        memory and returned if None
         :param scenario_generator: ScenarioGenerator object
         :param monitor: boolean
         :param counter_limit: int
         :param logistics_lp: boolean
-        :return: couple(list,list)
+        :param scenarios_filter: list of ids of scenarios to evaluate, all scenarios if None
+        :param batch_size: int, number of scenarios evaluated at once by BatchEvaluator, 0 to evaluate one by one
+        :param partitioning: SimulationPartitioning, env.SIMULATION_PARTITIONING if None
+        :param chunk: int, chunk of phase to evaluate, for contiguous partitioning
+        :param chunks: int, number of chunks per phase, for contiguous partitioning
+        :param sink_folder: string, folder of Parquet results written instead of kept in memory if there is no
+        publisher, results kept in memory if None or empty
+        :return: couple(dict,dict), empty if results are published
         """
-
-        # create scenario generator
-        if scenario_generator is None:
-            scenario_generator = SGF.create_scenario_generator(env.SCENARIO_GEN_TYPE, self)
-
-        # get driver from sales plan
-        sales_plan = self.data_manager.sales_plan
+        if publishers is None and sink_folder:
+            if cycle == 1 and chunks == 1:
+                ParquetResultSink.clear(sink_folder)
+            publishers = ParquetResultSink.create_publishers(sink_folder, phase, chunk)
+            try:
+                return self.simulate(cycle, phase, publishers, scenario_generator, monitor, counter_limit,
+                                     logistics_lp, scenarios_filter, batch_size, partitioning, chunk, chunks)
+            finally:
+                for publisher in publishers.values():
+                    publisher.close()
+
+        if partitioning is None:
+            partitioning = env.SIMULATION_PARTITIONING
+        if batch_size is None:
+            batch_size = env.SIMULATION_BATCH_SIZE
+        if batch_size > 0 and (logistics_lp or env.RANDOMIZE_RESULTS):
+            logger.warning("Batch evaluation not available with logistics LP or randomized results")
+            batch_size = 0
 
         # monitoring
         counter = 0
         save_counter = 0
         scenarios_details = {}
         scenarios_global = {}
-        check_work_infos = {}
-        scenarios = scenario_generator.generate()
-        scenarios_len = scenario_generator.len()
-
-        # Launch granulation PL
-        granulation_solver = GranulationSolver(self.nodes, self.sales_plan)
-        total_scenarios = len(granulation_solver.couples) * scenarios_len
+        check_work_infos = Simulator.get_work_infos(phase, chunk)
+        logistics_solvers = {}  # logistics LP templates per train location
 
-        check_work_infos[phase] = {
-            "total_scenario": str(total_scenarios),
-            "maxWorker": env.RABBITMQ_MAX_WORKER,
-            'db_name': env.DB_NAME,
-            'time_start': datetime.datetime.now().strftime("%d/%m/%y %H:%M:%S")
-        }
+        # each chunk ends once, failed or not, so that the phase history is written after its last chunk
+        failed = True
+        try:
+            # create scenario generator
+            if scenario_generator is None:
+                scenario_generator = SGF.create_scenario_generator(env.SCENARIO_GEN_TYPE, self)
+
+            # get driver from sales plan
+            sales_plan = self.data_manager.sales_plan
+
+            scenarios = scenario_generator.generate()
+            scenarios_len = scenario_generator.len()
+
+            # Launch granulation PL
+            granulation_solver = GranulationSolver(self.nodes, self.sales_plan)
+            total_scenarios = len(granulation_solver.couples) * scenarios_len
+
+            # requested scenarios per granulation couple
+            scenario_space = ScenarioSpace(granulation_solver.couples, scenarios, scenarios_len)
+            requested_positions = None
+            if scenarios_filter is not None:
+                requested_positions = scenario_space.group_by_couple(scenarios_filter)
+
+            # contiguous range of scenario ids owned by (phase, chunk), strided phases otherwise
+            owned_ids = None
+            progress_start, progress_total, last_counter = 0, total_scenarios, total_scenarios - phase
+            phase_total = total_scenarios
+            if partitioning == env.SimulationPartitioning.CONTIGUOUS:
+                owned_ids = Simulator.get_block(total_scenarios, phase * chunks + chunk, cycle * chunks)
+                progress_start, progress_total, last_counter = owned_ids[0] - 1, owned_ids[1] - owned_ids[0] + 1, owned_ids[1]
+                phase_total = sum(max(last - first + 1, 0) for first, last in [
+                    Simulator.get_block(total_scenarios, phase * chunks + c, cycle * chunks) for c in range(chunks)])
+                logger.info("Phase %d, chunk %d: scenarios %d to %d" % (phase, chunk, owned_ids[0], owned_ids[1]))
+
+            check_work_infos[phase]["total_scenario"] = str(progress_total)
+            check_work_infos[phase]["phase_total"] = str(phase_total)
+
+            for couple_index, tup in enumerate(granulation_solver.couples):
+                if counter_limit is not None and counter > counter_limit:
+                    break
+                positions = None if requested_positions is None else requested_positions.get(couple_index, [])
+                if owned_ids is not None:
+                    positions = Simulator.restrict_positions(positions, counter, scenarios_len, owned_ids)
+                if positions is not None and len(positions) == 0:
+                    counter += scenarios_len
+                    continue
 
-        for tup in granulation_solver.couples:
-            if counter_limit is not None and counter > counter_limit:
-                break
+                if publishers is not None:
+                    for publisher in publishers.values():
+                        publisher.set_partition(phase, couple_index)
 
-            granulation_solved = granulation_solver.launch_granulation_solver(tup)
-            if granulation_solved.status != 1:
-                counter += scenarios_len
-                if monitor and counter >= total_scenarios - phase:
-                    progress = round(int((counter * 100) / total_scenarios), 2)
-                    check_work_infos[phase]["progress"] = str(progress)
-                    check_work_infos[phase]["counter"] = str(counter)
-                    update_cache("workers_info_%i" % phase, check_work_infos)
-                continue
+                granulation_solved = granulation_solver.solve(tup)
+                if granulation_solved.status != 1:
+                    counter += scenarios_len
+                    if monitor and counter >= last_counter:
+                        Simulator.update_progress(check_work_infos, phase, chunk, counter, progress_start, progress_total)
+                    continue
 
-            granulation_solver.write_optimization_results(granulation_solved)
-            recalculated_sales_plan = tup[1]
-            domestic_granulation_nodes = list(filter(lambda x: (x.entity.productionSite == 'Morocco'), tup[0]))
-
-            # Abroad nodes produce at full capacity NPK
-            abroad_nodes = list(filter(lambda x: (x.entity.productionSite != 'Morocco'), tup[0]))
-            if len(abroad_nodes) != 0:
-                for node in abroad_nodes:
-                    node.entity.production["NPK"]["volume"] = node.entity.capacity
-
-            tup_acid_needs_per_year = \
-                reduce(lambda x, y: x + y, [node.entity.production[product]["volume"] *
-                                            node.entity.specific_consumptions[product]["ACP 29"]["ACP 29"]
-                                            for node in domestic_granulation_nodes for product in node.entity.production.keys()])
-            tup_rock_needs_per_year = \
-                reduce(lambda x, y: x + y, [node.entity.production["TSP"]["volume"] *
-                                            node.entity.specific_consumptions["TSP"]["ACP 29"]["Chimie"]
-                                            for node in domestic_granulation_nodes if "TSP" in
-                                            node.entity.production.keys()])
-
-            # Running calculation of metrics for granulation layer
-            granulation_npv = 0
-            granulation_scenario_results = []
-            for granulation in tup[0]:
-                granulation.entity.compute_metrics()
-                granulation_npv += granulation.entity.get_cost_pv(env.RANDOMIZE_RESULTS)
-                for result in granulation.entity.get_data(env.RANDOMIZE_RESULTS):
-                    granulation_scenario_results.append(result)
-
-            counter_step = 0
-            scenario_counter = 0
-            for scenario in tqdm(scenarios, total=scenarios_len):
-
-                counter += 1
-                if scenarios_filter is not None:
-                    if counter in scenarios_filter:
-                        scenarios_filter.remove(counter)
-                    else:
+                granulation_solver.write_optimization_results(granulation_solved)
+                recalculated_sales_plan = tup[1]
+                domestic_granulation_nodes = list(filter(lambda x: (x.entity.productionSite == 'Morocco'), tup[0]))
+
+                # Abroad nodes produce at full capacity NPK
+                abroad_nodes = list(filter(lambda x: (x.entity.productionSite != 'Morocco'), tup[0]))
+                if len(abroad_nodes) != 0:
+                    for node in abroad_nodes:
+                        node.entity.set_production("NPK", node.entity.capacity)
+
+                tup_acid_needs_per_year = \
+                    reduce(lambda x, y: x + y, [node.entity.production[product]["volume"] *
+                                                node.entity.specific_consumptions[product]["ACP 29"]["ACP 29"]
+                                                for node in domestic_granulation_nodes for product in node.entity.production.keys()])
+                tup_rock_needs_per_year = \
+                    reduce(lambda x, y: x + y, [node.entity.production["TSP"]["volume"] *
+                                                node.entity.specific_consumptions["TSP"]["ACP 29"]["Chimie"]
+                                                for node in domestic_granulation_nodes if "TSP" in
+                                                node.entity.production.keys()])
+
+                drivers = Simulator.get_drivers(recalculated_sales_plan, sales_plan,
+                                                tup_acid_needs_per_year, tup_rock_needs_per_year)
+
+                # Running calculation of metrics for granulation layer
+                granulation_npv = 0
+                granulation_scenario_results = []
+                for granulation in tup[0]:
+                    granulation.entity.compute_metrics()
+                    granulation_npv += granulation.entity.get_cost_pv(env.RANDOMIZE_RESULTS)
+                    for result in granulation.entity.get_data(env.RANDOMIZE_RESULTS):
+                        granulation_scenario_results.append(result)
+
+                couple_counter = counter
+                monitored_counter = counter
+                batch = []
+                # owned ranges are not strided
+                select_cycle, select_phase = (cycle, phase) if owned_ids is None else (1, 0)
+                for position, scenario in tqdm(Simulator.select_scenarios(scenarios, scenarios_len, select_cycle,
+                                                                           select_phase, positions, counter_limit),
+                                               total=scenarios_len // cycle if positions is None else len(positions)):
+                    counter = couple_counter + position
+
+                    if monitor:
+                        if counter - monitored_counter >= env.MONITORING_STEP or counter >= last_counter:
+                            Simulator.update_progress(check_work_infos, phase, chunk, counter, progress_start, progress_total)
+                            monitored_counter = counter
+
+                    if batch_size > 0:
+                        batch.append((counter, scenario))
+                        if len(batch) == batch_size:
+                            save_counter += self.evaluate_batch(batch, drivers, tup, granulation_npv,
+                                                                granulation_scenario_results, publishers,
+                                                                scenarios_global, scenarios_details)
+                            batch = []
                         continue
-                scenario_counter += 1
-                if counter_limit is not None and scenario_counter > counter_limit:
-                    break
 
-                if monitor:
-                    if counter_step == env.MONITORING_STEP or counter >= total_scenarios - phase:
-                        progress = round(int((counter * 100) / total_scenarios), 2)
-                        check_work_infos[phase]["progress"] = str(progress)
-                        check_work_infos[phase]["counter"] = str(counter)
-                        update_cache("workers_info_%i" % phase, check_work_infos)
-                        counter_step = 0
-                    counter_step += 1
+                    for product, driver in drivers:
+                        self.flow_upstream(product, driver, scenario)
 
-                if scenario_counter % cycle != phase:
-                    continue
+                    # Rebalance production in threads, and compute balances, opex
+                    Simulator.rebalance_thread_production(scenario)
 
-                for product in recalculated_sales_plan.Product.unique():
-                    product_needs = recalculated_sales_plan[recalculated_sales_plan.Product == product]
-                    if product_needs.Type.unique() == 'Fertilizer':
-                        pass
-                    elif product == 'ACP 29':
-                        driver = sales_plan[sales_plan.Product == product]["volume"] + tup_acid_needs_per_year
-                        self.flow_upstream(product, driver, scenario)
-                    else:
-                        driver = sales_plan[sales_plan.Product == product]["volume"]
-                        self.flow_upstream(product, driver, scenario)
-                    # Flow upstream TSP needs separately
-                self.flow_upstream("Chimie", tup_rock_needs_per_year, scenario)
-
-                # Rebalance production in threads, and compute balances, opex
-                Simulator.rebalance_thread_production(scenario)
-
-                # Calculation for non-granulation entities that have non-zero production
-                has_produced = list(filter(lambda x: (x.layer != env.PipelineLayer.GRANULATION) and
-                                                     (True in set(any(x.production[product]["volume"] > 0)
-                                                                  for product in x.production.keys())),
-                                           Entity.ENTITIES.values()))
-
-                scenario_results = []
-                for gsr in granulation_scenario_results:
-                    gsr_ = gsr.copy()
-                    gsr_["Scenario"] = counter
-                    scenario_results.append(gsr_)
-                scenario_cost_pv = granulation_npv
-
-                for entity in has_produced:
-                    entity.compute_metrics()
-                    scenario_cost_pv += entity.get_cost_pv(env.RANDOMIZE_RESULTS)
-                    for result in entity.get_data(env.RANDOMIZE_RESULTS):
-                        result["Scenario"] = counter
-                        scenario_results.append(result)
-
-                logistic_model_status = -1
-                if logistics_lp:
-                    logistics_solver = LogisticsSolver(self.nodes, scenario, sales_plan)
-                    _, logistics_entities, logistic_model_status = logistics_solver.launch_logistics_solver()
-                    if logistic_model_status != 1:
-                        logger.warning("Logistics solver failed for scenario %d" % counter)
-                    else:
-                        for elt in logistics_entities:
-                            has_produced.append(elt)
-                    for entity in logistics_entities:
+                    # Calculation for non-granulation entities that have non-zero production
+                    has_produced = list(filter(lambda x: (x.layer != env.PipelineLayer.GRANULATION) and
+                                                         (True in set(any(x.production[product]["volume"] > 0)
+                                                                      for product in x.production.keys())),
+                                               Entity.ENTITIES.values()))
+
+                    scenario_results = []
+                    for gsr in granulation_scenario_results:
+                        gsr_ = gsr.copy()
+                        gsr_["Scenario"] = counter
+                        scenario_results.append(gsr_)
+                    scenario_cost_pv = granulation_npv
+
+                    for entity in has_produced:
                         entity.compute_metrics()
                         scenario_cost_pv += entity.get_cost_pv(env.RANDOMIZE_RESULTS)
                         for result in entity.get_data(env.RANDOMIZE_RESULTS):
                             result["Scenario"] = counter
                             scenario_results.append(result)
 
-                # must reset before moving on
-                for entity in has_produced:
-                    entity.reset()
+                    logistic_model_status = -1
+                    if logistics_lp:
+                        train_location = LogisticsSolver.get_train_location(scenario)
+                        if train_location not in logistics_solvers:
+                            logistics_solvers[train_location] = LogisticsSolver(self.nodes, scenario, sales_plan)
+                        logistics_solver = logistics_solvers[train_location]
+                        _, logistics_entities, logistic_model_status = logistics_solver.launch_logistics_solver()
+                        if logistic_model_status != 1:
+                            logger.warning("Logistics solver failed for scenario %d" % counter)
+                        else:
+                            for elt in logistics_entities:
+                                has_produced.append(elt)
+                        for entity in logistics_entities:
+                            entity.compute_metrics()
+                            scenario_cost_pv += entity.get_cost_pv(env.RANDOMIZE_RESULTS)
+                            for result in entity.get_data(env.RANDOMIZE_RESULTS):
+                                result["Scenario"] = counter
+                                scenario_results.append(result)
+
+                    # must reset before moving on, base entities included: rebalancing may leave them with
+                    # consumed capacity or opex but no production
+                    for entity in has_produced:
+                        entity.reset()
+                    for thread in scenario[-1]:
+                        for entity in [thread.entity.mine.base_entity, thread.entity.beneficiation.base_entity]:
+                            if entity is not None and entity not in has_produced:
+                                entity.reset()
+
+                    if logistics_lp and logistic_model_status != 1:
+                        continue
+
+                    Simulator.save_scenario(counter, [tup[0]] + scenario, scenario_cost_pv, scenario_results, publishers,
+                                            scenarios_global, scenarios_details)
+                    save_counter += 1
+
+                if len(batch) > 0:
+                    save_counter += self.evaluate_batch(batch, drivers, tup, granulation_npv, granulation_scenario_results,
+                                                        publishers, scenarios_global, scenarios_details)
+                counter = couple_counter + scenarios_len
+
+                # Reset granulation entities
+                for granulation in tup[0]:
+                    granulation.entity.reset()
+
+            failed = False
+        finally:
+            if monitor:
+                try:
+                    Simulator.end_chunk(check_work_infos, phase, chunk, chunks, save_counter, failed)
+                except Exception as e:
+                    if not failed:
+                        raise
+                    logger.warning("End of phase %d, chunk %d not reported: %s" % (phase, chunk, e))
 
-                if logistics_lp and logistic_model_status != 1:
-                    continue
+        return scenarios_global, scenarios_details
 
-                if publishers is None:
-                    scenarios_details[counter] = scenario_results
-                    scenarios_global[counter] = {
-                        "Scenario": counter,
-                        "Cost PV": scenario_cost_pv,
-                        "Unit": "$", #TODO: check unit
-                        "Moniker": json.dumps(NodeJSONEncoder().encode([tup[0]] + scenario))
-                    }
-                else:
-                    publishers["details"].save(scenario_results, counter)
-                    publishers["global"].save({
-                        "Scenario": counter,
-                        "Cost PV": scenario_cost_pv,
-                        "Unit": "$", #TODO: check unit
-                        "Moniker": [tup[0]] + scenario,
-                    }, counter)
-                save_counter += 1
-
-            # Reset granulation entities
-            for granulation in tup[0]:
-                granulation.entity.reset()
-
-        if monitor:
-            if save_counter > 0:
-                message = "Phase %s done successfully" % phase
-                insert_history(phase=phase, task_to_save=check_work_infos[phase], status=env.HTML_STATUS.OK.value,
-                               message=message)
+    def simulate_parallel(self, n_jobs=None, scenario_generator=None, counter_limit=None, logistics_lp=False,
+                          scenarios_filter=None, batch_size=None, details=True, chunks=None, sink_folder=None):
+        """
+        Simulate scenarios in a pool of forked processes, without broker nor data service: workers inherit loaded
+        entities copy-on-write and each evaluates contiguous chunks of scenario ids
+        :param n_jobs: int, # of processes, env.SIMULATION_JOBS if None, all cores if 0
+        :param scenario_generator: ScenarioGenerator object
+        :param counter_limit: int
+        :param logistics_lp: boolean
+        :param scenarios_filter: list of ids of scenarios to evaluate, all scenarios if None
+        :param batch_size: int, number of scenarios evaluated at once by BatchEvaluator, 0 to evaluate one by one
+        :param details: boolean, False to only return global results
+        :param chunks: int, # of chunks of scenario ids, n_jobs * env.SIMULATION_CHUNKS_PER_JOB if None
+        :param sink_folder: string, folder of Parquet results written by each process instead of returned,
+        results returned if None or empty
+        :return: couple(dict,dict), as simulate
+        """
+        n_jobs = env.SIMULATION_JOBS if n_jobs is None else n_jobs
+        n_jobs = n_jobs if n_jobs > 0 else multiprocessing.cpu_count()
+        chunks = n_jobs * env.SIMULATION_CHUNKS_PER_JOB if chunks is None else chunks
+        if scenario_generator is None:
+            scenario_generator = SGF.create_scenario_generator(env.SCENARIO_GEN_TYPE, self)
+        kwargs = {
+            "scenario_generator": scenario_generator, "counter_limit": counter_limit, "logistics_lp": logistics_lp,
+            "scenarios_filter": scenarios_filter, "batch_size": batch_size,
+            "partitioning": env.SimulationPartitioning.CONTIGUOUS, "chunks": chunks, "sink_folder": sink_folder
+        }
+        if sink_folder:
+            ParquetResultSink.clear(sink_folder)
+
+        scenarios_global, scenarios_details = {}, {}
+        Simulator.PARALLEL_SIMULATOR = self
+        try:
+            with multiprocessing.get_context("fork").Pool(n_jobs) as pool:
+                for chunk_global, chunk_details in pool.imap_unordered(Simulator.simulate_chunk,
+                                                                       [(chunk, kwargs, details) for chunk in range(chunks)]):
+                    scenarios_global.update(chunk_global)
+                    scenarios_details.update(chunk_details)
+        finally:
+            Simulator.PARALLEL_SIMULATOR = None
+        if sink_folder:
+            logger.info("Scenarios simulated by %d processes written to %s" % (n_jobs, sink_folder))
+        else:
+            logger.info("%d scenarios simulated by %d processes" % (len(scenarios_global), n_jobs))
+        return dict(sorted(scenarios_global.items())), dict(sorted(scenarios_details.items()))
+
+    @staticmethod
+    def simulate_chunk(args):
+        """
+        Pool task of simulate_parallel, run by a forked process on its copy of simulator
+        :param args: couple (chunk, simulate keyword arguments, details)
+        :return: couple(dict,dict), details being empty if not requested
+        """
+        chunk, kwargs, details = args
+        scenarios_global, scenarios_details = Simulator.PARALLEL_SIMULATOR.simulate(chunk=chunk, **kwargs)
+        return scenarios_global, scenarios_details if details else {}
+
+    @staticmethod
+    def get_drivers(recalculated_sales_plan, sales_plan, acid_needs, rock_needs):
+        """
+        Drivers to flow upstream for a granulation couple, in flowing order
+        :param recalculated_sales_plan: Dataframe, sales plan of the granulation couple
+        :param sales_plan: Dataframe, sales plan
+        :param acid_needs: pd.Series, acid needs of granulation
+        :param rock_needs: pd.Series, rock needs of granulation (TSP)
+        :return: list of couples (product, driver)
+        """
+        drivers = []
+        for product in recalculated_sales_plan.Product.unique():
+            product_needs = recalculated_sales_plan[recalculated_sales_plan.Product == product]
+            if product_needs.Type.unique() == 'Fertilizer':
+                pass
+            elif product == 'ACP 29':
+                drivers.append((product, sales_plan[sales_plan.Product == product]["volume"] + acid_needs))
             else:
-                message = "All scenarios have failed for phase %s" % phase
-                insert_history(phase=phase, task_to_save=check_work_infos[phase], status=env.HTML_STATUS.ERROR.value,
-                               message=message)
+                drivers.append((product, sales_plan[sales_plan.Product == product]["volume"]))
+        # Flow upstream TSP needs separately
+        drivers.append(("Chimie", rock_needs))
+        return drivers
 
-        return scenarios_global, scenarios_details
+    @staticmethod
+    def get_block(total, block, blocks):
+        """
+        Contiguous partition of scenario ids
+        :param total: int, # of scenarios
+        :param block: int, block index from 0 to blocks - 1
+        :param blocks: int, # of blocks
+        :return: couple (first id, last id) of block, empty if first > last
+        """
+        return total * block // blocks + 1, total * (block + 1) // blocks
+
+    @staticmethod
+    def restrict_positions(positions, offset, scenarios_len, owned_ids):
+        """
+        :param positions: sorted list of positions (starting at 1) of requested scenarios, all scenarios if None
+        :param offset: int, id of first scenario of couple minus one
+        :param scenarios_len: int, # of scenarios of couple
+        :param owned_ids: couple (first id, last id)
+        :return: requested positions with id in owned range
+        """
+        first = max(owned_ids[0] - offset, 1)
+        last = min(owned_ids[1] - offset, scenarios_len)
+        if positions is None:
+            return range(first, max(last + 1, first))
+        return [position for position in positions if first <= position <= last]
+
+    @staticmethod
+    def get_progress_key(phase, chunk):
+        """
+        :param phase: int
+        :param chunk: int
+        :return: string, cache key of progress of a chunk, chunks of a phase being run by concurrent workers
+        """
+        return "workers_info_%i_%i" % (phase, chunk)
+
+    @staticmethod
+    def reset_progress(cycle, chunks):
+        """
+        Clear progress of chunks of a former simulation, before tasks are sent
+        :param cycle: int
+        :param chunks: int
+        :return: None
+        """
+        for phase in range(cycle):
+            for chunk in range(chunks):
+                delete_cache(Simulator.get_progress_key(phase, chunk))
+            update_cache("workers_done_%i" % phase, "0")
+
+    @staticmethod
+    def update_progress(check_work_infos, phase, chunk, counter, progress_start, progress_total):
+        """
+        Publish worker progress
+        :param check_work_infos: dictionary
+        :param phase: int
+        :param chunk: int
+        :param counter: int, current scenario id
+        :param progress_start: int, id of first scenario of worker minus one
+        :param progress_total: int, # of scenarios of worker
+        :return: None
+        """
+        progress = round(int(((counter - progress_start) * 100) / max(progress_total, 1)), 2)
+        check_work_infos[phase]["progress"] = str(progress)
+        check_work_infos[phase]["counter"] = str(counter)
+        check_work_infos[phase]["done"] = str(min(max(counter - progress_start, 0), progress_total))
+        update_cache(Simulator.get_progress_key(phase, chunk), check_work_infos)
+
+    @staticmethod
+    def get_work_infos(phase, chunk):
+        """
+        :param phase: int
+        :param chunk: int
+        :return: dictionary, progress of chunk published in cache, totals being set once scenarios are counted
+        """
+        return {phase: {
+            "total_scenario": "0",
+            "phase_total": "0",
+            "chunk": chunk,
+            "done": "0",
+            "maxWorker": env.RABBITMQ_MAX_WORKER,
+            'db_name': env.DB_NAME,
+            'time_start': datetime.datetime.now().strftime("%d/%m/%y %H:%M:%S")
+        }}
+
+    @staticmethod
+    def end_chunk(check_work_infos, phase, chunk, chunks, save_counter, failed=False):
+        """
+        Publish end of a chunk, failed or not; the last chunk of phase to end writes history of phase, failed if a chunk
+        has failed or if no chunk has saved any scenario
+        :param check_work_infos: dictionary
+        :param phase: int
+        :param chunk: int
+        :param chunks: int, # of chunks of phase
+        :param save_counter: int, # of scenarios saved by chunk
+        :param failed: boolean, True if chunk has raised
+        :return: None
+        """
+        check_work_infos[phase]["saved"] = str(save_counter)
+        check_work_infos[phase]["failed"] = failed
+        update_cache(Simulator.get_progress_key(phase, chunk), check_work_infos)
+        key = "workers_done_%i" % phase
+        memcached_client.add(key, "0", noreply=False)
+        done = memcached_client.incr(key, 1, noreply=False)
+        if done is not None and done < chunks:
+            logger.info("Phase %d, chunk %d done: %d/%d chunks done" % (phase, chunk, done, chunks))
+            return
+
+        infos = [check_work_infos[phase]]
+        for other_chunk in range(chunks):
+            if other_chunk != chunk:
+                other_infos = memcached_client.get(Simulator.get_progress_key(phase, other_chunk))
+                if other_infos:
+                    infos.append(other_infos[str(phase)])
+        task_to_save = {
+            "db_name": check_work_infos[phase]["db_name"],
+            "time_start": min((info["time_start"] for info in infos),
+                              key=lambda time_start: datetime.datetime.strptime(time_start, "%d/%m/%y %H:%M:%S")),
+            "total_scenario": str(sum(int(info["total_scenario"]) for info in infos)),
+        }
+        failed_chunks = sum(1 for info in infos if info.get("failed"))
+        if failed_chunks > 0:
+            message = "Phase %s: %d/%d chunks have failed" % (phase, failed_chunks, chunks)
+            insert_history(phase=phase, task_to_save=task_to_save, status=env.HTML_STATUS.ERROR.value,
+                           message=message)
+        elif sum(int(info.get("saved", 0)) for info in infos) > 0:
+            message = "Phase %s done successfully" % phase
+            insert_history(phase=phase, task_to_save=task_to_save, status=env.HTML_STATUS.OK.value, message=message)
+        else:
+            message = "All scenarios have failed for phase %s" % phase
+            insert_history(phase=phase, task_to_save=task_to_save, status=env.HTML_STATUS.ERROR.value,
+                           message=message)
+
+    @staticmethod
+    def select_scenarios(scenarios, scenarios_len, cycle, phase, positions=None, counter_limit=None):
+        """
+        Scenarios of a granulation couple evaluated by phase, i.e. k-th retained scenario such that k % cycle == phase
+        :param scenarios: collection of scenarios, only retained scenarios are visited if it supports random access
+        :param scenarios_len: int, # of scenarios
+        :param cycle: int
+        :param phase: int
+        :param positions: sorted list of positions (starting at 1) of requested scenarios, all scenarios if None
+        :param counter_limit: int, maximal # of retained scenarios
+        :return: iterator on couples (position of scenario starting at 1, scenario)
+        """
+        random_access = hasattr(scenarios, "__getitem__")
+        if positions is None and random_access:
+            stop = scenarios_len if counter_limit is None else min(scenarios_len, counter_limit)
+            for index in range((phase - 1) % cycle, stop, cycle):
+                yield index + 1, scenarios[index]
+            return
+        if positions is None:
+            retained = enumerate(scenarios, 1)
+        elif random_access:
+            retained = ((position, None) for position in positions)
+        else:
+            requested = set(positions)
+            retained = ((position, scenario) for position, scenario in enumerate(scenarios, 1)
+                        if position in requested)
+        for scenario_counter, (position, scenario) in enumerate(retained, 1):
+            if counter_limit is not None and scenario_counter > counter_limit:
+                break
+            if scenario_counter % cycle == phase:
+                yield position, scenarios[position - 1] if scenario is None else scenario
+
+    @staticmethod
+    def save_scenario(counter, moniker, cost_pv, scenario_results, publishers, scenarios_global, scenarios_details):
+        """
+        Publish scenario results, or keep them in memory if there is no publisher
+        :param counter: int, scenario id
+        :param moniker: list, granulation nodes followed by scenario layers
+        :param cost_pv: float
+        :param scenario_results: list of detailed results
+        :param publishers: dictionary or None
+        :param scenarios_global: dictionary
+        :param scenarios_details: dictionary
+        :return: None
+        """
+        if publishers is None:
+            scenarios_details[counter] = scenario_results
+            scenarios_global[counter] = {
+                "Scenario": counter,
+                "Cost PV": cost_pv,
+                "Unit": "$", #TODO: check unit
+                "Moniker": json.dumps(NodeJSONEncoder().encode(moniker))
+            }
+        else:
+            publishers["details"].save(scenario_results, counter)
+            publishers["global"].save({
+                "Scenario": counter,
+                "Cost PV": cost_pv,
+                "Unit": "$", #TODO: check unit
+                "Moniker": moniker,
+            }, counter)
+
+    def evaluate_batch(self, batch, drivers, tup, granulation_npv, granulation_scenario_results, publishers,
+                       scenarios_global, scenarios_details):
+        """
+        Evaluate and save a batch of scenarios of the same granulation couple
+        :param batch: list of couples (counter, scenario)
+        :param drivers: list of couples (product, driver)
+        :param tup: granulation couple
+        :param granulation_npv: float
+        :param granulation_scenario_results: list of detailed results of granulation entities
+        :return: int, number of saved scenarios
+        """
+        if self.batch_evaluator is None:
+            self.batch_evaluator = BatchEvaluator(self.nodes)
+        costs_pv, details = self.batch_evaluator.evaluate([scenario for _, scenario in batch], drivers,
+                                                          granulation_npv)
+        for (counter, scenario), cost_pv, entities_results in zip(batch, costs_pv, details):
+            scenario_results = []
+            for result in granulation_scenario_results + entities_results:
+                result_ = result.copy()
+                result_["Scenario"] = counter
+                scenario_results.append(result_)
+            Simulator.save_scenario(counter, [tup[0]] + scenario, cost_pv, scenario_results, publishers,
+                                    scenarios_global, scenarios_details)
+        return len(batch)
 
     def flow_upstream(self, product, driver, sub_scenario):
         """
@@ -291,7 +637,7 @@ class Simulator:
                     # Filling production of entities in specific layer, taking nto account needs (sp+chem needs) and capacity
                     produced = np.maximum(0, np.minimum(driver, entity.capacity))
                     if np.count_nonzero(produced) != 0:
-                        entity.production[driver_name]['volume'] = entity.production[driver_name]['volume'] + produced
+                        entity.add_production(driver_name, produced)
                         driver = driver - produced
                         entity.capacity = entity.capacity - produced
                         new_allocation_to_propagate[driver_name][entity.name] = produced
@@ -389,10 +735,8 @@ class Simulator:
             mine.capacity = mine.capacity - produced * thread.raw_rock_consumption[driver_name]
             beneficiation.capacity = beneficiation.capacity - produced * thread.raw_rock_consumption[driver_name]
             # Updating prod
-            mine.production['Raw Rock']['volume'] = mine.production['Raw Rock']['volume'] + produced * \
-                                                    thread.raw_rock_consumption[driver_name]
-            beneficiation.production[driver_name]['volume'] = beneficiation.production[driver_name]['volume'] + \
-                                                              produced * thread.raw_rock_consumption[driver_name]
+            mine.add_production('Raw Rock', produced * thread.raw_rock_consumption[driver_name])
+            beneficiation.add_production(driver_name, produced * thread.raw_rock_consumption[driver_name])
 
         return output_driver, capa_mine_constrained, capa_wp_constrained
 
@@ -430,30 +774,26 @@ class Simulator:
             start_year = 10000
         # Correcting production dispatch
         for key in entity.production.keys():
-            entity.production[key]["volume"] = entity.production[key]["volume"] + \
-                                               entity.base_entity.production[key]["volume"] * \
-                                               np.heaviside(entity.base_entity.production[key]["volume"].index - start_year, 1)
-            entity.base_entity.production[key]["volume"] = entity.base_entity.production[key]["volume"] * \
-                                                           (1 - np.heaviside(entity.base_entity.production[key][
-                                                                                 "volume"].index - start_year, 1))
+            entity.add_production(key, entity.base_entity.production[key]["volume"] *
+                                  np.heaviside(entity.base_entity.production[key]["volume"].index - start_year, 1))
+            entity.base_entity.set_production(key, entity.base_entity.production[key]["volume"] *
+                                              (1 - np.heaviside(entity.base_entity.production[key][
+                                                                    "volume"].index - start_year, 1)))
 
     @staticmethod
     def calculate_thread_opex_and_balances(thread):
         # Updating total opex and input balances for mine
         thread.mine.total_opex = thread.mine.production['Raw Rock']['volume'] * thread.mine.opex['Raw Rock']
         for input_ in thread.mine.inputs:
-            thread.mine.consumption[input_]['volume'] = \
-                thread.mine.consumption[input_]['volume'] + \
-                (thread.mine.production['Raw Rock']['volume'] *
-                 thread.mine.specific_consumptions['Raw Rock']['All'][input_])
+            thread.mine.add_consumption(input_, thread.mine.production['Raw Rock']['volume'] *
+                                        thread.mine.specific_consumptions['Raw Rock']['All'][input_])
         if thread.mine.base_entity is not None:
             thread.mine.base_entity.total_opex = thread.mine.production['Raw Rock']['volume'] * thread.mine.opex[
                 'Raw Rock']
             for input_ in thread.mine.base_entity.inputs:
-                thread.mine.base_entity.consumption[input_]['volume'] = \
-                    thread.mine.base_entity.consumption[input_]['volume'] + \
-                    (thread.mine.base_entity.production['Raw Rock']['volume'] *
-                     thread.mine.base_entity.specific_consumptions['Raw Rock']['All'][input_])
+                thread.mine.base_entity.add_consumption(
+                    input_, thread.mine.base_entity.production['Raw Rock']['volume'] *
+                    thread.mine.base_entity.specific_consumptions['Raw Rock']['All'][input_])
 
         # Updating total opex and input balances for mine
         for driver_name in thread.wp_equivalent_opex.keys():
@@ -461,9 +801,9 @@ class Simulator:
                                               thread.beneficiation.production[driver_name]["volume"] * \
                                               thread.wp_equivalent_opex[driver_name]
             for input_ in thread.beneficiation.inputs:
-                thread.beneficiation.consumption[input_]['volume'] = \
-                    thread.beneficiation.consumption[input_]['volume'] + \
-                    thread.beneficiation.production[driver_name]["volume"] * thread.wp_equivalent_specific_consumption[driver_name][input_]
+                thread.beneficiation.add_consumption(
+                    input_, thread.beneficiation.production[driver_name]["volume"] *
+                    thread.wp_equivalent_specific_consumption[driver_name][input_])
 
             if thread.beneficiation.base_entity is not None:
                 base_wp_equivalent_specific_consumption, base_wp_equivalent_opex = \
@@ -475,10 +815,9 @@ class Simulator:
                                                                   "volume"] * \
                                                               base_wp_equivalent_opex[driver_name]
                 for input_ in thread.beneficiation.inputs:
-                    thread.beneficiation.base_entity.consumption[input_]['volume'] = \
-                        thread.beneficiation.base_entity.consumption[input_]['volume'] + \
-                        thread.beneficiation.base_entity.production[driver_name]["volume"] * \
-                        base_wp_equivalent_specific_consumption[driver_name][input_]
+                    thread.beneficiation.base_entity.add_consumption(
+                        input_, thread.beneficiation.base_entity.production[driver_name]["volume"] *
+                        base_wp_equivalent_specific_consumption[driver_name][input_])
 
 
     @lru_cache(maxsize=128, typed=True)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import pandas as pd
+import app.config.env as env
+from app.tools import Discounting
+
+
+class CostPVModel:
+    """
+    Cost PV of a scenario as a function of raw materials prices and discount rate, volumes being fixed:
+    cost_pv = sum_t (cash_flows[t] + sum_i (multiplier_i - 1) * priced_consumptions[i, t]) / (1 + rate) ** t,
+    t being the position in entities timelines, as discounted by Entity.compute_cost_pv
+    """
+
+    def __init__(self, details, prices, items, priced_monikers):
+        """
+        ctor
+        :param details: list of detailed results of entities of scenario, as given by Simulator.simulate
+        :param prices: pd.Series of raw materials prices indexed by (Item, Tenor)
+        :param items: list of raw materials
+        :param priced_monikers: set of monikers of entities whose opex is computed from prices
+        """
+        self.items = list(items)
+        rows = {item: i for i, item in enumerate(self.items)}
+        cash_flows = []
+        consumptions = []   # (item row, yearly consumptions valued at base prices)
+        for result in details:
+            cash_flow = pd.Series(result["Opex"]).add(pd.Series(result["Capex"], dtype=float), fill_value=0)
+            cash_flows.append(cash_flow.values)
+            if result["Moniker"] not in priced_monikers:
+                continue
+            for item, consumption in result["Consumption"].items():
+                if item in rows and item in prices.index.levels[0]:
+                    volume = consumption["volume"].reindex(cash_flow.index).fillna(0)
+                    price = prices[item].reindex(cash_flow.index).fillna(0)
+                    consumptions.append((rows[item], (volume * price).values))
+
+        self.periods = max([len(cash_flow) for cash_flow in cash_flows] + [1])
+        self.cash_flows = np.zeros(self.periods)
+        for cash_flow in cash_flows:
+            self.cash_flows[:len(cash_flow)] += cash_flow
+        self.priced_consumptions = np.zeros((len(self.items), self.periods))
+        for row, values in consumptions:
+            self.priced_consumptions[row, :len(values)] += values
+
+    def get_discount_factors(self, rates=None):
+        """
+        :param rates: np.array of discount rates, env.WACC if None
+        :return: np.array (periods) if rates is None, (rates x periods) otherwise
+        """
+        if rates is None:
+            return Discounting.discount_factors(env.WACC, self.periods)
+        return 1. / (1 + np.asarray(rates, dtype=float)[:, None]) ** np.arange(0, self.periods)
+
+    def evaluate(self, multipliers=None, rates=None):
+        """
+        :param multipliers: np.array (draws x items) of price multipliers, 1 for base prices
+        :param rates: np.array (draws) of discount rates, env.WACC for all draws if None
+        :return: np.array (draws) of Cost PV
+        """
+        factors = self.get_discount_factors(rates)
+        if rates is None:
+            base = self.cash_flows.dot(factors)
+            if multipliers is None:
+                return np.array([base])
+            # one matrix product for all draws
+            return base + (np.asarray(multipliers, dtype=float) - 1).dot(self.priced_consumptions.dot(factors))
+        costs_pv = factors.dot(self.cash_flows)
+        if multipliers is not None:
+            shifts = (np.asarray(multipliers, dtype=float) - 1).dot(self.priced_consumptions)
+            costs_pv += (shifts * factors).sum(axis=1)
+        return costs_pv
+
+    @staticmethod
+    def get_statistics(costs_pv, quantiles=(0.05, 0.5, 0.95), level=0.95):
+        """
+        :param costs_pv: np.array of Cost PV
+        :param quantiles: list of quantile levels
+        :param level: float, confidence level of VaR and CVaR, i.e. mean of Cost PV beyond its level quantile
+        :return: dictionary {statistic: value}
+        """
+        statistics = {"Mean": float(costs_pv.mean()), "Std": float(costs_pv.std())}
+        for quantile, value in zip(quantiles, np.quantile(costs_pv, quantiles)):
+            statistics["Q%g" % (100 * quantile)] = float(value)
+        var = np.quantile(costs_pv, level)
+        statistics["VaR"] = float(var)
+        statistics["CVaR"] = float(costs_pv[costs_pv >= var].mean())
+        return statistics
@@ -7,6 +7,13 @@ from app.data.Client import Driver
 from app.tools.Logger import logger_sensitivity as logger
 from app.model.ScenarioGenerator import ScenarioGeneratorFactory as SGF
 from app.config.env import ScenarioGeneratorType, PipelineLayer
+import app.config.env as env
+from app.tools import Discounting
+import multiprocessing
+import numpy as np
+import pandas as pd
+from app.entity.Entity import Entity
+from app.risk.CostPVModel import CostPVModel
 
 
 class RiskEngine:
@@ -14,6 +21,8 @@ class RiskEngine:
     Risk sensitivity class
     """
 
+    PARALLEL_ENGINE = None  # risk engine inherited by processes of compute_deltas
+
     def __init__(self):
         """
         ctor
@@ -21,8 +30,13 @@ class RiskEngine:
         self.dm = DataManager()
         self.dm.load_data()
 
-    def compute_delta(self, scenario, shocks, with_logistics=False):
-        # base scenario
+    def simulate_base(self, scenario, with_logistics=False):
+        """
+        Simulate scenario without shock
+        :param scenario: scenario as list of monikers per layer
+        :param with_logistics: boolean
+        :return: couple (global result, list of detailed results of entities)
+        """
         simulator = Simulator(dm=self.dm, monikers_filter=sum(scenario, []))
         scenarios = [
             simulator.nodes[layer] for layer in [
@@ -32,8 +46,26 @@ class RiskEngine:
         ]
         scenario_generator = SGF.create_scenario_generator(ScenarioGeneratorType.SPECIFIC_SCENARIOS, simulator,
                                                            [scenarios])
-        result_no_bump, _ = simulator.simulate(scenario_generator=scenario_generator, logistics_lp=with_logistics)
+        result_no_bump, details = simulator.simulate(scenario_generator=scenario_generator, logistics_lp=with_logistics)
         logger.info("Base: %f" % result_no_bump[1]["Cost PV"])
+        return result_no_bump[1], details[1]
+
+    def compute_delta(self, scenario, shocks, with_logistics=False, analytic=False):
+        """
+        Cost PV sensitivities to raw materials prices
+        :param scenario: scenario as list of monikers per layer
+        :param shocks: dictionary {item: additive price shock}
+        :param with_logistics: boolean
+        :param analytic: boolean, first order deltas from base scenario volumes instead of one simulation per shock
+        :return: dictionary {item: delta}
+        """
+        if analytic:
+            items = [item for item in self.dm.raw_materials["Item"].unique() if item in shocks]
+            sensitivities = self.compute_price_sensitivities(scenario, items, with_logistics)
+            return {item: shocks[item] * sensitivities[item] for item in items}
+
+        # base scenario
+        result_no_bump, _ = self.simulate_base(scenario, with_logistics)
 
         # bump data
         result_with_bump = {}
@@ -61,8 +93,227 @@ class RiskEngine:
             self.dm.bump_raw_materials({item: -shocks[item]})
 
         # deltas
-        base_price = result_no_bump[1]["Cost PV"]
+        base_price = result_no_bump["Cost PV"]
         deltas = {}
         for item in result_with_bump:
             deltas[item] = result_with_bump[item][1]["Cost PV"] - base_price
         return deltas
+
+    def compute_deltas(self, scenarios, shocks, with_logistics=False, analytic=None, n_jobs=1):
+        """
+        Cost PV sensitivities to raw materials prices of several scenarios, data being loaded once
+        :param scenarios: dictionary {scenario id: scenario as list of monikers per layer}
+        :param shocks: dictionary {item: additive price shock}
+        :param with_logistics: boolean
+        :param analytic: boolean, first order deltas from base scenario volumes, env.SENSITIVITY_ANALYTIC if None
+        :param n_jobs: int, # of forked processes evaluating scenarios, all cores if 0
+        :return: Dataframe with columns Scenario, Item, Delta
+        """
+        analytic = env.SENSITIVITY_ANALYTIC if analytic is None else analytic
+        tasks = [(scenario_id, scenario, shocks, with_logistics, analytic) for scenario_id, scenario in scenarios.items()]
+        n_jobs = n_jobs if n_jobs > 0 else multiprocessing.cpu_count()
+        if n_jobs == 1 or len(tasks) <= 1:
+            results = [self.compute_scenario_deltas(task) for task in tasks]
+        else:
+            # workers inherit loaded data copy-on-write, entities being built per scenario in each process
+            RiskEngine.PARALLEL_ENGINE = self
+            try:
+                with multiprocessing.get_context("fork").Pool(min(n_jobs, len(tasks))) as pool:
+                    results = pool.map(RiskEngine.compute_parallel_deltas, tasks)
+            finally:
+                RiskEngine.PARALLEL_ENGINE = None
+        return pd.DataFrame([{"Scenario": scenario_id, "Item": item, "Delta": delta}
+                             for scenario_id, deltas in results for item, delta in deltas.items()],
+                            columns=["Scenario", "Item", "Delta"])
+
+    def compute_scenario_deltas(self, task):
+        """
+        :param task: tuple (scenario id, scenario, shocks, with_logistics, analytic)
+        :return: couple (scenario id, dictionary {item: delta})
+        """
+        scenario_id, scenario, shocks, with_logistics, analytic = task
+        return scenario_id, self.compute_delta(scenario, shocks, with_logistics=with_logistics, analytic=analytic)
+
+    @staticmethod
+    def compute_parallel_deltas(task):
+        """ Pool task of compute_deltas, run by a forked process on its copy of risk engine """
+        return RiskEngine.PARALLEL_ENGINE.compute_scenario_deltas(task)
+
+    @staticmethod
+    def save_deltas(db, deltas):
+        """
+        Writes deltas in sensitivity collection at once, one document {item: delta, "Scenario": id} per scenario
+        :param db: DBAccess
+        :param deltas: Dataframe with columns Scenario, Item, Delta, as given by compute_deltas
+        :return: None
+        """
+        documents = []
+        for scenario_id, scenario_deltas in deltas.groupby("Scenario", sort=False):
+            document = dict(zip(scenario_deltas["Item"], scenario_deltas["Delta"].astype(float)))
+            document["Scenario"] = int(scenario_id)
+            documents.append(document)
+        if len(documents) > 0:
+            db.save_to_db_no_check(env.DB_SENSITIVITY_COLLECTION_NAME, documents)
+
+    def compute_price_sensitivities(self, scenario, items=None, with_logistics=False):
+        """
+        Analytic Cost PV sensitivities to parallel shifts of raw materials prices, volumes of base scenario being kept
+        (granulation and logistics optimizations are not rerun). Opex per ton being linear in prices, sensitivity to
+        an item price is the present value of the item consumption of entities whose opex is computed from prices
+        :param scenario: scenario as list of monikers per layer
+        :param items: list of raw materials, all raw materials if None
+        :param with_logistics: boolean
+        :return: dictionary {item: dCostPV/dprice}
+        """
+        items = list(self.dm.raw_materials["Item"].unique()) if items is None else items
+        _, details = self.simulate_base(scenario, with_logistics)
+
+        sensitivities = dict.fromkeys(items, 0.)
+        for result in details:
+            entity = Entity.ENTITIES.get(result["Moniker"])
+            if entity is None or not entity.priced_opex:
+                continue
+            consumed = [item for item in result["Consumption"] if item in sensitivities]
+            if len(consumed) == 0:
+                continue
+            # one row of yearly consumptions per item, over entity timeline as its Cost PV
+            volumes = np.array([result["Consumption"][item]["volume"].values for item in consumed])
+            for item, value in zip(consumed, Discounting.npv(volumes)):
+                sensitivities[item] += value
+        for item in items:
+            logger.info("Sensitivity to %s price: %f" % (item, sensitivities[item]))
+        return sensitivities
+
+    def compute_wacc_deltas(self, scenario, wacc_shifts, with_logistics=False):
+        """
+        Cost PV sensitivities to discount rate, volumes and cash flows of base scenario being kept
+        (granulation and logistics optimizations are not rerun with bumped rate)
+        :param scenario: scenario as list of monikers per layer
+        :param wacc_shifts: list of additive shifts of env.WACC
+        :param with_logistics: boolean
+        :return: dictionary {shift: delta}
+        """
+        _, details = self.simulate_base(scenario, with_logistics)
+        rates = [env.WACC] + [env.WACC + shift for shift in wacc_shifts]
+        costs_pv = RiskEngine.get_costs_pv_by_rate(details, rates)
+
+        deltas = {}
+        for shift, cost_pv in zip(wacc_shifts, costs_pv[1:]):
+            deltas[shift] = cost_pv - costs_pv[0]
+            logger.info("Shift WACC by %f: %f" % (shift, cost_pv))
+        return deltas
+
+    @staticmethod
+    def get_costs_pv_by_rate(details, rates):
+        """
+        Cost PV of a scenario for several discount rates: as Entity.compute_cost_pv, each entity is discounted from
+        the first year of its own timeline
+        :param details: list of detailed results of scenario entities
+        :param rates: list of discount rates
+        :return: np.array, one Cost PV per rate
+        """
+        # entities with timelines of the same length are discounted for all rates at once
+        cash_flows = {}
+        for result in details:
+            values = pd.Series(result["Opex"], dtype=float).add(pd.Series(result["Capex"], dtype=float),
+                                                                 fill_value=0).values
+            cash_flows.setdefault(len(values), []).append(values)
+        costs_pv = np.zeros(len(rates))
+        for rows in cash_flows.values():
+            costs_pv += Discounting.npv_by_rate(np.array(rows), rates).sum(axis=0)
+        return costs_pv
+
+    def build_cost_pv_model(self, scenario, items=None, with_logistics=False):
+        """
+        Cost PV of scenario as a linear function of raw materials prices, volumes of base scenario being kept
+        :param scenario: scenario as list of monikers per layer
+        :param items: list of raw materials, all raw materials if None
+        :param with_logistics: boolean
+        :return: couple (base Cost PV, CostPVModel)
+        """
+        items = list(self.dm.raw_materials["Item"].unique()) if items is None else items
+        result, details = self.simulate_base(scenario, with_logistics)
+        # prices of an item and tenor are summed as in entities opex merges
+        prices = self.dm.raw_materials.groupby(["Item", "Tenor"])["price"].sum()
+        priced_monikers = set(moniker for moniker, entity in Entity.ENTITIES.items() if entity.priced_opex)
+        return result["Cost PV"], CostPVModel(details, prices, items, priced_monikers)
+
+    def compute_price_grid(self, scenarios, shocks, items=None, with_logistics=False):
+        """
+        Cost PV of scenarios for relative shocks of raw materials prices, one item at a time, volumes of base
+        scenarios being kept: each scenario is simulated once, whole grid being one matrix product
+        :param scenarios: dictionary {scenario id: scenario as list of monikers per layer}
+        :param shocks: list of relative price shocks, e.g. [-0.2, -0.1, 0.1, 0.2]
+        :param items: list of raw materials, all raw materials if None
+        :param with_logistics: boolean
+        :return: Dataframe with columns Scenario, Item, Shock, Cost PV, Delta
+        """
+        items = list(self.dm.raw_materials["Item"].unique()) if items is None else items
+        # one row of multipliers per (item, shock)
+        grid = [(item, shock) for item in items for shock in shocks]
+        multipliers = np.ones((len(grid), len(items)))
+        for row, (item, shock) in enumerate(grid):
+            multipliers[row, items.index(item)] += shock
+
+        rows = []
+        for scenario_id, scenario in scenarios.items():
+            base, model = self.build_cost_pv_model(scenario, items, with_logistics)
+            costs_pv = model.evaluate(multipliers)
+            for (item, shock), cost_pv in zip(grid, costs_pv):
+                rows.append({"Scenario": scenario_id, "Item": item, "Shock": shock, "Cost PV": cost_pv,
+                             "Delta": cost_pv - base})
+        return pd.DataFrame(rows, columns=["Scenario", "Item", "Shock", "Cost PV", "Delta"])
+
+    def draw_risk_factors(self, items, draws, volatilities, wacc_volatility, correlation=None, seed=None):
+        """
+        Joint draws of raw materials prices multipliers (lognormal, mean 1) and discount rates (normal, mean env.WACC)
+        :param items: list of raw materials
+        :param draws: int, # of draws
+        :param volatilities: float, or dictionary {item: volatility}, missing items being kept at base price
+        :param wacc_volatility: float, standard deviation of discount rate, env.WACC being kept if 0
+        :param correlation: np.array, correlation matrix of items then discount rate, independent factors if None
+        :param seed: int, random seed
+        :return: couple (np.array (draws x items) of multipliers, np.array (draws) of rates or None)
+        """
+        sigmas = np.array([volatilities.get(item, 0.) if isinstance(volatilities, dict) else volatilities
+                           for item in items] + [wacc_volatility], dtype=float)
+        normals = np.random.RandomState(seed).standard_normal((draws, len(sigmas)))
+        if correlation is not None:
+            correlation = np.asarray(correlation, dtype=float)
+            if correlation.shape != (len(sigmas), len(sigmas)):
+                logger.error("Correlation matrix of shape %s, expected %d risk factors (items then WACC)" %
+                             (str(correlation.shape), len(sigmas)))
+                raise Exception("Correlation matrix does not match risk factors")
+            normals = normals.dot(np.linalg.cholesky(correlation).T)
+        multipliers = np.exp(sigmas[:-1] * normals[:, :-1] - sigmas[:-1] ** 2 / 2)
+        rates = env.WACC + wacc_volatility * normals[:, -1] if wacc_volatility > 0 else None
+        return multipliers, rates
+
+    def compute_cost_distributions(self, scenarios, draws=10000, volatilities=0.2, wacc_volatility=0.,
+                                   correlation=None, items=None, quantiles=(0.05, 0.5, 0.95), level=0.95,
+                                   seed=None, with_logistics=False):
+        """
+        Monte Carlo distributions of Cost PV over joint draws of raw materials prices and discount rate, volumes of base
+        scenarios being kept. Each scenario is simulated once; the same draws are evaluated for all scenarios
+        :param scenarios: dictionary {scenario id: scenario as list of monikers per layer}
+        :param draws: int, # of draws
+        :param volatilities: float, or dictionary {item: volatility} of lognormal price multipliers
+        :param wacc_volatility: float, standard deviation of discount rate
+        :param correlation: np.array, correlation matrix of items then discount rate, independent factors if None
+        :param items: list of raw materials, all raw materials if None
+        :param quantiles: list of quantile levels
+        :param level: float, confidence level of VaR and CVaR (mean of Cost PV above its VaR)
+        :param seed: int, random seed
+        :param with_logistics: boolean
+        :return: Dataframe, one row per scenario with columns Scenario, Base, Mean, Std, quantiles, VaR, CVaR
+        """
+        items = list(self.dm.raw_materials["Item"].unique()) if items is None else items
+        multipliers, rates = self.draw_risk_factors(items, draws, volatilities, wacc_volatility, correlation, seed)
+        rows = []
+        for scenario_id, scenario in scenarios.items():
+            base, model = self.build_cost_pv_model(scenario, items, with_logistics)
+            statistics = CostPVModel.get_statistics(model.evaluate(multipliers, rates), quantiles, level)
+            logger.info("Scenario %s: Cost PV mean %f, CVaR %f" % (scenario_id, statistics["Mean"],
+                                                                   statistics["CVaR"]))
+            rows.append(dict(Scenario=scenario_id, Base=base, **statistics))
+        return pd.DataFrame(rows)
@@ -11,12 +11,16 @@ class Broker:
     Class for distributing tasks among workers
     """
 
-    def __init__(self, queue_name):
+    def __init__(self, queue_name, confirm=False):
         """
         ctor
+        :param queue_name: string
+        :param confirm: boolean, publisher confirms: publish returns once broker has acknowledged messages
         """
         self.connection = pika.BlockingConnection(pika.ConnectionParameters(env.RABBITMQ_SERVER))
         self.channel = self.connection.channel()
+        if confirm:
+            self.channel.confirm_delivery()
         self.queue = queue_name
         self.channel.queue_declare(queue=self.queue, durable=True, arguments={'queue-mode': 'lazy'})
 
@@ -25,6 +29,7 @@ class Broker:
         Send tasks to workers
         :param data: list
         :param close_connection: boolean
+        :param head_data: boolean, binary messages whose content is not logged
         :return: None
         """
         for message in data:
@@ -36,9 +41,10 @@ class Broker:
                     delivery_mode=2
                 ))
             if head_data:
-                logger.info(" [x] Sent %r" % message[0:env.HEAD_DATA_BITS])
+                logger.debug(" [x] Sent %d bytes" % len(message))
             else:
-                logger.info(" [x] Sent %r" % message)
+                logger.debug(" [x] Sent %r" % message)
+        logger.info(" [x] Sent %d messages to %s" % (len(data), self.queue))
         if close_connection:
             self.close()
 
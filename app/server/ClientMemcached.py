@@ -63,5 +63,5 @@ def insert_history(phase, task_to_save, status, message):
     query_insert['time_end'] = datetime.datetime.now().strftime("%d/%m/%y %H:%M:%S")
     query_insert['db_name'] = task_to_save['db_name']
     query_insert['total_scenario'] = task_to_save['total_scenario']
-    db = DBAccess(env.MONITORING_DB_NAME)
+    db = DBAccess.get(env.MONITORING_DB_NAME)
     db.save_to_db_no_check(env.MONITORING_COLLECTION_HISTORY_NAME, query_insert)
\ No newline at end of file
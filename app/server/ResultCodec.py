@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import struct
+import zlib
+import numpy as np
+import pandas as pd
+import app.config.env as env
+from app.graph.Node import Node
+from app.tools.Logger import logger_results as logger
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class ResultCodec:
+    """
+    Binary envelope of messages of result queues:
+    MAGIC | version, payload codec, compression, header length (struct PREAMBLE) | json header | payload.
+    Header holds task id, db name and batch flag; payload holds data of a result, or list of data of several results
+    if batch, encoded with msgpack (pandas Series as typed float arrays) if installed, json otherwise, optionally zlib
+    compressed. Decoded documents are the same as with the former double json text messages, Series being
+    dictionaries {str(index): value}
+    """
+
+    MAGIC = b"M2FR"
+    VERSION = 1
+    PREAMBLE = struct.Struct(">BBBH")
+
+    JSON = 0
+    MSGPACK = 1
+
+    NO_COMPRESSION = 0
+    ZLIB = 1
+
+    SERIES_EXT = 1
+
+    @staticmethod
+    def is_envelope(body):
+        return body[:len(ResultCodec.MAGIC)] == ResultCodec.MAGIC
+
+    @staticmethod
+    def to_builtin(o):
+        """
+        Fallback of json and msgpack encoders
+        :param o: object
+        :return: encodable object
+        """
+        if isinstance(o, Node):
+            return o.moniker()
+        if isinstance(o, pd.Series):
+            return {str(k): v for k, v in o.to_dict().items()}
+        if isinstance(o, np.generic):
+            return o.item()
+        raise TypeError("Object of type %s is not serializable" % type(o).__name__)
+
+    @staticmethod
+    def pack_default(o):
+        """ msgpack fallback: numeric Series as (index, float64 bytes) extension """
+        if isinstance(o, pd.Series) and o.dtype.kind in "biuf":
+            index = [str(k) for k in o.index]
+            values = np.ascontiguousarray(o.values, dtype=">f8").tobytes()
+            return msgpack.ExtType(ResultCodec.SERIES_EXT, msgpack.packb([index, values], use_bin_type=True))
+        return ResultCodec.to_builtin(o)
+
+    @staticmethod
+    def str_keys(pairs):
+        """ msgpack map hook: keys as json would decode them, e.g. int years of BatchEvaluator results as strings """
+        return {key if isinstance(key, str) else str(key): value for key, value in pairs}
+
+    @staticmethod
+    def unpack_ext(code, data):
+        if code == ResultCodec.SERIES_EXT:
+            index, values = msgpack.unpackb(data, raw=False, strict_map_key=False)
+            return dict(zip(index, np.frombuffer(values, dtype=">f8").tolist()))
+        return msgpack.ExtType(code, data)
+
+    @staticmethod
+    def get_codec():
+        return ResultCodec.MSGPACK if msgpack is not None else ResultCodec.JSON
+
+    @staticmethod
+    def encode_item(data):
+        """
+        :param data: dictionary or list of dictionaries
+        :return: bytes, payload of data alone
+        """
+        if msgpack is not None:
+            return msgpack.packb(data, default=ResultCodec.pack_default, use_bin_type=True)
+        return json.dumps(data, default=ResultCodec.to_builtin).encode("utf-8")
+
+    @staticmethod
+    def frame(payload, header, compression=None):
+        """
+        :param payload: bytes, encoded with get_codec codec
+        :param header: dictionary
+        :param compression: boolean, env.RESULT_COMPRESSION if None
+        :return: bytes
+        """
+        compression = env.RESULT_COMPRESSION if compression is None else compression
+        if compression:
+            payload = zlib.compress(payload, 1)
+        header = json.dumps(header).encode("utf-8")
+        preamble = ResultCodec.PREAMBLE.pack(ResultCodec.VERSION, ResultCodec.get_codec(),
+                                             ResultCodec.ZLIB if compression else ResultCodec.NO_COMPRESSION,
+                                             len(header))
+        return b"".join([ResultCodec.MAGIC, preamble, header, payload])
+
+    @staticmethod
+    def encode(data, task_id, db_name, compression=None):
+        """
+        :param data: dictionary or list of dictionaries
+        :param task_id: int
+        :param db_name: string
+        :param compression: boolean, env.RESULT_COMPRESSION if None
+        :return: bytes
+        """
+        return ResultCodec.frame(ResultCodec.encode_item(data), {"task": task_id, "db": db_name}, compression)
+
+    @staticmethod
+    def encode_batch(items, task_id, db_name, compression=None):
+        """
+        Packs results already encoded by encode_item in one message, without encoding them again
+        :param items: list of bytes, as given by encode_item
+        :param task_id: int
+        :param db_name: string
+        :param compression: boolean, env.RESULT_COMPRESSION if None
+        :return: bytes, decoded as header with "batch" and list of data
+        """
+        if msgpack is not None:
+            payload = b"".join([msgpack.Packer().pack_array_header(len(items))] + items)
+        else:
+            payload = b"".join([b"[", b",".join(items), b"]"])
+        return ResultCodec.frame(payload, {"task": task_id, "db": db_name, "batch": True}, compression)
+
+    @staticmethod
+    def decode(body):
+        """
+        :param body: bytes, as given by encode
+        :return: couple (header dictionary, data)
+        """
+        if not ResultCodec.is_envelope(body):
+            logger.error("Result message is not an envelope")
+            raise Exception("Result message is not an envelope")
+        start = len(ResultCodec.MAGIC)
+        version, codec, compression, header_length = ResultCodec.PREAMBLE.unpack_from(body, start)
+        if version > ResultCodec.VERSION:
+            logger.error("Result envelope version %d is not handled" % version)
+            raise Exception("Result envelope version %d is not handled" % version)
+        start += ResultCodec.PREAMBLE.size
+        header = json.loads(body[start:start + header_length].decode("utf-8"))
+        payload = body[start + header_length:]
+        if compression == ResultCodec.ZLIB:
+            payload = zlib.decompress(payload)
+        if codec == ResultCodec.MSGPACK:
+            if msgpack is None:
+                logger.error("msgpack is required to decode results of task %s" % header.get("task"))
+                raise Exception("msgpack is required to decode results")
+            data = msgpack.unpackb(payload, ext_hook=ResultCodec.unpack_ext, raw=False, strict_map_key=False,
+                                   object_pairs_hook=ResultCodec.str_keys)
+        else:
+            data = json.loads(payload.decode("utf-8"))
+        return header, data
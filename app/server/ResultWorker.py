@@ -5,6 +5,8 @@ from app.model.Simulator import *
 from app.server.Worker import Worker
 from app.tools.Logger import logger_results as logger
 from app.data.DBAccess import DBAccess
+from app.server.ResultCodec import ResultCodec
+from app.data.ColumnarResults import ColumnarResults
 import json
 from datetime import datetime
 
@@ -14,9 +16,34 @@ class ResultWorker(Worker):
     Class for distributing tasks among result workers
     """
 
-    def __init__(self, queue_name, collection_name):
+    def __init__(self, queue_name, collection_name, prefetch=None, flush_size=None, flush_interval=None,
+                 columnar=None):
+        """
+        ctor
+        :param queue_name: string
+        :param collection_name: string
+        :param prefetch: int, # of unacknowledged messages delivered to worker, env.RABBITMQ_RESULT_PREFETCH if None
+        :param flush_size: int, # of buffered documents triggering a write, env.RABBITMQ_RESULT_FLUSH_SIZE if None
+        :param flush_interval: float, seconds before buffered documents are written, env.RABBITMQ_RESULT_FLUSH_INTERVAL
+        if None
+        :param columnar: boolean, detailed results saved as one columnar document per scenario in
+        env.DB_DETAILED_COLUMNAR_RESULT_COLLECTION_NAME; if None, True for detailed results queue with
+        env.DETAILED_RESULT_LAYOUT columnar
+        """
         super().__init__(queue_name)
-        self.collection_name = collection_name
+        if columnar is None:
+            columnar = queue_name == env.RABBITMQ_DETAILED_RESULT_QUEUE_NAME and \
+                env.DETAILED_RESULT_LAYOUT == env.DetailedResultLayout.COLUMNAR
+        self.columnar = columnar
+        self.collection_name = env.DB_DETAILED_COLUMNAR_RESULT_COLLECTION_NAME if columnar else collection_name
+        self.flush_size = env.RABBITMQ_RESULT_FLUSH_SIZE if flush_size is None else flush_size
+        self.flush_interval = env.RABBITMQ_RESULT_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        prefetch = env.RABBITMQ_RESULT_PREFETCH if prefetch is None else prefetch
+        self.prefetch = max(prefetch, self.flush_size)
+        self.documents = {}  # db name -> buffered documents
+        self.size = 0
+        self.last_delivery_tag = None
+        self.timer = None
 
     def consume(self):
         """
@@ -25,28 +52,93 @@ class ResultWorker(Worker):
         :return: None
         """
         logger.info(' [*] Waiting for messages. To exit press CTRL+C')
-        self.channel.basic_qos(prefetch_count=1) # send task to available worker
+        self.channel.basic_qos(prefetch_count=self.prefetch)
         self.channel.basic_consume(queue=self.queue, on_message_callback=self.save_results)
-        self.channel.start_consuming()
+        try:
+            self.channel.start_consuming()
+        finally:
+            if self.channel.is_open:
+                self.flush()
 
+    @staticmethod
+    def decode(body):
+        """
+        :param body: bytes, message published by ResultSaver, binary envelope or former text message
+        :return: couple (db name, list of documents)
+        """
+        if ResultCodec.is_envelope(body):
+            header, data = ResultCodec.decode(body)
+            db_name = header["db"]
+            results = data if header.get("batch", False) else [data]
+        else:
+            db_name, data = ResultWorker.decode_text(body)
+            results = [data]
+        documents = []
+        for data in results:
+            if isinstance(data, dict):
+                if "timestamp" not in data:
+                    data["timestamp"] = datetime.now()
+                documents.append(data)
+            else:
+                documents.extend(data)
+        return db_name, documents
+
+    @staticmethod
+    def decode_text(body):
+        """
+        :param body: bytes, fixed width task header, db name, '$' and double json encoded data
+        :return: couple (db name, data)
+        """
+        message = body[env.HEAD_DATA_BITS:]
+        message_db = str(body[env.HEAD_DATA_BITS:env.HEAD_DATA_BITS + env.DB_NAME_BITS], 'utf-8')
+        dol_index = message_db.find("$")
+        db_name = message_db[0:dol_index]
+        return db_name, json.loads(json.loads(message[dol_index + 1:]))
 
     def save_results(self, ch, method, properties, body):
         """
-        Callback function called for each task
+        Callback function called for each task: decoded documents are buffered, and written once flush size is reached
+        or flush interval is elapsed. Messages are acknowledged after their documents are written
         :param ch:
         :param method:
         :param properties:
         :param body:
         :return: None
         """
-        logger.info(" [*] Saving results %r" % body[0:env.HEAD_DATA_BITS])
-        message = body[env.HEAD_DATA_BITS:]
-        message_db = str(body[env.HEAD_DATA_BITS:env.HEAD_DATA_BITS + env.DB_NAME_BITS], 'utf-8')
-        dol_index = message_db.find("$")
-        db_name = message_db[0:dol_index]
-        data = json.loads(json.loads(message[dol_index + 1:]))
-        if isinstance(data, dict) and "timestamp" not in data:
-            data["timestamp"] = datetime.now()
-        DBAccess('%s_results' % db_name).save_to_db_no_check(self.collection_name, data)
-        logger.info(" [x] Done")
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        logger.debug(" [*] Buffering results %r" % body[0:env.HEAD_DATA_BITS])
+        db_name, documents = ResultWorker.decode(body)
+        if self.columnar:
+            # results of a scenario are never split among messages
+            documents = ColumnarResults.to_documents(documents)
+        self.documents.setdefault(db_name, []).extend(documents)
+        self.size += len(documents)
+        self.last_delivery_tag = method.delivery_tag
+        if self.size >= self.flush_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.connection.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """
+        Writes buffered documents with one unordered bulk insert per database, then acknowledges all pending messages
+        at once. On failure, pending messages are requeued, so that documents are saved at least once
+        :return: None
+        """
+        if self.timer is not None:
+            self.connection.remove_timeout(self.timer)
+            self.timer = None
+        if self.last_delivery_tag is None:
+            return
+        try:
+            for db_name, documents in self.documents.items():
+                DBAccess.get('%s_results' % db_name, env.DB_RESULT_WRITE_CONCERN).save_many_unordered(
+                    self.collection_name, documents)
+            self.channel.basic_ack(delivery_tag=self.last_delivery_tag, multiple=True)
+            logger.info(" [x] %d results saved" % self.size)
+        except Exception as e:
+            logger.error(" [x] %d results not saved, messages requeued: %s" % (self.size, e))
+            self.channel.basic_nack(delivery_tag=self.last_delivery_tag, multiple=True, requeue=True)
+        finally:
+            self.documents = {}
+            self.size = 0
+            self.last_delivery_tag = None
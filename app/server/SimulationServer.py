@@ -5,6 +5,7 @@ import app.config.env as env
 from app.server.Broker import Broker
 import json
 from app.data.DBAccess import DBAccess
+from app.model.Simulator import Simulator
 import pymongo
 
 
@@ -13,16 +14,22 @@ class SimulationServer:
     Class for sending tasks
     """
 
-    def serve(self, cycle):
+    def serve(self, cycle, chunks=None):
         """
         Crating tasks and sending to broker
         :param cycle:
+        :param chunks: int, number of tasks per phase with contiguous partitioning, env.SIMULATION_CHUNKS_PER_PHASE if None
         :return:
         """
+        if chunks is None:
+            chunks = env.SIMULATION_CHUNKS_PER_PHASE
+        if env.SIMULATION_PARTITIONING != env.SimulationPartitioning.CONTIGUOUS:
+            chunks = 1
         # reset scenarios table
         db = DBAccess(env.DB_RESULT_NAME)
         db.clear_collection(env.DB_GLOBAL_RESULT_COLLECTION_NAME)
         db.clear_collection(env.DB_DETAILED_RESULT_COLLECTION_NAME)
+        db.clear_collection(env.DB_DETAILED_COLUMNAR_RESULT_COLLECTION_NAME)
         db.clear_collection(env.DB_SENSITIVITY_COLLECTION_NAME)
         db.create_index(
             env.DB_GLOBAL_RESULT_COLLECTION_NAME,
@@ -32,17 +39,27 @@ class SimulationServer:
             env.DB_DETAILED_RESULT_COLLECTION_NAME,
             [("Scenario", pymongo.ASCENDING)]
         )
+        db.create_index(
+            env.DB_DETAILED_COLUMNAR_RESULT_COLLECTION_NAME,
+            [("Scenario", pymongo.ASCENDING)]
+        )
         db.save_to_db_no_check(env.DB_SENSITIVITY_COLLECTION_NAME, {"NH3": 0, "ACS": 0, "HCl": 0, "Raw water": 0,
                                                                     "Electricity": 0, "K09": 0, "Rock": 0,
                                                                     "Scenario": -1})
 
+        # first chunks of all phases are queued first, idle workers then take over remaining chunks
         data = []
-        for i in range(cycle):
-            data.append(json.dumps({
-                "cycle": cycle,
-                "phase": i,
-                "db_name": env.DB_NAME,
-                "logistics_lp": env.LOGISTICS_LP
-            }))
+        for chunk in range(chunks):
+            for i in range(cycle):
+                data.append(json.dumps({
+                    "cycle": cycle,
+                    "phase": i,
+                    "chunk": chunk,
+                    "chunks": chunks,
+                    "partitioning": int(env.SIMULATION_PARTITIONING),
+                    "db_name": env.DB_NAME,
+                    "logistics_lp": env.LOGISTICS_LP
+                }))
+        Simulator.reset_progress(cycle, chunks)
         broker = Broker(env.RABBITMQ_SIMULATOR_QUEUE_NAME)
         broker.publish(data)
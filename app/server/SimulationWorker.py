@@ -3,10 +3,14 @@
 
 from app.config.env_func import reset_db_name
 from app.model.Simulator import *
+from app.model.ResultPublisher import ResultPublisher
 import json
+import queue
+import threading
+import time
 from app.server.Worker import Worker
 from app.server.Broker import Broker
-from app.graph.Node import NodeJSONEncoder
+from app.server.ResultCodec import ResultCodec
 from app.tools.Logger import logger_simulation as logger
 
 
@@ -44,21 +48,25 @@ class SimulationWorker(Worker):
 
         cycle = data["cycle"]
         phase = data["phase"]
+        chunk = data.get("chunk", 0)
+        chunks = data.get("chunks", 1)
+        partitioning = env.SimulationPartitioning(data.get("partitioning", env.SimulationPartitioning.STRIDED))
         time_start = datetime.datetime.now().strftime("%d/%m/%y %H:%M:%S")
         if "db_name" in data:
             reset_db_name(data['db_name'])
         if "logistics_lp" in data:
             env.LOGISTICS_LP = data["logistics_lp"]
-        detailed_publisher = ResultSaver(env.RABBITMQ_DETAILED_RESULT_QUEUE_NAME, env.RESULT_BATCHES_SIZE)
-        global_publisher = ResultSaver(env.RABBITMQ_GLOBAL_RESULT_QUEUE_NAME, env.RESULT_BATCHES_SIZE)
-
+        publishers = {}
+        s = None
         try:
+            publishers["details"] = ResultSaver(env.RABBITMQ_DETAILED_RESULT_QUEUE_NAME, env.RESULT_BATCHES_SIZE)
+            publishers["global"] = ResultSaver(env.RABBITMQ_GLOBAL_RESULT_QUEUE_NAME, env.RESULT_BATCHES_SIZE)
             s = Simulator()
-            s.simulate(cycle, phase, {"details": detailed_publisher, "global": global_publisher}, monitor=True,
-                       logistics_lp=env.LOGISTICS_LP)
+            s.simulate(cycle, phase, publishers, monitor=True,
+                       logistics_lp=env.LOGISTICS_LP, partitioning=partitioning, chunk=chunk, chunks=chunks)
 
-            detailed_publisher.close()
-            global_publisher.close()
+            publishers["details"].close()
+            publishers["global"].close()
             logger.info(" [x] Done")
         except Exception as e:
             task_to_save = dict()
@@ -68,33 +76,136 @@ class SimulationWorker(Worker):
             message = "Worker failed: %s" % (str(e))
             logger.warning("Worker failed: %s" % (str(e)))
             insert_history(phase=phase, task_to_save=task_to_save, status=env.HTML_STATUS.ERROR.value, message=message)
-            global_publisher.close()
-            detailed_publisher.close()
+            if s is None:
+                # chunk not started, simulate ends started chunks
+                try:
+                    Simulator.end_chunk(Simulator.get_work_infos(phase, chunk), phase, chunk, chunks, 0, failed=True)
+                except Exception as e:
+                    logger.warning("End of phase %d, chunk %d not reported: %s" % (phase, chunk, e))
+            # savers built before the failure
+            for publisher in publishers.values():
+                publisher.close(check=False)
             logger.info(" [x] Done with error")
         ch.basic_ack(delivery_tag=method.delivery_tag)
 
 
-class ResultSaver:
+class ResultSaver(ResultPublisher):
     """
-    Helper class for saving results
+    Helper class for saving results: results are encoded by caller, then packed and published by a background thread
+    owning the broker connection, so that simulation never waits for broker. A message carries up to db_batch_size
+    results and batch_bytes bytes, and is sent at the latest linger seconds after its first result. The channel is in
+    confirm mode: close returns once all messages are acknowledged by broker
     """
 
-    def __init__(self, queue_name, db_batch_size):
-        self.broker = Broker(queue_name)
-        self.db_batch_size = db_batch_size
-        self.datas = []
-        self.counter = 0
+    MAX_PENDING = 10000  # results waiting for publisher thread before save blocks
+    CLOSE = None
 
+    def __init__(self, queue_name, db_batch_size, batch_bytes=None, linger=None):
+        """
+        ctor
+        :param queue_name: string
+        :param db_batch_size: int, maximum # of results per message
+        :param batch_bytes: int, maximum size of message before compression, env.RESULT_BATCH_BYTES if None
+        :param linger: float, maximum seconds a result waits for its message to be filled, env.RESULT_LINGER if None
+        """
+        self.queue_name = queue_name
+        self.db_batch_size = max(db_batch_size, 1)
+        self.batch_bytes = env.RESULT_BATCH_BYTES if batch_bytes is None else batch_bytes
+        self.linger = env.RESULT_LINGER if linger is None else linger
+        self.db_name = env.DB_NAME
+        self.pending = queue.Queue(ResultSaver.MAX_PENDING)
+        self.error = None
+        self.closed = False
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="ResultSaver-%s" % queue_name, daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None:
+            logger.error("Result publisher of %s not started: %s" % (queue_name, self.error))
+            raise Exception("Result publisher of %s not started: %s" % (queue_name, self.error))
 
     def save(self, data, task_id):
-        self.counter += 1
-        head_data = ("TASK {0:0" + str(env.HEAD_DATA_BITS - 5) + "d}").format(task_id)
-        json_data = ''.join([head_data, env.DB_NAME, "$", json.dumps(NodeJSONEncoder().encode(data))])
-        self.datas.append(json_data)
-        if self.counter == self.db_batch_size or len(self.datas) <= self.db_batch_size:
-            self.counter = 0
-            self.broker.publish(self.datas, False, True)
-            self.datas.clear()
-
-    def close(self):
-        self.broker.close()
+        """
+        :param data: dictionary or list of dictionaries
+        :param task_id: int, scenario id
+        :return: None
+        """
+        if self.error is not None:
+            logger.error("Results of %s not published: %s" % (self.queue_name, self.error))
+            raise Exception("Results of %s not published: %s" % (self.queue_name, self.error))
+        self.pending.put((task_id, ResultCodec.encode_item(data)))
+
+    def run(self):
+        """
+        Publisher thread: packs pending results in messages and publishes them until close
+        :return: None
+        """
+        try:
+            broker = Broker(self.queue_name, confirm=True)
+        except Exception as e:
+            self.error = e
+            self.started.set()
+            return
+        self.started.set()
+        batch, size, task_id, deadline = [], 0, None, None
+        closing = False
+        try:
+            while True:
+                try:
+                    timeout = 1. if deadline is None else min(max(deadline - time.time(), 0.), 1.)
+                    item = self.pending.get(timeout=timeout)
+                except queue.Empty:
+                    if deadline is not None and time.time() >= deadline:
+                        self.publish(broker, batch, task_id)
+                        batch, size, task_id, deadline = [], 0, None, None
+                    # heartbeats
+                    broker.connection.process_data_events(0)
+                    continue
+                if item is ResultSaver.CLOSE:
+                    closing = True
+                    self.publish(broker, batch, task_id)
+                    break
+                if len(batch) > 0 and size + len(item[1]) > self.batch_bytes:
+                    self.publish(broker, batch, task_id)
+                    batch, size, task_id, deadline = [], 0, None, None
+                if len(batch) == 0:
+                    task_id, deadline = item[0], time.time() + self.linger
+                batch.append(item[1])
+                size += len(item[1])
+                if len(batch) >= self.db_batch_size or size >= self.batch_bytes or time.time() >= deadline:
+                    self.publish(broker, batch, task_id)
+                    batch, size, task_id, deadline = [], 0, None, None
+        except Exception as e:
+            self.error = e
+            # unblock save until close, unless close is already consumed
+            while not closing and self.pending.get() is not ResultSaver.CLOSE:
+                pass
+        finally:
+            try:
+                broker.close()
+            except Exception as e:
+                logger.warning("Result publisher of %s: %s" % (self.queue_name, e))
+
+    def publish(self, broker, batch, task_id):
+        """
+        :param broker: Broker, in confirm mode
+        :param batch: list of results encoded by ResultCodec.encode_item
+        :param task_id: int, first scenario id of batch
+        :return: None
+        """
+        if len(batch) > 0:
+            broker.publish([ResultCodec.encode_batch(batch, task_id, self.db_name)], False, True)
+
+    def close(self, check=True):
+        """
+        Publishes remaining results and waits for broker acknowledgements
+        :param check: boolean, raise if some results were not published
+        :return: None
+        """
+        if not self.closed:
+            self.closed = True
+            self.pending.put(ResultSaver.CLOSE)
+            self.thread.join()
+            if check and self.error is not None:
+                logger.error("Results of %s not published: %s" % (self.queue_name, self.error))
+                raise Exception("Results of %s not published: %s" % (self.queue_name, self.error))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+
+from functools import lru_cache
+import numpy as np
+import app.config.env as env
+
+
+@lru_cache(maxsize=64)
+def compounding_factors(rate, periods):
+    """
+    :param rate: float, discount rate
+    :param periods: int, number of periods
+    :return: read-only np.array [(1 + rate) ** t for t in 0..periods-1]
+    """
+    factors = (1 + rate) ** np.arange(0, periods)
+    factors.flags.writeable = False
+    return factors
+
+
+@lru_cache(maxsize=64)
+def discount_factors(rate, periods):
+    """
+    :param rate: float, discount rate
+    :param periods: int, number of periods
+    :return: read-only np.array [(1 + rate) ** -t for t in 0..periods-1]
+    """
+    factors = 1. / compounding_factors(rate, periods)
+    factors.flags.writeable = False
+    return factors
+
+
+def npv(cash_flows, rate=None):
+    """
+    Net present value, first period not discounted, same results as numpy.npv
+    :param cash_flows: yearly cash flows (list, pd.Series or np.array), or np.array of rows of cash flows
+    :param rate: float, env.WACC if None
+    :return: float, or np.array with one npv per row
+    """
+    rate = env.WACC if rate is None else rate
+    values = np.asarray(cash_flows, dtype=float)
+    return (values / compounding_factors(rate, values.shape[-1])).sum(axis=-1)
+
+
+def npv_by_rate(cash_flows, rates):
+    """
+    Net present values of rows of cash flows for several discount rates, as a single matrix product
+    :param cash_flows: np.array (rows x periods)
+    :param rates: list of discount rates
+    :return: np.array (rows x rates)
+    """
+    values = np.atleast_2d(np.asarray(cash_flows, dtype=float))
+    factors = np.array([discount_factors(rate, values.shape[-1]) for rate in rates]).T
+    return values.dot(factors)
@@ -8,6 +8,7 @@ import subprocess
 from app.data.Service import DATA_SERVICE
 from app.server.ClientMemcached import memcached_client, update_cache
 from app.server.SimulationWorker import SimulationWorker, logger, datetime
+from app.model.Simulator import Simulator
 from pymemcache.client import base
 from app.server.ResultWorker import ResultWorker
 import app.config.env as env
@@ -198,3 +199,29 @@ def init_all_phase():
         }
         update_cache("workers_info_%i" % phase, infos)
     return env.HTML_STATUS.OK.value
+
+
+def get_workers_info(phase):
+    """
+    Progress of a phase, aggregated over its chunks run by concurrent workers
+    :param phase: Int
+    :return: Dict or None
+    """
+    chunks = env.SIMULATION_CHUNKS_PER_PHASE \
+        if env.SIMULATION_PARTITIONING == env.SimulationPartitioning.CONTIGUOUS else 1
+    infos = []
+    for chunk in range(chunks):
+        chunk_infos = memcached_client.get(Simulator.get_progress_key(phase, chunk))
+        if chunk_infos:
+            infos.append(chunk_infos[str(phase)])
+    if len(infos) == 0:
+        # no chunk started yet
+        phase_infos = memcached_client.get("workers_info_%i" % phase)
+        return phase_infos[str(phase)] if phase_infos else None
+    phase_total = int(infos[0]["phase_total"])
+    done = sum(int(info.get("done", 0)) for info in infos)
+    workers_info = dict(infos[0])
+    workers_info["total_scenario"] = str(phase_total)
+    workers_info["counter"] = str(done)
+    workers_info["progress"] = str(round(int(done * 100 / max(phase_total, 1)), 2))
+    return workers_info
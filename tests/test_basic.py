@@ -2,18 +2,25 @@
 
 
 import unittest
+import numpy as np
 import pandas as pd
 import time
+from types import SimpleNamespace
 
 from app.config import env
 from app.config.env import ScenarioGeneratorType, PipelineLayer
 from app.config.env_func import reset_db_name
 from app.data.Client import Driver
 from app.data.DataManager import DataManager
+from app.data.ParquetResultSink import ParquetResultSink, pyarrow
 from app.model.Simulator import Simulator
 from app.risk.RiskEngine import RiskEngine
+from app.server import ResultCodec as result_codec
+from app.server.ResultCodec import ResultCodec
 from app.tools import Utils
-from app.model.ScenarioGenerator import ScenarioGeneratorFactory as SGF
+from app.tools.Logger import logger_simulation as logger
+from app.model.ScenarioGenerator import ScenarioGeneratorFactory as SGF, ScenarioGeneratorFromOption
+from app.model.ScenarioSpace import ScenarioSpace
 
 
 reset_db_name("mine2farm")
@@ -29,14 +36,41 @@ class PricingTestSuite(unittest.TestCase):
         self.scenarios_dic = Utils.get_scenario_from_df(scenarios_df)
         scenario_id = 1
         self.simulator = Simulator(dm=dm, monikers_filter=sum(self.scenarios_dic[scenario_id], []))
-        scenarios = [
+        self.scenarios = [
             self.simulator.nodes[layer] for layer in [
                 PipelineLayer.PAP, PipelineLayer.SAP,
                 PipelineLayer.BENEFICIATION, PipelineLayer.MINE, PipelineLayer.MINE_BENEFICIATION
             ] if layer in self.simulator.nodes
         ]
         self.scenario_generator = SGF.create_scenario_generator(ScenarioGeneratorType.SPECIFIC_SCENARIOS,
-                                                                self.simulator, [scenarios])
+                                                                self.simulator, [self.scenarios])
+
+    def assert_same_value(self, value, batch_value):
+        if isinstance(value, float):
+            self.assertTrue(isinstance(batch_value, float))
+            self.assertTrue(abs(value - batch_value) <= 1e-6 * max(abs(value), 1.))
+            return
+        self.assertTrue(type(value) == type(batch_value))
+        if isinstance(value, pd.Series):
+            self.assertTrue(list(value.index) == list(batch_value.index))
+            self.assertTrue(np.allclose(value.values.astype(float), batch_value.values.astype(float)))
+        elif isinstance(value, dict):
+            self.assertTrue(set(value) == set(batch_value))
+            for key in value:
+                self.assert_same_value(value[key], batch_value[key])
+        else:
+            self.assertTrue(value == batch_value)
+
+
+    def assert_same_details(self, details, batch_details):
+        self.assertTrue(set(details) == set(batch_details))
+        for scenario_id in details:
+            results = {result["Moniker"]: result for result in details[scenario_id]}
+            batch_results = {result["Moniker"]: result for result in batch_details[scenario_id]}
+            self.assertTrue(set(results) == set(batch_results))
+            for moniker in results:
+                self.assert_same_value(results[moniker], batch_results[moniker])
+
 
     def test_pricing(self):
         result, _ = self.simulator.simulate(scenario_generator=self.scenario_generator)
@@ -56,6 +90,28 @@ class PricingTestSuite(unittest.TestCase):
         self.assertTrue(delta < 10)
 
 
+    def test_batch_pricing(self):
+        result, batch_details = self.simulator.simulate(scenario_generator=self.scenario_generator, batch_size=1)
+        self.assertTrue(result[1]["Cost PV"] == 12057687291.92442)
+        _, details = self.simulator.simulate(scenario_generator=self.scenario_generator, batch_size=0)
+        self.assert_same_details(details, batch_details)
+
+
+    def test_batch_timing(self):
+        scenario_generator = SGF.create_scenario_generator(ScenarioGeneratorType.SPECIFIC_SCENARIOS,
+                                                           self.simulator, [self.scenarios] * 100)
+        start = time.process_time()
+        result, details = self.simulator.simulate(scenario_generator=scenario_generator, batch_size=0)
+        delta = time.process_time() - start
+        start = time.process_time()
+        batch_result, batch_details = self.simulator.simulate(scenario_generator=scenario_generator, batch_size=100)
+        batch_delta = time.process_time() - start
+        logger.info("100 scenarios: %.3fs one by one, %.3fs batched (x%.1f)" %
+                    (delta, batch_delta, delta / max(batch_delta, 1e-9)))
+        self.assertTrue(all(result[i]["Cost PV"] == batch_result[i]["Cost PV"] for i in result))
+        self.assert_same_details(details, batch_details)
+
+
     def test_sensitivity(self):
         raw_materials_df = Driver().get_data("raw_materials")
         shocks = {}
@@ -77,5 +133,181 @@ class PricingTestSuite(unittest.TestCase):
         self.assertTrue(deltas == expected_res)
 
 
+    def test_analytic_sensitivity(self):
+        raw_materials_df = Driver().get_data("raw_materials")
+        shocks = {}
+        for raw_material in raw_materials_df:
+            item = raw_material["Item"]
+            shocks[item] = 1
+        scenario_id = 1
+        risk_engine = RiskEngine()
+        deltas = risk_engine.compute_delta(self.scenarios_dic[scenario_id], shocks)
+        analytic_deltas = risk_engine.compute_delta(self.scenarios_dic[scenario_id], shocks, analytic=True)
+        self.assertTrue(set(deltas) == set(analytic_deltas))
+        for item in deltas:
+            self.assertTrue(abs(analytic_deltas[item] - deltas[item]) <= max(1e-2 * abs(deltas[item]), 1.))
+
+
+    def test_batch_analytic_sensitivity(self):
+        batch_size = env.SIMULATION_BATCH_SIZE
+        env.SIMULATION_BATCH_SIZE = 10
+        try:
+            self.test_analytic_sensitivity()
+        finally:
+            env.SIMULATION_BATCH_SIZE = batch_size
+
+
+    def test_wacc_sensitivity(self):
+        scenario_id = 1
+        risk_engine = RiskEngine()
+        deltas = risk_engine.compute_wacc_deltas(self.scenarios_dic[scenario_id], [0., 0.01])
+        self.assertTrue(abs(deltas[0.]) < 1e-3)
+        self.assertTrue(deltas[0.01] < 0)
+        result, details = risk_engine.simulate_base(self.scenarios_dic[scenario_id])
+        cost_pv = RiskEngine.get_costs_pv_by_rate(details, [env.WACC])[0]
+        self.assertTrue(abs(cost_pv - result["Cost PV"]) <= 1e-6 * abs(result["Cost PV"]))
+
+
+    def test_cost_distributions(self):
+        scenario_id = 1
+        risk_engine = RiskEngine()
+        scenarios = {scenario_id: self.scenarios_dic[scenario_id]}
+        grid = risk_engine.compute_price_grid(scenarios, [0., 0.1])
+        self.assertTrue((grid[grid["Shock"] == 0.]["Delta"].abs() < 1e-3).all())
+        distributions = risk_engine.compute_cost_distributions(scenarios, draws=1000, volatilities=0.2, seed=0)
+        self.assertTrue(distributions.loc[0, "CVaR"] >= distributions.loc[0, "VaR"] >= distributions.loc[0, "Q50"])
+
+
+    def test_batch_cost_distributions(self):
+        batch_size = env.SIMULATION_BATCH_SIZE
+        env.SIMULATION_BATCH_SIZE = 10
+        try:
+            self.test_cost_distributions()
+        finally:
+            env.SIMULATION_BATCH_SIZE = batch_size
+
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_parquet_sink(self):
+        sink_folder = env.APP_FOLDER + "tests/outputs/results/"
+        result, _ = self.simulator.simulate(scenario_generator=self.scenario_generator, sink_folder=sink_folder)
+        self.assertTrue(len(result) == 0)
+        scenarios_df = ParquetResultSink.read_global(sink_folder)
+        self.assertTrue(scenarios_df.loc[0, "Cost PV"] == 12057687291.92442)
+        details = list(ParquetResultSink.iter_details(sink_folder, [1]))
+        self.assertTrue(len(details) > 0 and all(detail["Scenario"] == 1 for detail in details))
+
+
+    def test_sink_folder_opt_in(self):
+        sink_folder = env.RESULT_SINK_FOLDER
+        env.RESULT_SINK_FOLDER = env.APP_FOLDER + "tests/outputs/results/"
+        try:
+            scenario_id = 1
+            risk_engine = RiskEngine()
+            deltas = risk_engine.compute_wacc_deltas(self.scenarios_dic[scenario_id], [0.])
+            self.assertTrue(abs(deltas[0.]) < 1e-3)
+            result, _ = self.simulator.simulate(scenario_generator=self.scenario_generator)
+            self.assertTrue(result[1]["Cost PV"] == 12057687291.92442)
+        finally:
+            env.RESULT_SINK_FOLDER = sink_folder
+
+
+    def test_snapshot(self):
+        snapshot_dm = DataManager()
+        snapshot_dm.raw_materials = pd.DataFrame({"Item": ["Rock", "ACS"], "Unit": ["t", "t"], "2020": [10., 20.]})
+        snapshot_dm.sales_plan = pd.DataFrame({"Product": ["DAP"], "2020": [1.5]})
+        snapshot_dm.data = {PipelineLayer.PAP: {"Opex": pd.DataFrame({"Moniker": ["PAP/1"], "Cost": [3.]}),
+                                                "Options": {"Product": ["ACP 29"]}}}
+        folder = env.APP_FOLDER + "tests/outputs/snapshot/"
+        version = snapshot_dm.save_snapshot(folder)
+        loaded_dm = DataManager()
+        self.assertTrue(loaded_dm.load_snapshot("latest", folder, verify=True) == version)
+        pd.testing.assert_frame_equal(loaded_dm.raw_materials, snapshot_dm.raw_materials)
+        pd.testing.assert_frame_equal(loaded_dm.sales_plan, snapshot_dm.sales_plan)
+        pd.testing.assert_frame_equal(loaded_dm.data[PipelineLayer.PAP]["Opex"],
+                                      snapshot_dm.data[PipelineLayer.PAP]["Opex"])
+        self.assertTrue(loaded_dm.data[PipelineLayer.PAP]["Options"] == {"Product": ["ACP 29"]})
+
+
+
+    def assert_codec_round_trip(self):
+        data = {"Moniker": "PAP/1", "Cost PV": 1.5, "Capex": pd.Series([1., 2.5], index=[2020, 2021]),
+                "Volume": {2020: 3., 2021: 4.}}
+        expected = {"Moniker": "PAP/1", "Cost PV": 1.5, "Capex": {"2020": 1., "2021": 2.5},
+                    "Volume": {"2020": 3., "2021": 4.}}
+        for compression in [False, True]:
+            items = [ResultCodec.encode_item([data]), ResultCodec.encode_item([data, data])]
+            header, batch = ResultCodec.decode(ResultCodec.encode_batch(items, 1, "mine2farm", compression))
+            self.assertTrue(header == {"task": 1, "db": "mine2farm", "batch": True})
+            self.assertTrue(batch == [[expected], [expected, expected]])
+            header, result = ResultCodec.decode(ResultCodec.encode(data, 2, "mine2farm", compression))
+            self.assertTrue(header == {"task": 2, "db": "mine2farm"} and result == expected)
+
+
+    @unittest.skipIf(result_codec.msgpack is None, "msgpack is not installed")
+    def test_msgpack_codec(self):
+        self.assert_codec_round_trip()
+
+
+    def test_json_codec(self):
+        msgpack = result_codec.msgpack
+        result_codec.msgpack = None
+        try:
+            self.assert_codec_round_trip()
+        finally:
+            result_codec.msgpack = msgpack
+
+
+    def test_codec_rejection(self):
+        body = ResultCodec.encode({"Cost PV": 1.5}, 1, "mine2farm")
+        self.assertFalse(ResultCodec.is_envelope(b"XXXX" + body[len(ResultCodec.MAGIC):]))
+        with self.assertRaises(Exception):
+            ResultCodec.decode(b"XXXX" + body[len(ResultCodec.MAGIC):])
+        start = len(ResultCodec.MAGIC)
+        with self.assertRaises(Exception):
+            ResultCodec.decode(body[:start] + bytes([ResultCodec.VERSION + 1]) + body[start + 1:])
+
+
+
+    @staticmethod
+    def create_layers():
+        def node(moniker, layer, location, associated_pap=np.nan):
+            entity = SimpleNamespace(layer=layer, location=location, associated_pap=associated_pap)
+            return SimpleNamespace(entity=entity, moniker=lambda: moniker)
+
+        saps = [[node("SAP/A", PipelineLayer.SAP, "A")],
+                [node("SAP/B", PipelineLayer.SAP, "B", "PAP/B2")],
+                [node("SAP/A2", PipelineLayer.SAP, "A", "PAP/X")]]
+        paps = [[node("PAP/A1", PipelineLayer.PAP, "A")],
+                [node("PAP/B1", PipelineLayer.PAP, "B")],
+                [node("PAP/B2", PipelineLayer.PAP, "B")]]
+        threads = [[node("MINE/%d" % i, PipelineLayer.MINE, "A")] for i in range(3)]
+        return {layer: SimpleNamespace(shuffle=lambda combinations=combinations: combinations) for layer, combinations in
+                [(PipelineLayer.SAP, saps), (PipelineLayer.PAP, paps), (PipelineLayer.MINE_BENEFICIATION, threads)]}
+
+
+    def test_scenario_ranking(self):
+        layers = PricingTestSuite.create_layers()
+        eager = ScenarioGeneratorFromOption(layers, lazy=False)
+        lazy = ScenarioGeneratorFromOption(layers, lazy=True)
+        # (SAP/A, PAP/A1) and (SAP/B, PAP/B2) are the only valid couples
+        self.assertTrue(lazy.len() == eager.len() == 6)
+        self.assertTrue(list(lazy.generate()) == eager.generate())
+        self.assertTrue([lazy[index] for index in range(lazy.len())] == eager.generate())
+        for index in range(lazy.len()):
+            self.assertTrue(lazy.rank(*lazy.unrank(index)) == index)
+        for sap, pap in [(0, 0), (1, 2)]:
+            for thread in range(3):
+                self.assertTrue(lazy.unrank(lazy.rank(sap, pap, thread)) == (sap, pap, thread))
+        for sap, pap in [(0, 1), (1, 0), (2, 0)]:
+            with self.assertRaises(Exception):
+                lazy.rank(sap, pap, 0)
+        scenario_space = ScenarioSpace(["couple 1", "couple 2"], lazy.generate())
+        for scenario_id in range(1, scenario_space.size + 1):
+            self.assertTrue(scenario_space.get_id(scenario_space.get_choices(scenario_id)) == scenario_id)
+        with self.assertRaises(Exception):
+            scenario_space.unrank(scenario_space.size + 1)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file